@@ -0,0 +1,295 @@
+import pickle
+import tempfile
+import construction as con
+import instrument
+import utility
+import validate
+import networkx     as nx
+import numpy        as np
+import pandas       as pd
+from   pathlib      import Path
+from   networkx     import Graph
+from   typing       import List, Dict, Tuple, Iterator
+
+'''
+Out-of-core time aggregation: counterparts of construction.time_aggregate_movement_graph and
+time_aggregate_admin_population_graph for timeframes whose graphs do not fit into memory (e.g. months of tile data).
+Source files are streamed one at a time (one time step each, read ahead in the background) and combined into partial
+sums held in hash partitions of the node/edge keys. If the partial sums exceed <memory_limit>, the largest partition is
+spilled to a temporary file; later rows of a spilled partition are appended to its file and folded in when the result
+is built, one partition at a time. Sums are added in file order and attributes are taken from the first file holding a
+node/edge (within a file the last row wins), as in the graph aggregators, so results are identical to them.
+
+Usage:
+    nodes, edges = aggregate.time_aggregate_movement(files, 'movement', memory_limit=2 << 30)
+    graph        = aggregate.to_graph(nodes, edges)      # == construction.time_aggregate_movement_graph(graphs)
+    for nodes in aggregate.time_aggregate_population(files, 'admin_population', slice=3):
+        graph    = aggregate.to_graph(nodes)             # == construction.time_aggregate_admin_population_graph(graphs)[i]
+'''
+
+MEMORY_LIMIT = 1 << 30
+
+# Kind: (columns read, node key columns, node attributes, name of the file graph property)
+MOVEMENT_KINDS   = {
+    'movement':         (con.MOVEMENT_COLUMNS,         ['quadkey'],    ['lat', 'lon', 'polygon_id', 'polygon_name'], 'mov_file'),
+    'admin_movement':   (con.ADMIN_MOVEMENT_COLUMNS,   ['lat', 'lon'], ['polygon_id', 'polygon_name'],               'mov_admin_file'),
+}
+POPULATION_KINDS = {
+    'population':       (con.POPULATION_COLUMNS,       ['quadkey'],    ['lat', 'lon', 'country'],                    'pop_file'),
+    'admin_population': (con.ADMIN_POPULATION_COLUMNS, ['lat', 'lon'], ['country', 'polygon_name'],                  'pop_admin_file'),
+}
+
+class HashAggregator:
+    '''
+    Sums DataFrame chunks by key columns in hash partitions, partitions are spilled to disk if the estimated size of
+    the partial sums exceeds <memory_limit>. Every key may occur only once per chunk, sums are added in chunk order
+    and all other columns keep the values of the first chunk holding a key.
+
+    Args:
+        keys:         key columns
+        sums:         columns to sum
+        partitions:   number of hash partitions (one partition has to fit into memory when the result is built)
+        memory_limit: maximum estimated size of the partial sums held in memory (bytes)
+        directory:    parent directory of the spill files (default: system temporary directory)
+    '''
+    def __init__(self, keys: List[str], sums: List[str], partitions: int = 16, memory_limit: int = MEMORY_LIMIT, directory: str = None):
+        self.keys         = list(keys)
+        self.sums         = list(sums)
+        self.partitions   = partitions
+        self.memory_limit = memory_limit
+        self.directory    = directory
+        self.spills       = 0
+        self._resident    = [None]*partitions
+        self._bytes       = np.zeros(partitions, dtype=np.int64)
+        self._spilled     = np.zeros(partitions, dtype=bool)
+        self._temp        = None
+        self._columns     = self.keys + self.sums
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        '''
+        Removes the spill files.
+        '''
+        self._resident = [None]*self.partitions
+        if(self._temp is not None):
+            self._temp.cleanup()
+            self._temp = None
+
+    def _path(self, partition: int) -> Path:
+        if(self._temp is None):
+            self._temp = tempfile.TemporaryDirectory(prefix='aggregate-', dir=self.directory)
+        return Path(self._temp.name, f'{partition}.pkl')
+
+    def _append(self, partition: int, chunk: pd.DataFrame):
+        with open(self._path(partition), 'ab') as file:
+            pickle.dump(chunk, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _fold(self, partial: pd.DataFrame, chunk: pd.DataFrame) -> Tuple[pd.DataFrame, int]:
+        '''
+        Adds <chunk> (key columns as index) to <partial>, returns the result and the number of new keys.
+        '''
+        if(partial is None):
+            return chunk, len(chunk)
+        position = partial.index.get_indexer(chunk.index)
+        new      = position < 0
+        if((~new).any()):
+            partial = partial.copy()
+            for column in self.sums:
+                values = partial[column].to_numpy(copy=True)
+                values[position[~new]] += chunk[column].to_numpy()[~new]
+                partial[column] = values
+        if(new.any()):
+            partial = pd.concat([partial, chunk[new]])
+        return partial, int(new.sum())
+
+    def add(self, chunk: pd.DataFrame):
+        '''
+        Adds the rows of <chunk> (unique keys) to the partial sums.
+        '''
+        if(chunk.empty):
+            return
+        self._columns = list(chunk.columns)
+        chunk         = chunk.set_index(self.keys)
+        row_bytes     = chunk.memory_usage(deep=True, index=True).sum()/len(chunk)
+        partition     = pd.util.hash_pandas_object(chunk.index, index=False).to_numpy() % self.partitions
+        for part in np.unique(partition):
+            rows = chunk[partition == part]
+            if(self._spilled[part]):
+                self._append(part, rows)
+                continue
+            self._resident[part], new = self._fold(self._resident[part], rows)
+            self._bytes[part] += int(new*row_bytes)
+        while(self._bytes.sum() > self.memory_limit):
+            self._spill(int(np.argmax(self._bytes)))
+
+    def _spill(self, partition: int):
+        self._append(partition, self._resident[partition])
+        self._resident[partition] = None
+        self._bytes[partition]    = 0
+        self._spilled[partition]  = True
+        self.spills += 1
+
+    def results(self) -> Iterator[pd.DataFrame]:
+        '''
+        Yields the aggregated rows of each partition (key columns as index), spilled partitions are read back in order.
+        '''
+        for partition in range(self.partitions):
+            partial = self._resident[partition]
+            self._resident[partition] = None
+            if(self._spilled[partition]):
+                with open(self._path(partition), 'rb') as file:
+                    while(True):
+                        try:
+                            chunk = pickle.load(file)
+                        except EOFError:
+                            break
+                        partial, _ = self._fold(partial, chunk)
+            if(partial is not None):
+                yield partial
+
+    def result(self) -> pd.DataFrame:
+        '''
+        Returns all aggregated rows sorted by key.
+        '''
+        parts = list(self.results())
+        if(not parts):
+            return pd.DataFrame(columns=self._columns)
+        return pd.concat(parts).sort_index().reset_index()
+
+def _read(path: str, columns: Dict, country: str = None) -> pd.DataFrame:
+    '''
+    Reads the valid rows of a Facebook source (see validate.read_valid) with the dtypes of the graph loaders.
+    An unreadable file is reported and contributes no rows.
+    '''
+    try:
+        rows, _ = validate.read_valid(path, columns)
+    except (OSError, ValueError):
+        instrument.error(f'Unable to read file at location {path}.')
+        rows    = pd.DataFrame({column: pd.Series(dtype=str) for column in columns})
+    rows    = validate.convert(rows, columns)
+    if(country):
+        rows = rows[rows['country'] == country].reset_index(drop=True)
+    return rows
+
+def _nodes(rows: pd.DataFrame, keys: List[str], attributes: List[str]) -> pd.DataFrame:
+    '''
+    Start and end nodes of the rows of a movement file in graph insertion order, the last occurrence of a node wins.
+    '''
+    sides = []
+    for side in ('start', 'end'):
+        part = rows[[f'{side}_{column}' for column in keys + attributes]].set_axis(keys + attributes, axis=1)
+        sides.append(part.assign(country=rows['country']))
+    nodes = pd.concat(sides).sort_index(kind='stable')
+    nodes = nodes.drop_duplicates(keys, keep='last').reset_index(drop=True)
+    return nodes.rename(columns={'quadkey': 'node'})
+
+@instrument.timed('aggregate')
+def time_aggregate_movement(paths: List[str], kind: str = 'movement', country: str = None, memory_limit: int = MEMORY_LIMIT,
+                            partitions: int = 16, directory: str = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Aggregates (administrative) movement files over an arbitrary timeframe with bounded memory,
+    out-of-core counterpart of construction.time_aggregate_movement_graph (see to_graph).
+
+    Args:
+        paths:        movement files in time order (plain, compressed or archive members, see utility.data_files)
+        kind:         'movement' or 'admin_movement'
+        country:      country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        memory_limit: maximum estimated size of partial sums held in memory (bytes), larger sums are spilled to disk
+        partitions:   number of hash partitions of the node and edge keys
+        directory:    parent directory of the spill files (default: system temporary directory)
+
+    Returns:
+        nodes: DataFrame with node key (node: quadkey, or lat, lon for administrative files) and node attributes
+        edges: DataFrame with edge key (start, end, or start_lat, start_lon, end_lat, end_lon) and summed n_crisis, length_km
+    '''
+    if(not paths):
+        instrument.error('Empty list - no files to aggregate.')
+    columns, keys, attributes, _ = MOVEMENT_KINDS[kind]
+    edge_keys = ['start', 'end'] if keys == ['quadkey'] else [f'{side}_{key}' for side in ('start', 'end') for key in keys]
+    node_keys = ['node'] if keys == ['quadkey'] else keys
+
+    with HashAggregator(node_keys, [], partitions, memory_limit//2, directory) as nodes, \
+         HashAggregator(edge_keys, ['n_crisis', 'length_km'], partitions, memory_limit//2, directory) as edges:
+        rows = 0
+        for path in utility.read_ahead(paths):
+            table = _read(path, columns, country)
+            rows += len(table)
+            nodes.add(_nodes(table, keys, attributes))
+            table = table.rename(columns={'start_quadkey': 'start', 'end_quadkey': 'end'})
+            edges.add(table[edge_keys + ['n_crisis', 'length_km']].drop_duplicates(edge_keys, keep='last'))
+        instrument.annotate(files=len(paths), rows=rows, spills=nodes.spills + edges.spills)
+        return nodes.result(), edges.result()
+
+@instrument.timed('aggregate')
+def time_aggregate_population(paths: List[str], kind: str = 'admin_population', slice: int = 3, country: str = None,
+                              memory_limit: int = MEMORY_LIMIT, partitions: int = 16, directory: str = None) -> Iterator[pd.DataFrame]:
+    '''
+    Aggregates (administrative) population files in consecutive slices of <slice> files with bounded memory,
+    out-of-core counterpart of construction.time_aggregate_admin_population_graph (see to_graph).
+    Slices are aggregated one after another, remaining files of an incomplete last slice are ignored.
+
+    Args:
+        paths:        population files in time order (plain, compressed or archive members, see utility.data_files)
+        kind:         'population' or 'admin_population'
+        slice:        number of files per slice (default: 3 8-hour-timeframes = 1 day)
+        country:      country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        memory_limit: maximum estimated size of partial sums held in memory (bytes), larger sums are spilled to disk
+        partitions:   number of hash partitions of the node keys
+        directory:    parent directory of the spill files (default: system temporary directory)
+
+    Returns:
+        nodes: generator of one DataFrame per slice with node key (node: quadkey, or lat, lon for administrative files),
+               node attributes and summed population; attrs hold the date_time and file name lists of the slice
+    '''
+    if(not paths):
+        instrument.error('Empty list - no files to aggregate.')
+    columns, keys, attributes, file_property = POPULATION_KINDS[kind]
+    node_keys = ['node'] if keys == ['quadkey'] else keys
+    paths     = list(paths)[:len(paths)//slice*slice]
+
+    aggregator = None
+    properties = {'date_time': [], file_property: []}
+    for index, path in enumerate(utility.read_ahead(paths)):
+        if(index % slice == 0):
+            aggregator = HashAggregator(node_keys, ['population'], partitions, memory_limit, directory)
+            properties = {'date_time': [], file_property: []}
+        table = _read(path, columns, country).rename(columns={'quadkey': 'node', 'n_crisis': 'population'})
+        properties['date_time'].append(pd.to_datetime(table['date_time'].iloc[-1], format=validate.DATE_TIME_FORMAT) if len(table) else utility.timestamp_from_name(path))
+        properties[file_property].append(Path(path).name)
+        aggregator.add(table[node_keys + attributes + ['population']].drop_duplicates(node_keys, keep='last'))
+        if(index % slice == slice - 1):
+            with aggregator:
+                nodes = aggregator.result()
+            nodes.attrs = properties
+            instrument.annotate(slices=index//slice + 1)
+            yield nodes
+
+def to_graph(nodes: pd.DataFrame, edges: pd.DataFrame = None) -> Graph:
+    '''
+    Builds the graph of the in-memory aggregators from the results of time_aggregate_movement / time_aggregate_population.
+
+    Args:
+        nodes: aggregated nodes (graph properties in nodes.attrs)
+        edges: aggregated edges (movement only)
+
+    Returns:
+        graph: DiGraph object
+    '''
+    keys       = ['node'] if 'node' in nodes.columns else ['lat', 'lon']
+    attributes = [column for column in nodes.columns if column not in keys]
+    graph      = nx.DiGraph(**nodes.attrs)
+    ids        = nodes['node'].tolist() if keys == ['node'] else list(zip(nodes['lat'].tolist(), nodes['lon'].tolist()))
+    graph.add_nodes_from(zip(ids, nodes[attributes].to_dict('records')))
+    if(edges is not None):
+        if('start' in edges.columns):
+            start, end = edges['start'].tolist(), edges['end'].tolist()
+        else:
+            start = list(zip(edges['start_lat'].tolist(), edges['start_lon'].tolist()))
+            end   = list(zip(edges['end_lat'].tolist(), edges['end_lon'].tolist()))
+        graph.add_edges_from(zip(start, end, edges[['n_crisis', 'length_km']].to_dict('records')))
+    return graph
@@ -1,8 +1,6 @@
-import plot
 import settings
 import sys
-import model
-import construction as con
+import instrument
 import networkx as nx
 import numpy as np
 import utility as ut
@@ -10,9 +8,8 @@ from networkx import Graph
 from networkx import DiGraph
 from pathlib  import Path
 from typing   import List, Set, Dict, Tuple, Optional
-from vincenty import vincenty
-from tabulate import tabulate
 
+@instrument.timed('analytics')
 def search_edges(graph: DiGraph, **kwargs) -> List:
     '''
     Searches edges of a graph for property values and returns list of resulting edges
@@ -30,6 +27,7 @@ def search_edges(graph: DiGraph, **kwargs) -> List:
             edges.append((id1, id2, data))
     return edges
     
+@instrument.timed('analytics')
 def search_nodes(graph: DiGraph, **kwargs) -> List:
     '''
     Searches nodes of a graph for property values and returns list of resulting nodes
@@ -47,6 +45,7 @@ def search_nodes(graph: DiGraph, **kwargs) -> List:
             nodes.append((id, data))           
     return nodes
     
+@instrument.timed('analytics')
 def search_graphs(graphs: list, **kwargs) -> List:
     '''
     Searches a graph for property values and returns list of resulting graphs
@@ -92,9 +91,25 @@ def quadkey_to_tile_coordinates(quadkey: str) -> Tuple[float, float]:
             x |= mask
             y |= mask
             continue
-        print('[ERROR] Invalid quadkey digit sequence.') 
+        instrument.error('Invalid quadkey digit sequence.') 
     return (x, y)
 
+def quadkey_to_lat_lon(quadkey: str) -> Tuple[float, float]:
+    '''
+    Returns the center of a tile.
+
+    Args:
+        quadkey: str object
+
+    Returns:
+        (lat, lon): latitude and longitude of tile center (in degrees)
+    '''
+    x, y = quadkey_to_tile_coordinates(quadkey)
+    size = 2**len(quadkey)
+    lon  = (x + 0.5)/size*360 - 180
+    lat  = np.degrees(np.arctan(np.sinh(np.pi*(1 - 2*(y + 0.5)/size))))
+    return float(lat), float(lon)
+
 def spherical_to_mercator_coordinates(lon: float, lat: float) -> Tuple[float, float]:
     '''
     Converts point in spherical coordinate system to point on mercator map.
@@ -181,7 +196,7 @@ def orthodrome_length(lat1, lon1, lat2, lon2):
         Returns:
             length: length of orthodrome in meters
     '''
-    
+    from vincenty import vincenty
     length = vincenty((lat1, lon1), (lat2, lon2))*1000
     return length
     
@@ -192,6 +207,8 @@ if __name__ == '__main__':
     ########################################################################
     
     #sys.stdout = open('output.txt', 'w')
+    import construction as con
+    from   tabulate import tabulate
     
     movement_path            = settings.paths['movement_path']
     admin_movement_path      = settings.paths['admin_movement_path']
@@ -0,0 +1,132 @@
+import instrument
+import numpy    as np
+import pandas   as pd
+from   typing   import List
+
+'''
+Crisis vs. baseline change for movement and population tables loaded with baseline=True
+(construction.movement_table(..., baseline=True), construction.population_table(..., baseline=True)).
+All functions work on whole tables (every node/edge and time step) with vectorized column operations and one groupby.
+'''
+
+def _keys(table: pd.DataFrame) -> List[str]:
+    return ['start', 'end'] if 'start' in table.columns else ['node']
+
+def _value(table: pd.DataFrame) -> str:
+    return 'n_crisis' if 'n_crisis' in table.columns else 'population'
+
+def _z_column(table: pd.DataFrame) -> str:
+    return 'z_score' if 'z_score' in table.columns else 'clipped_z_score'
+
+@instrument.timed('anomaly')
+def deviation(table: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Computes the deviation from baseline for every row of a movement or population table.
+
+    Args:
+        table: table loaded with baseline=True
+
+    Returns:
+        deviation: columns date_time, node key(s), crisis, baseline, difference (crisis - baseline),
+                   ratio (crisis / baseline), log_ratio (log2 of ratio) and z (Facebook z-score) as float32
+    '''
+    if('n_baseline' not in table.columns):
+        instrument.error('Table has no baseline columns - load it with baseline=True.')
+        return None
+
+    crisis   = table[_value(table)].to_numpy(dtype=np.float32)
+    baseline = table['n_baseline'].to_numpy(dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(baseline > 0, crisis/baseline, np.nan).astype(np.float32)
+
+    deviation = table[['date_time'] + _keys(table)].copy()
+    deviation['crisis']     = crisis
+    deviation['baseline']   = baseline
+    deviation['difference'] = crisis - baseline
+    deviation['ratio']      = ratio
+    deviation['log_ratio']  = np.log2(ratio)
+    deviation['z']          = table[_z_column(table)].to_numpy(dtype=np.float32)
+    return deviation
+
+@instrument.timed('anomaly')
+def deviation_series(table: pd.DataFrame, by: str = 'total') -> pd.DataFrame:
+    '''
+    Aggregates crisis and baseline over all rows of each time step and returns the deviation series.
+
+    Args:
+        table: table loaded with baseline=True
+        by:    'total' (one series), 'node' (per node, movement tables: outgoing flows per start node) or 'edge'
+
+    Returns:
+        series: indexed by date_time (and node/edge), columns crisis, baseline, difference, percent_change
+    '''
+    keys = {'total': [], 'node': [_keys(table)[0]], 'edge': _keys(table)}[by]
+    sums = pd.DataFrame({
+        'date_time': table['date_time'],
+        **{key: table[key] for key in keys},
+        'crisis':    table[_value(table)].astype(np.float64),
+        'baseline':  table['n_baseline'].astype(np.float64),
+    }).groupby(['date_time'] + keys, observed=True).sum()
+    if(by == 'node' and keys != ['node']):
+        sums.index = sums.index.set_names(['date_time', 'node'])
+    sums['difference']     = sums['crisis'] - sums['baseline']
+    sums['percent_change'] = 100*sums['difference']/sums['baseline'].where(sums['baseline'] > 0)
+    return sums
+
+@instrument.timed('anomaly')
+def flag_anomalies(table: pd.DataFrame, threshold: float = 3.0, method: str = 'robust', min_baseline: float = 10, min_periods: int = 3) -> pd.DataFrame:
+    '''
+    Flags anomalous nodes or edges across the full time range of a table in one pass.
+
+    Methods:
+        'zscore': Facebook z-score column (z_score / clipped_z_score) exceeds <threshold>
+        'robust': robust z-score of log2(crisis / baseline) per node or edge over all time steps,
+                  (log_ratio - median) / (1.4826 * median absolute deviation), exceeds <threshold>
+
+    Args:
+        table:        table loaded with baseline=True
+        threshold:    absolute score above which a row is flagged
+        method:       'zscore' or 'robust'
+        min_baseline: rows with smaller baseline are never flagged (unstable ratios)
+        min_periods:  minimum number of time steps per node/edge for robust scores
+
+    Returns:
+        anomalies: flagged rows of deviation(table) with additional columns score and direction (+1 above, -1 below baseline)
+    '''
+    deviations = deviation(table)
+    if(deviations is None):
+        return None
+
+    if(method == 'zscore'):
+        score = deviations['z'].to_numpy()
+    elif(method == 'robust'):
+        keys    = _keys(table)
+        grouped = deviations.groupby(keys, observed=True)['log_ratio']
+        median  = grouped.transform('median')
+        mad     = (deviations['log_ratio'] - median).abs().groupby([deviations[key] for key in keys], observed=True).transform('median')
+        periods = grouped.transform('count')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.array((deviations['log_ratio'] - median)/(1.4826*mad), dtype=np.float64)
+        score[(periods < min_periods).to_numpy() | ~np.isfinite(score)] = 0
+    else:
+        instrument.error(f'Unknown anomaly method {method}.')
+        return None
+
+    mask = (np.abs(score) > threshold) & (deviations['baseline'].to_numpy() >= min_baseline)
+    anomalies = deviations[mask].copy()
+    anomalies['score']     = score[mask].astype(np.float32)
+    anomalies['direction'] = np.sign(anomalies['difference']).astype(np.int8)
+    return anomalies.sort_values(['date_time', 'score'], key=lambda column: column.abs() if column.name == 'score' else column, ascending=[True, False])
+
+def anomaly_counts(anomalies: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Number of anomalous rows above and below baseline per time step.
+
+    Args:
+        anomalies: output of flag_anomalies
+
+    Returns:
+        counts: indexed by date_time, columns above, below
+    '''
+    counts = anomalies.groupby(['date_time', 'direction']).size().unstack('direction', fill_value=0)
+    return counts.rename(columns={1: 'above', -1: 'below', 0: 'equal'})
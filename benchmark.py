@@ -0,0 +1,691 @@
+import argparse
+import json
+import platform
+import settings
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy    as np
+import pandas   as pd
+from   pathlib  import Path
+from   typing   import List, Dict, Tuple, Callable
+
+'''
+Benchmark suite with a generator for synthetic Facebook (movement/population, tile and administrative level)
+and RKI files in the exact format read by the construction module.
+Times construction, aggregation, analytics, model and plot paths and writes a machine-readable baseline (JSON).
+
+Usage: python benchmark.py --tile-size 13 --nodes 500 --days 7 --output baseline.json
+'''
+
+STATES = {
+    'Baden-Württemberg':      (48.54, 9.04),
+    'Bayern':                 (48.95, 11.40),
+    'Berlin':                 (52.50, 13.40),
+    'Brandenburg':            (52.45, 13.02),
+    'Bremen':                 (53.08, 8.80),
+    'Hamburg':                (53.55, 10.00),
+    'Hessen':                 (50.61, 9.03),
+    'Mecklenburg-Vorpommern': (53.77, 12.57),
+    'Niedersachsen':          (52.75, 9.25),
+    'Nordrhein-Westfalen':    (51.47, 7.55),
+    'Rheinland-Pfalz':        (49.91, 7.45),
+    'Saarland':               (49.38, 6.88),
+    'Sachsen':                (51.05, 13.35),
+    'Sachsen-Anhalt':         (51.97, 11.70),
+    'Schleswig-Holstein':     (54.18, 9.82),
+    'Thüringen':              (50.90, 11.03),
+}
+
+AGE_GROUPS = ['A00-A04', 'A05-A14', 'A15-A34', 'A35-A59', 'A60-A79', 'A80+']
+
+def lat_lon_to_quadkey(lat: np.ndarray, lon: np.ndarray, tile_size: int) -> np.ndarray:
+    '''
+    https://docs.microsoft.com/en-us/bingmaps/articles/bing-maps-tile-system
+    Returns the quadkeys of the tiles containing the points (lat, lon).
+
+    Args:
+        lat:       latitudes (in degrees)
+        lon:       longitudes (in degrees)
+        tile_size: tile level
+
+    Returns:
+        quadkeys: array of quadkey strings
+    '''
+    sin_lat = np.sin(np.asarray(lat)*np.pi/180)
+    x = (np.asarray(lon) + 180)/360
+    y = 0.5 - np.log((1 + sin_lat)/(1 - sin_lat))/(4*np.pi)
+    tile_x = np.clip((x*2**tile_size).astype(np.int64), 0, 2**tile_size - 1)
+    tile_y = np.clip((y*2**tile_size).astype(np.int64), 0, 2**tile_size - 1)
+
+    digits = np.zeros((len(tile_x), tile_size), dtype=np.int64)
+    for i in range(tile_size, 0, -1):
+        mask = 1 << (i-1)
+        digits[:, tile_size - i] = ((tile_x & mask) > 0) + 2*((tile_y & mask) > 0)
+    return np.array([''.join(map(str, row)) for row in digits], dtype=object)
+
+def quadkey_to_lat_lon(quadkeys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Returns the center coordinates of the tiles given by <quadkeys> (all of the same tile level).
+
+    Args:
+        quadkeys: array of quadkey strings
+
+    Returns:
+        (lat, lon): latitudes and longitudes of tile centers (in degrees)
+    '''
+    tile_size = len(quadkeys[0])
+    digits = np.array([list(quadkey) for quadkey in quadkeys], dtype=np.int64)
+    weights = 1 << np.arange(tile_size - 1, -1, -1)
+    tile_x = ((digits & 1) * weights).sum(axis=1)
+    tile_y = ((digits >> 1) * weights).sum(axis=1)
+    x = (tile_x + 0.5)/2**tile_size
+    y = (tile_y + 0.5)/2**tile_size
+    lon = 360*x - 180
+    lat = 90 - 360*np.arctan(np.exp((y - 0.5)*2*np.pi))/np.pi
+    return lat, lon
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    '''
+    Vectorized great circle distance (spherical earth) in kilometers.
+    '''
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1)/2)**2 + np.cos(lat1)*np.cos(lat2)*np.sin((lon2 - lon1)/2)**2
+    return 2*6371.0088*np.arcsin(np.sqrt(a))
+
+def _time_steps(start_date: str, days: int) -> pd.DatetimeIndex:
+    return pd.date_range(start_date, periods=days*3, freq='8h')
+
+def _file_name(prefix: str, date_time: pd.Timestamp) -> str:
+    return f"{prefix}_{date_time.strftime('%Y-%m-%d %H%M')}.csv"
+
+def _baseline_columns(rng, crisis: np.ndarray) -> Dict:
+    baseline   = np.maximum(crisis*rng.uniform(0.8, 1.4, len(crisis)), 10).round(1)
+    difference = crisis - baseline
+    return {
+        'n_baseline':     baseline,
+        'n_difference':   difference.round(1),
+        'percent_change': (100*difference/(baseline + 1)).round(4),
+        'z_score':        (difference/np.sqrt(baseline)).round(4),
+    }
+
+def generate_tiles(tile_size: int = 13, nodes: int = 500, seed: int = 0) -> pd.DataFrame:
+    '''
+    Draws <nodes> distinct tiles of level <tile_size> inside Germany and assigns each to its nearest state.
+
+    Args:
+        tile_size: tile level (quadkey length)
+        nodes:     number of tiles (capped by the number of tiles at that level)
+        seed:      random seed
+
+    Returns:
+        tiles: DataFrame with columns quadkey, lat, lon, polygon_id, polygon_name, weight
+    '''
+    rng = np.random.default_rng(seed)
+    quadkeys = np.array([], dtype=object)
+    for _ in range(50):
+        draw = 4*nodes
+        lat  = rng.uniform(47.4, 54.9, draw)
+        lon  = rng.uniform(5.9, 15.0, draw)
+        quadkeys = np.unique(np.concatenate([quadkeys, lat_lon_to_quadkey(lat, lon, tile_size)]))
+        if(len(quadkeys) >= nodes):
+            break
+    quadkeys = np.sort(rng.choice(quadkeys, min(nodes, len(quadkeys)), replace=False))
+    lat, lon = quadkey_to_lat_lon(quadkeys)
+
+    names   = list(STATES)
+    centers = np.array(list(STATES.values()))
+    state   = haversine_km(lat[:, None], lon[:, None], centers[None, :, 0], centers[None, :, 1]).argmin(axis=1)
+
+    return pd.DataFrame({
+        'quadkey':      quadkeys,
+        'lat':          lat.round(6),
+        'lon':          lon.round(6),
+        'polygon_id':   1000 + state,
+        'polygon_name': np.array(names, dtype=object)[state],
+        'weight':       rng.lognormal(5, 1, len(quadkeys)),
+    })
+
+def generate_movement_files(path: str, tiles: pd.DataFrame, start_date: str = '2020-04-01', days: int = 7, degree: int = 8, country: str = 'DE', seed: int = 0) -> List[Path]:
+    '''
+    Writes one tile level and one administrative level movement .csv file per 8-hour time step.
+
+    Args:
+        path:       storage directory (sub directories 'movement' and 'admin_movement' are created)
+        tiles:      output of generate_tiles
+        start_date: first day
+        days:       number of days
+        degree:     number of outgoing edges per tile and time step (besides the self loop)
+        country:    country code
+        seed:       random seed
+
+    Returns:
+        files: list of written tile level files
+    '''
+    rng = np.random.default_rng(seed)
+    tile_path, admin_path = Path(path, 'movement'), Path(path, 'admin_movement')
+    tile_path.mkdir(parents=True, exist_ok=True)
+    admin_path.mkdir(parents=True, exist_ok=True)
+    tile_size = len(tiles['quadkey'].iloc[0])
+
+    n = len(tiles)
+    # Neighbours in quadkey order are spatially close, offsets emulate mostly local movement.
+    offsets = np.concatenate([[0], rng.choice(np.r_[-4*degree:0, 1:4*degree + 1], min(degree, 8*degree), replace=False)])
+    start   = np.repeat(np.arange(n), len(offsets))
+    end     = (start + np.tile(offsets, n)) % n
+    start, end = np.unique(np.stack([start, end]), axis=1)
+    base    = np.sqrt(tiles['weight'].to_numpy()[start]*tiles['weight'].to_numpy()[end])
+    base[start == end] *= 5
+    length  = haversine_km(tiles['lat'].to_numpy()[start], tiles['lon'].to_numpy()[start], tiles['lat'].to_numpy()[end], tiles['lon'].to_numpy()[end])
+
+    files = []
+    for date_time in _time_steps(start_date, days):
+        factor = {0: 0.6, 8: 1.2, 16: 1.0}[date_time.hour]
+        crisis = np.maximum(base*factor*rng.lognormal(0, 0.3, len(base)), 10).astype(np.int64)
+        keep   = rng.random(len(base)) < 0.9
+        s, e, crisis = start[keep], end[keep], crisis[keep]
+        columns = _baseline_columns(rng, crisis)
+
+        tile_movement = pd.DataFrame({
+            'geometry':                     'LINESTRING',
+            'date_time':                    date_time.strftime('%Y-%m-%d %H%M'),
+            'start_polygon_name':           tiles['polygon_name'].to_numpy()[s],
+            'end_polygon_name':             tiles['polygon_name'].to_numpy()[e],
+            'length_km':                    length[keep].round(6),
+            'tile_size':                    tile_size,
+            'country':                      country,
+            'level':                        'LEVEL3',
+            'n_crisis':                     crisis,
+            'n_baseline':                   columns['n_baseline'],
+            'n_difference':                 columns['n_difference'],
+            'percent_change':               columns['percent_change'],
+            'is_statistically_significant': (np.abs(columns['z_score']) > 1.96).astype(int),
+            'z_score':                      columns['z_score'],
+            'start_lat':                    tiles['lat'].to_numpy()[s],
+            'start_lon':                    tiles['lon'].to_numpy()[s],
+            'end_lat':                      tiles['lat'].to_numpy()[e],
+            'end_lon':                      tiles['lon'].to_numpy()[e],
+            'start_quadkey':                tiles['quadkey'].to_numpy()[s],
+            'end_quadkey':                  tiles['quadkey'].to_numpy()[e],
+            'start_polygon_id':             tiles['polygon_id'].to_numpy()[s],
+            'end_polygon_id':               tiles['polygon_id'].to_numpy()[e],
+            'ds':                           date_time.strftime('%Y-%m-%d'),
+        })
+        file = Path(tile_path, _file_name(f'{country}_Movement_between_Tiles', date_time))
+        tile_movement.to_csv(file, index=False)
+        files.append(file)
+
+        admin = tile_movement.groupby(['start_polygon_id', 'end_polygon_id', 'start_polygon_name', 'end_polygon_name'], as_index=False).agg(
+            n_crisis=('n_crisis', 'sum'), n_baseline=('n_baseline', 'sum'))
+        start_center = np.array([STATES[name] for name in admin['start_polygon_name']])
+        end_center   = np.array([STATES[name] for name in admin['end_polygon_name']])
+        admin_movement = pd.DataFrame({
+            'geometry':           'LINESTRING',
+            'date_time':          date_time.strftime('%Y-%m-%d %H%M'),
+            'start_polygon_id':   admin['start_polygon_id'],
+            'start_polygon_name': admin['start_polygon_name'],
+            'end_polygon_id':     admin['end_polygon_id'],
+            'end_polygon_name':   admin['end_polygon_name'],
+            'length_km':          haversine_km(start_center[:, 0], start_center[:, 1], end_center[:, 0], end_center[:, 1]).round(6),
+            'tile_size':          tile_size,
+            'country':            country,
+            'level':              'LEVEL1',
+            'n_crisis':           admin['n_crisis'],
+            'n_baseline':         admin['n_baseline'].round(1),
+            'n_difference':       (admin['n_crisis'] - admin['n_baseline']).round(1),
+            'percent_change':     (100*(admin['n_crisis'] - admin['n_baseline'])/(admin['n_baseline'] + 1)).round(4),
+            'z_score':            ((admin['n_crisis'] - admin['n_baseline'])/np.sqrt(admin['n_baseline'])).round(4),
+            'start_lat':          start_center[:, 0],
+            'start_lon':          start_center[:, 1],
+            'end_lat':            end_center[:, 0],
+            'end_lon':            end_center[:, 1],
+            'ds':                 date_time.strftime('%Y-%m-%d'),
+        })
+        admin_movement.to_csv(Path(admin_path, _file_name(f'{country}_Movement_between_Administrative_Regions', date_time)), index=False)
+
+    return files
+
+def generate_population_files(path: str, tiles: pd.DataFrame, start_date: str = '2020-04-01', days: int = 7, delta: int = 1, country: str = 'DE', seed: int = 0) -> List[Path]:
+    '''
+    Writes one tile level and one administrative level population .csv file per 8-hour time step.
+    Population tiles are <delta> levels finer than the movement tiles, as in the Facebook data sets.
+
+    Args:
+        path:       storage directory (sub directories 'population' and 'admin_population' are created)
+        tiles:      output of generate_tiles
+        start_date: first day
+        days:       number of days
+        delta:      tile level difference between population and movement tiles
+        country:    country code
+        seed:       random seed
+
+    Returns:
+        files: list of written tile level files
+    '''
+    rng = np.random.default_rng(seed + 1)
+    tile_path, admin_path = Path(path, 'population'), Path(path, 'admin_population')
+    tile_path.mkdir(parents=True, exist_ok=True)
+    admin_path.mkdir(parents=True, exist_ok=True)
+
+    children = tiles.loc[tiles.index.repeat(4**delta)].reset_index(drop=True)
+    suffixes = [''.join(digits) for digits in np.array(np.meshgrid(*[list('0123')]*delta, indexing='ij')).reshape(delta, -1).T] if delta else ['']
+    children['quadkey'] = children['quadkey'] + np.tile(np.array(suffixes, dtype=object), len(tiles))
+    children = children.sample(frac=0.5 if delta else 1.0, random_state=seed).sort_values('quadkey').reset_index(drop=True)
+    children['lat'], children['lon'] = quadkey_to_lat_lon(children['quadkey'].to_numpy())
+    weight = children['weight'].to_numpy()/4**delta
+
+    files = []
+    for date_time in _time_steps(start_date, days):
+        factor = {0: 1.1, 8: 0.9, 16: 1.0}[date_time.hour]
+        crisis = np.maximum(weight*factor*rng.lognormal(0, 0.1, len(weight)), 10).round(1)
+        columns = _baseline_columns(rng, crisis)
+
+        population = pd.DataFrame({
+            'lat':              children['lat'].round(6),
+            'lon':              children['lon'].round(6),
+            'quadkey':          children['quadkey'],
+            'date_time':        date_time.strftime('%Y-%m-%d %H%M'),
+            'n_baseline':       columns['n_baseline'],
+            'n_crisis':         crisis,
+            'n_difference':     columns['n_difference'],
+            'density_baseline': (columns['n_baseline']/1000).round(6),
+            'density_crisis':   (crisis/1000).round(6),
+            'percent_change':   columns['percent_change'],
+            'clipped_z_score':  np.clip(columns['z_score'], -4, 4),
+            'ds':               date_time.strftime('%Y-%m-%d'),
+            'country':          country,
+        })
+        file = Path(tile_path, _file_name(f'{country}_Facebook_Population_Tile_Level', date_time))
+        population.to_csv(file, index=False)
+        files.append(file)
+
+        admin  = population.assign(polygon_name=children['polygon_name'], polygon_id=children['polygon_id'])
+        admin  = admin.groupby(['polygon_id', 'polygon_name'], as_index=False).agg(n_crisis=('n_crisis', 'sum'), n_baseline=('n_baseline', 'sum'))
+        center = np.array([STATES[name] for name in admin['polygon_name']])
+        admin_population = pd.DataFrame({
+            'lat':             center[:, 0],
+            'lon':             center[:, 1],
+            'polygon_name':    admin['polygon_name'],
+            'polygon_id':      admin['polygon_id'],
+            'date_time':       date_time.strftime('%Y-%m-%d %H%M'),
+            'n_baseline':      admin['n_baseline'].round(1),
+            'n_crisis':        admin['n_crisis'].round(1),
+            'n_difference':    (admin['n_crisis'] - admin['n_baseline']).round(1),
+            'percent_change':  (100*(admin['n_crisis'] - admin['n_baseline'])/(admin['n_baseline'] + 1)).round(4),
+            'clipped_z_score': np.clip((admin['n_crisis'] - admin['n_baseline'])/np.sqrt(admin['n_baseline']), -4, 4).round(4),
+            'ds':              date_time.strftime('%Y-%m-%d'),
+            'country':         country,
+        })
+        admin_population.to_csv(Path(admin_path, _file_name(f'{country}_Facebook_Population_Administrative_Regions', date_time)), index=False)
+
+    return files
+
+def generate_rki_files(path: str, start_date: str = '2020-06-01', days: int = 7, districts: int = 64, history: int = 30, seed: int = 0) -> List[Path]:
+    '''
+    Writes one RKI publication per day to <path>/<MonthYear>/RKI_COVID19_<YYYY-MM-DD>.csv (layout read by construction.cumulated_*).
+    Every case has a reporting date (Meldedatum) and a later publication date, so late arrivals show up as NeuerFall = 1
+    in later publications. Cases recover 14 days and die (rarely) 10 days after their reporting date.
+
+    Args:
+        path:       RKI root directory (use as settings.paths['RKI'])
+        start_date: date of first publication
+        days:       number of publications
+        districts:  number of Landkreise (spread over all states)
+        history:    number of reporting days before <start_date>
+        seed:       random seed
+
+    Returns:
+        files: list of written publications
+    '''
+    rng = np.random.default_rng(seed + 2)
+    states = list(STATES)
+    district_state = np.arange(districts) % len(states)
+    district_id    = 1000*(district_state + 1) + np.arange(districts)
+    district_name  = np.array([f'LK {states[s]} {i}' for i, s in enumerate(district_state)], dtype=object)
+
+    first, last = pd.Timestamp(start_date) - pd.Timedelta(days=history), pd.Timestamp(start_date) + pd.Timedelta(days=days - 1)
+    report_dates = pd.date_range(first, last)
+    groups = pd.MultiIndex.from_product([report_dates, np.arange(districts), np.arange(len(AGE_GROUPS)), ['M', 'W']], names=['Meldedatum', 'district', 'age', 'Geschlecht']).to_frame(index=False)
+    groups['AnzahlFall'] = rng.poisson(1.5, len(groups))
+    groups = groups[groups['AnzahlFall'] > 0].reset_index(drop=True)
+    # Reporting delay: most cases are published the next day, some up to a week later.
+    groups['published']  = groups['Meldedatum'] + pd.to_timedelta(rng.choice([0, 1, 1, 1, 2, 3, 7], len(groups)), unit='D')
+    groups['recovered']  = groups['Meldedatum'] + pd.Timedelta(days=14)
+    groups['dead']       = rng.random(len(groups)) < 0.03
+    groups['died']       = groups['Meldedatum'] + pd.Timedelta(days=10)
+
+    files = []
+    for publication in pd.date_range(start_date, periods=days):
+        cases = groups[groups['published'] <= publication]
+        recovered = cases['recovered'] <= publication
+        dead      = cases['dead'] & (cases['died'] <= publication)
+        district  = cases['district'].to_numpy()
+        df = pd.DataFrame({
+            'ObjectId':             np.arange(1, len(cases) + 1),
+            'IdBundesland':         district_state[district] + 1,
+            'Bundesland':           np.array(states, dtype=object)[district_state[district]],
+            'Landkreis':            district_name[district],
+            'Altersgruppe':         np.array(AGE_GROUPS, dtype=object)[cases['age'].to_numpy()],
+            'Geschlecht':           cases['Geschlecht'].to_numpy(),
+            'AnzahlFall':           cases['AnzahlFall'].to_numpy(),
+            'AnzahlTodesfall':      np.where(dead, cases['AnzahlFall'], 0),
+            'Meldedatum':           cases['Meldedatum'].dt.strftime('%Y/%m/%d 00:00:00').to_numpy(),
+            'IdLandkreis':          district_id[district],
+            'Datenstand':           publication.strftime('%d.%m.%Y, 00:00 Uhr'),
+            'NeuerFall':            (cases['published'] == publication).astype(int).to_numpy(),
+            'NeuerTodesfall':       np.where(dead, (cases['died'] == publication).astype(int), -9),
+            'Refdatum':             cases['Meldedatum'].dt.strftime('%Y/%m/%d 00:00:00').to_numpy(),
+            'NeuGenesen':           np.where(recovered & ~dead, (cases['recovered'] == publication).astype(int), -9),
+            'AnzahlGenesen':        np.where(recovered & ~dead, cases['AnzahlFall'], 0),
+            'IstErkrankungsbeginn': 0,
+            'Altersgruppe2':        'Nicht übermittelt',
+        })
+        directory = Path(path, f'{publication.month_name()}{publication.year}')
+        directory.mkdir(parents=True, exist_ok=True)
+        file = Path(directory, f'RKI_COVID19_{publication.date()}.csv')
+        df.to_csv(file, index=False)
+        files.append(file)
+
+    return files
+
+def generate_dataset(path: str, tile_size: int = 13, nodes: int = 500, days: int = 7, start_date: str = '2020-06-01', population_delta: int = 1, districts: int = 64, seed: int = 0) -> Dict:
+    '''
+    Generates a complete synthetic data set (Facebook movement/population on both levels, RKI publications) at <path>.
+
+    Args:
+        path:             storage directory
+        tile_size:        tile level of movement tiles
+        nodes:            number of movement tiles
+        days:             number of days (3 Facebook time steps and one RKI publication per day)
+        start_date:       first day
+        population_delta: tile level difference between population and movement tiles
+        districts:        number of RKI Landkreise
+        seed:             random seed
+
+    Returns:
+        paths: dict in the layout of settings.paths
+    '''
+    tiles = generate_tiles(tile_size, nodes, seed)
+    generate_movement_files(path, tiles, start_date, days, seed=seed)
+    generate_population_files(path, tiles, start_date, days, population_delta, seed=seed)
+    generate_rki_files(Path(path, 'RKI'), start_date, days, districts, seed=seed)
+    return {
+        'RKI':                   Path(path, 'RKI'),
+        'movement_path':         Path(path, 'movement'),
+        'admin_movement_path':   Path(path, 'admin_movement'),
+        'population_path':       Path(path, 'population'),
+        'admin_population_path': Path(path, 'admin_population'),
+        'root':                  Path(path),
+    }
+
+# Core data and analytics modules (also imported by every worker process) and the plotting/modelling/export
+# modules they must only load on demand.
+CORE_MODULES = ['utility', 'store', 'analytics', 'construction', 'metrics', 'ingest', 'partition', 'aggregate', 'stages', 'cli']
+LAZY_MODULES = ['matplotlib', 'seaborn', 'simplekml', 'plot', 'model', 'vincenty', 'tabulate', 'scipy.spatial']
+
+def import_module(module: str):
+    '''
+    Imports <module> in a fresh interpreter (startup of a worker process or one-shot CLI call),
+    fails if it loads any of LAZY_MODULES.
+    '''
+    code   = f'import sys, {module}; print(*[name for name in {LAZY_MODULES!r} if name in sys.modules])'
+    loaded = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parent, capture_output=True, text=True, check=True).stdout.split()
+    if(loaded):
+        raise RuntimeError(f'import {module} loads {", ".join(loaded)}')
+
+def measure(function: Callable, repeat: int = 1, memory: bool = True) -> Dict:
+    '''
+    Times <function> (best of <repeat> runs) and measures its peak traced memory in a separate run.
+
+    Args:
+        function: callable without arguments
+        repeat:   number of timed runs
+        memory:   additionally trace peak memory (tracemalloc, slower)
+
+    Returns:
+        result: dict with seconds, peak_memory_mb, status, error
+    '''
+    result = {'seconds': None, 'peak_memory_mb': None, 'status': 'ok', 'error': None}
+    try:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        result['seconds'] = min(timings)
+
+        if(memory):
+            tracemalloc.start()
+            function()
+            result['peak_memory_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+    except Exception as exception:
+        result['status'] = 'error'
+        result['error']  = f'{type(exception).__name__}: {exception}'
+    finally:
+        if(tracemalloc.is_tracing()):
+            tracemalloc.stop()
+    return result
+
+def cases(paths: Dict, output: str) -> List[Tuple[str, str, int, Callable]]:
+    '''
+    Builds the list of benchmark cases (group, name, number of processed rows, callable) for a generated data set.
+
+    Args:
+        paths:  output of generate_dataset
+        output: directory for files written by plot functions
+
+    Returns:
+        cases: list of (group, name, rows, function)
+    '''
+    import aggregate
+    import analytics
+    import anomaly
+    import community
+    import diff
+    import construction as con
+    import gravity
+    import metrics
+    import model
+    import od
+    import plot
+    import rki
+    import rollup
+    import spatial
+    import stages
+    import tiles
+    import trips
+    import utility      as ut
+    import validate
+    import matplotlib
+    matplotlib.use('Agg')
+
+    mov_files       = sorted(ut.file_list(paths['movement_path']))
+    admin_mov_files = sorted(ut.file_list(paths['admin_movement_path']))
+    pop_files       = sorted(ut.file_list(paths['population_path']))
+    admin_pop_files = sorted(ut.file_list(paths['admin_population_path']))
+    rows            = lambda files: sum(len(pd.read_csv(file, usecols=[0])) for file in files)
+
+    mov_rows, admin_mov_rows = rows(mov_files), rows(admin_mov_files)
+    pop_rows, admin_pop_rows = rows(pop_files), rows(admin_pop_files)
+
+    mov_graphs       = [con.movement_graph(file) for file in mov_files]
+    admin_mov_graphs = [con.administrative_movement_graph(file) for file in admin_mov_files]
+    pop_graphs       = [con.population_graph(file) for file in pop_files]
+    admin_pop_graphs = [con.administrative_population_graph(file) for file in admin_pop_files]
+    mov_table        = con.movement_table(mov_files)
+    pop_table        = con.population_table(pop_files)
+    mov_baseline     = con.movement_table(mov_files, baseline=True)
+
+    rki_days   = sorted(path.name[-14:-4] for path in Path(paths['RKI']).glob('*/RKI_COVID19_*.csv'))
+    first, last = rki_days[0], rki_days[-1]
+    rki_file   = next(Path(paths['RKI']).glob(f'*/RKI_COVID19_{last}.csv'))
+    rki_rows   = rows([rki_file])
+    rki_table  = rki.read_publication(rki_file)
+    rki_cache  = str(Path(output, 'rki-cache'))
+    for day in rki_days:
+        rki.save_cube(rki.cube(rki.read_publication(next(Path(paths['RKI']).glob(f'*/RKI_COVID19_{day}.csv')))), rki_cache, f'RKI_COVID19_{day}')
+    rki.update_triangle(rki_cache, [pd.Timestamp(day) for day in rki_days])
+    rki.clear_cubes()
+    stage_cache = str(Path(output, 'stage-cache'))
+    mov_stage   = lambda: stages.stage(stage_cache, 'movement_graph', con.movement_graph, [[key] for key in stages.sources(stage_cache, mov_files)], jobs=1)
+
+    sir_graph = admin_pop_graphs[0].copy()
+    sir_graph.graph['date_time'] = str(sir_graph.graph['date_time'])
+    sample_quadkeys = list(pop_graphs[0].nodes)[:1000]
+    tile_size = pop_graphs[0].graph['tile_size']
+    pop_index = spatial.graph_index(pop_graphs[0])
+    mapping   = rollup.tile_polygon_mapping(mov_table)
+    sample_points = [(data['lat'], data['lon']) for _, data in list(pop_graphs[0].nodes.data())[:1000]]
+
+    return [
+        ('construction', 'movement_graph',                        mov_rows,           lambda: [con.movement_graph(file) for file in mov_files]),
+        ('construction', 'administrative_movement_graph',         admin_mov_rows,     lambda: [con.administrative_movement_graph(file) for file in admin_mov_files]),
+        ('construction', 'population_graph',                      pop_rows,           lambda: [con.population_graph(file) for file in pop_files]),
+        ('construction', 'administrative_population_graph',       admin_pop_rows,     lambda: [con.administrative_population_graph(file) for file in admin_pop_files]),
+        ('construction', 'movement_table',                        mov_rows,           lambda: con.movement_table(mov_files)),
+        ('construction', 'administrative_movement_table',         admin_mov_rows,     lambda: con.administrative_movement_table(admin_mov_files)),
+        ('construction', 'population_table',                      pop_rows,           lambda: con.population_table(pop_files)),
+        ('construction', 'administrative_population_table',       admin_pop_rows,     lambda: con.administrative_population_table(admin_pop_files)),
+        ('construction', 'movement_graph_read_ahead',             mov_rows,           lambda: [con.movement_graph(file) for file in ut.read_ahead(mov_files)]),
+        ('construction', 'validate_movement',                     mov_rows,           lambda: [validate.read_valid(file, con.MOVEMENT_COLUMNS) for file in mov_files]),
+        ('construction', 'administrative_radiation_graph',        len(admin_pop_graphs[0])**2, lambda: con.administrative_radiation_graph(admin_pop_files[0])),
+        ('construction', 'cumulated_infected',                    rki_rows,           lambda: con.cumulated_infected(first, last)),
+        ('construction', 'cumulated_recovered',                   rki_rows,           lambda: con.cumulated_recovered(first, last)),
+        ('construction', 'cumulated_dead',                        rki_rows,           lambda: con.cumulated_dead(first, last)),
+        ('rki',          'read_publication',                      rki_rows,           lambda: rki.read_publication(rki_file)),
+        ('rki',          'cube',                                  rki_rows,           lambda: rki.cube(rki_table)),
+        ('rki',          'landkreis_series',                      rki_rows,           lambda: rki.series(last)),
+        ('rki',          'update_triangle',                       rki_rows,           lambda: rki.update_triangle(rki_cache, [pd.Timestamp(last)])),
+        ('rki',          'reporting_delay',                       rki_rows,           lambda: rki.reporting_delay(rki.triangle(rki_cache))),
+        ('construction', 'currently_infected',                    3*rki_rows,         lambda: con.currently_infected(last)),
+        ('aggregation',  'space_aggregate_population_graph',      pop_rows,           lambda: [con.space_aggregate_population_graph(graph) for graph in pop_graphs]),
+        ('aggregation',  'space_aggregate_population_table',      pop_rows,           lambda: con.space_aggregate_population_table(pop_table)),
+        ('aggregation',  'space_aggregate_movement_graph',        mov_rows,           lambda: [con.space_aggregate_movement_graph(graph, 2) for graph in mov_graphs]),
+        ('aggregation',  'space_aggregate_movement_table',        mov_rows,           lambda: con.space_aggregate_movement_table(mov_table, 2)),
+        ('aggregation',  'time_aggregate_movement_graph',         mov_rows,           lambda: con.time_aggregate_movement_graph(mov_graphs)),
+        ('aggregation',  'time_aggregate_admin_movement_graph',   admin_mov_rows,     lambda: con.time_aggregate_movement_graph(admin_mov_graphs)),
+        ('aggregation',  'time_aggregate_admin_population_graph', admin_pop_rows,     lambda: con.time_aggregate_admin_population_graph(admin_pop_graphs)),
+        ('aggregation',  'time_aggregate_movement_out_of_core',   mov_rows,           lambda: aggregate.time_aggregate_movement(mov_files, 'movement', memory_limit=1 << 20, directory=output)),
+        ('aggregation',  'time_aggregate_population_out_of_core', admin_pop_rows,     lambda: list(aggregate.time_aggregate_population(admin_pop_files, 'admin_population', memory_limit=1 << 20, directory=output))),
+        ('aggregation',  'merge_population_with_movement_table',  mov_rows + pop_rows, lambda: con.merge_population_with_movement_table(pop_table, mov_table)),
+        ('aggregation',  'diff_edges',                            mov_rows,           lambda: diff.diff_edges(mov_table)),
+        ('aggregation',  'diff_nodes',                            pop_rows,           lambda: diff.diff_nodes(pop_table)),
+        ('metrics',      'graph_communities',                     mov_rows,           lambda: community.graph_communities(con.time_aggregate_movement_graph(mov_graphs))),
+        ('metrics',      'track_communities',                     mov_rows,           lambda: community.track_communities(mov_table)),
+        ('metrics',      'trip_length_histogram',                 mov_rows,           lambda: trips.quantiles(trips.histogram(mov_table))),
+        ('metrics',      'radius_of_gyration',                    mov_rows,           lambda: trips.gyration(mov_table)),
+        ('aggregation',  'stage_cache_build',                     mov_rows,           lambda: (shutil.rmtree(stage_cache, ignore_errors=True), mov_stage())),
+        ('aggregation',  'stage_cache_rerun',                     mov_rows,           mov_stage),
+        ('aggregation',  'tile_polygon_mapping',                  mov_rows,           lambda: rollup.tile_polygon_mapping(mov_table)),
+        ('aggregation',  'rollup_movement',                       mov_rows,           lambda: rollup.rollup_movement(mov_table, mapping)),
+        ('aggregation',  'rollup_population',                     pop_rows,           lambda: rollup.rollup_population(pop_table, mapping)),
+        ('export',       'export_od_npz',                         mov_rows,           lambda: od.export_table(mov_table, str(Path(output, 'od-npz')), 'npz')),
+        ('export',       'export_od_parquet',                     mov_rows,           lambda: od.export_table(mov_table, str(Path(output, 'od-parquet')), 'parquet')),
+        ('export',       'tile_pyramid_population',               pop_rows,           lambda: tiles.pyramid(pop_table, str(Path(output, 'tiles')), min_zoom=4, jobs=1)),
+        ('export',       'tile_pyramid_movement',                 mov_rows,           lambda: tiles.pyramid(mov_table, str(Path(output, 'tiles')), min_zoom=4, jobs=1)),
+        ('export',       'read_od_npz',                           mov_rows,           lambda: od.read_matrices(str(Path(output, 'od-npz')), 'npz')),
+        ('analytics',    'search_edges',                          mov_rows,           lambda: [analytics.search_edges(graph, length_km=0.0) for graph in mov_graphs]),
+        ('analytics',    'search_nodes',                          pop_rows,           lambda: [analytics.search_nodes(graph, country='DE') for graph in pop_graphs]),
+        ('analytics',    'search_graphs',                         len(mov_graphs),    lambda: analytics.search_graphs(mov_graphs, tile_size=tile_size)),
+        ('analytics',    'quadkey_to_tile_coordinates',           len(sample_quadkeys), lambda: [analytics.quadkey_to_tile_coordinates(quadkey) for quadkey in sample_quadkeys]),
+        ('analytics',    'get_tile_vertices',                     len(pop_graphs[0]), lambda: [analytics.get_tile_vertices(data['lon'], data['lat'], tile_size) for _, data in pop_graphs[0].nodes.data()]),
+        ('analytics',    'orthodrome_length',                     len(mov_graphs[0].edges), lambda: [analytics.orthodrome_length(mov_graphs[0].nodes[u]['lat'], mov_graphs[0].nodes[u]['lon'], mov_graphs[0].nodes[v]['lat'], mov_graphs[0].nodes[v]['lon']) for u, v in mov_graphs[0].edges]),
+        ('analytics',    'graph_index',                           len(pop_graphs[0]), lambda: spatial.graph_index(pop_graphs[0])),
+        ('analytics',    'radius_query',                          len(sample_points), lambda: [pop_index.radius(lat, lon, 10) for lat, lon in sample_points]),
+        ('analytics',    'nearest_query',                         len(sample_points), lambda: [pop_index.nearest(lat, lon, 8) for lat, lon in sample_points]),
+        ('analytics',    'node_metrics',                          mov_rows,           lambda: metrics.node_metrics(mov_table)),
+        ('analytics',    'edge_metrics',                          mov_rows,           lambda: metrics.edge_metrics(mov_table)),
+        ('analytics',    'deviation_series',                      mov_rows,           lambda: anomaly.deviation_series(mov_baseline, 'node')),
+        ('analytics',    'flag_anomalies',                        mov_rows,           lambda: anomaly.flag_anomalies(mov_baseline)),
+        ('model',        'gravity_fit_power',                     mov_rows,           lambda: gravity.fit(mov_table, 'power')),
+        ('model',        'gravity_fit_exponential',               mov_rows,           lambda: gravity.fit(mov_table, 'exponential')),
+        ('model',        'gravity_compare',                       mov_rows,           lambda: gravity.compare(mov_table)),
+        ('model',        'closed_SIR',                            365,                lambda: model.closed_SIR(990, 10, 0, 0.4, 0.04, 365)),
+        ('model',        'init_state_SIR',                        3*len(STATES)*rki_rows, lambda: model.init_state_SIR(last)),
+        ('model',        'static_state_SIR',                      3*len(STATES)*rki_rows, lambda: model.static_state_SIR(sir_graph, 0.4, 0.04, 100)),
+        ('plot',         'tile_kml',                              len(pop_graphs[0]), lambda: plot.tile_kml(pop_graphs[0], str(Path(output, 'tiles')))),
+        ('plot',         'plot_SIR',                              100,                lambda: plot.plot_SIR(*model.closed_SIR(990, 10, 0, 0.4, 0.04, 100), 'SIR', True, str(Path(output, 'sir.png')))),
+        ('plot',         'plot_nation_currently_infected',        3*rki_rows*len(rki_days), lambda: plot.plot_nation_currently_infected(last, True, str(Path(output, 'nation-infected.png')))),
+        ('plot',         'plot_nation_population',                admin_pop_rows,     lambda: plot.plot_nation_population(admin_pop_graphs, str(admin_pop_graphs[0].graph['date_time'].date()), True, str(Path(output, 'nation-population.png')))),
+        ('plot',         'plot_nation_population_time_aggregate', admin_pop_rows,     lambda: plot.plot_nation_population_time_aggregate(admin_pop_graphs, str(admin_pop_graphs[0].graph['date_time'].date()), 1, True, str(Path(output, 'nation-population-aggregate.png')))),
+        ('plot',         'plot_state_population_share',           admin_pop_rows,     lambda: plot.plot_state_population_share(admin_pop_graphs, str(admin_pop_graphs[0].graph['date_time'].date()), True, str(Path(output, 'state-population-share.png')))),
+    ] + [('startup', f'import_{module}', 0, lambda module=module: import_module(module)) for module in CORE_MODULES]
+
+def run(tile_size: int = 13, nodes: int = 500, days: int = 7, repeat: int = 1, memory: bool = True, select: List[str] = None, path: str = None, seed: int = 0) -> Dict:
+    '''
+    Generates a synthetic data set and runs all (or the <select>ed) benchmark cases on it.
+
+    Args:
+        tile_size: tile level of movement tiles
+        nodes:     number of movement tiles
+        days:      number of days
+        repeat:    number of timed runs per case (minimum is reported)
+        memory:    measure peak memory per case
+        select:    list of case or group names to run (default: all)
+        path:      data directory (default: temporary directory, removed afterwards)
+        seed:      random seed
+
+    Returns:
+        baseline: dict with 'meta' (parameters, environment) and 'results' (one entry per case)
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        root  = Path(path) if path else Path(directory)
+        start = time.perf_counter()
+        paths = generate_dataset(root, tile_size, nodes, days, seed=seed)
+        generation = time.perf_counter() - start
+
+        rki_path = settings.paths.get('RKI')
+        settings.paths['RKI'] = paths['RKI']
+        try:
+            results = []
+            for group, name, rows, function in cases(paths, directory):
+                if(select and group not in select and name not in select):
+                    continue
+                result = {'group': group, 'name': name, 'rows': rows}
+                result.update(measure(function, repeat, memory))
+                result['rows_per_second'] = rows/result['seconds'] if result['seconds'] else None
+                results.append(result)
+                print(f"[{result['status']:>5}] {group:<12} {name:<40} {result['seconds'] or 0:10.4f} s")
+        finally:
+            settings.paths['RKI'] = rki_path
+
+    meta = {
+        'tile_size':  tile_size,
+        'nodes':      nodes,
+        'days':       days,
+        'repeat':     repeat,
+        'seed':       seed,
+        'generation': generation,
+        'python':     platform.python_version(),
+        'platform':   platform.platform(),
+        'created':    pd.Timestamp.now().isoformat(),
+    }
+    return {'meta': meta, 'results': results}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark suite on synthetic Facebook/RKI data.')
+    parser.add_argument('--tile-size', type=int, default=13,  help='tile level of movement tiles')
+    parser.add_argument('--nodes',     type=int, default=500, help='number of movement tiles')
+    parser.add_argument('--days',      type=int, default=7,   help='number of days (3 time steps per day)')
+    parser.add_argument('--repeat',    type=int, default=1,   help='timed runs per case')
+    parser.add_argument('--no-memory', action='store_true',   help='skip peak memory measurement')
+    parser.add_argument('--select',    nargs='*',             help='case or group names to run')
+    parser.add_argument('--data',      type=str, default=None, help='keep generated data in this directory')
+    parser.add_argument('--seed',      type=int, default=0)
+    parser.add_argument('--output',    type=str, default='baseline.json', help='path of JSON baseline')
+    parser.add_argument('--trace',     type=str, default=None, help='additionally write a Chrome trace of all instrumented stages')
+    args = parser.parse_args()
+
+    if(args.trace):
+        import instrument
+        instrument.enable()
+
+    baseline = run(args.tile_size, args.nodes, args.days, args.repeat, not args.no_memory, args.select, args.data, args.seed)
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(baseline, file, indent=2)
+    print(f'Baseline written to {args.output}')
+    if(args.trace):
+        instrument.export_chrome_trace(args.trace)
@@ -0,0 +1,335 @@
+import argparse
+import json
+import platform
+import time
+import instrument
+import settings
+import store
+import utility
+from   pathlib  import Path
+from   typing   import List, Dict
+
+'''
+Command-line entry point of the pipeline: build the cached store, aggregate, compute metrics, run SIR models and
+render plots without editing settings.py or a __main__ block. Input directories and the store location are given
+as options (or a JSON file in the layout of settings.paths), results are written to the store at --output
+(default: the cache) and every run records its arguments and paths in <output>/runs/<timestamp>.json.
+Independent jobs (one per stored table, country or plot) run in --jobs worker processes; --memory-limit caps the
+address space of the run and its workers (POSIX only), a job exceeding it fails alone and is reported.
+
+Usage:
+    python cli.py --rki data/RKI --movement data/movement --cache cache build --partition
+    python cli.py --cache cache --jobs 8 --memory-limit 4G metrics --kind movement
+    python cli.py --cache cache --jobs 8 aggregate --kind movement --level admin
+    python cli.py --movement data/movement --cache cache time-aggregate --kind movement --buffer 2G --spill-dir /scratch
+    python cli.py --cache cache --jobs 8 tiles --kind population --min-zoom 4
+    python cli.py --cache cache --jobs 4 sir --infection-rate 0.3
+    python cli.py --rki data/RKI --output results plot nation-infected state-infected
+'''
+
+# Option: key of settings.paths
+PATH_OPTIONS = {
+    'rki':              'RKI',
+    'movement':         'movement_path',
+    'admin_movement':   'admin_movement_path',
+    'population':       'population_path',
+    'admin_population': 'admin_population_path',
+    'cache':            'cache',
+    'quarantine':       'quarantine',
+}
+
+PLOTS = ['sir', 'nation-infected', 'state-infected', 'nation-population', 'nation-population-aggregate', 'state-population', 'state-population-share']
+
+def memory_size(value: str) -> int:
+    '''
+    Parses a memory size like '512M', '4G' or '1073741824' (bytes).
+    '''
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+    value = value.strip().upper().rstrip('B')
+    if(value and value[-1] in units):
+        return int(float(value[:-1])*units[value[-1]])
+    return int(value)
+
+def set_memory_limit(limit: int):
+    '''
+    Caps the address space of this process (and the worker processes it starts) at <limit> bytes.
+    '''
+    try:
+        import resource
+    except ImportError:
+        instrument.error('Memory limit not supported on this platform.')
+        return
+    hard = resource.getrlimit(resource.RLIMIT_AS)[1]
+    if(hard != resource.RLIM_INFINITY):
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+def configure(args: argparse.Namespace) -> Dict:
+    '''
+    Applies --config and the path options to settings.paths (modules reading settings see them, partition.map_jobs
+    passes them on to its worker processes).
+
+    Returns:
+        paths: updated settings.paths
+    '''
+    if(args.config):
+        with open(args.config, encoding='utf8') as file:
+            settings.paths.update({key: Path(value) for key, value in json.load(file).items()})
+    for option, key in PATH_OPTIONS.items():
+        if(getattr(args, option)):
+            settings.paths[key] = Path(getattr(args, option))
+    args.output = args.output or str(settings.paths['cache'])
+    return settings.paths
+
+def write_run(args: argparse.Namespace, paths: Dict, seconds: float, results: Dict) -> Path:
+    '''
+    Records the arguments, paths and results of a run as <output>/runs/<timestamp>.json.
+    '''
+    path = Path(args.output, 'runs', time.strftime('%Y-%m-%d %H%M%S') + f' {args.command}.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    run = {
+        'command':   args.command,
+        'arguments': {key: value for key, value in vars(args).items() if key != 'function'},
+        'paths':     {key: str(value) for key, value in paths.items()},
+        'python':    platform.python_version(),
+        'seconds':   seconds,
+        'results':   results,
+    }
+    with open(path, 'w', encoding='utf8') as file:
+        json.dump(run, file, indent=1, default=str)
+    return path
+
+def _names(cache: str, kind: str, names: List[str] = None) -> List[str]:
+    names = names or store.list_tables(cache, kind)
+    if(not names):
+        instrument.error(f'No {kind} tables in the store at {cache} - run the build command first.')
+    return names
+
+def _metrics_job(cache: str, kind: str, name: str, output: str, alpha: float) -> str:
+    import metrics
+    table = store.read_table(cache, kind, [name])
+    store.write_table(metrics.node_metrics(table, alpha), output, f'{kind}_metrics', name)
+    return name
+
+def _aggregate_job(cache: str, kind: str, name: str, output: str, level: str, delta: int, max_distance_km: float) -> str:
+    import construction as con
+    import rollup
+    table = store.read_table(cache, kind, [name])
+    if(level == 'admin'):
+        mapping = rollup.load_mapping(cache)
+        result  = rollup.rollup_movement(table, mapping, max_distance_km) if kind == 'movement' else rollup.rollup_population(table, mapping, max_distance_km)
+    else:
+        result  = con.space_aggregate_movement_table(table, delta) if kind == 'movement' else con.space_aggregate_population_table(table, delta)
+    store.write_table(result, output, f'{kind}_{level}' + (f'_{delta}' if level == 'coarse' else ''), name)
+    return name
+
+def _plot_job(figure: str, output: str, date: str, start_date: str, infected: int, infection_rate: float, recovery_rate: float, timeframe: int) -> str:
+    import matplotlib
+    matplotlib.use('Agg')
+    import construction as con
+    import model
+    import plot
+    path = str(Path(output, 'plots', f'{figure}.png'))
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    if(figure == 'sir'):
+        plot.plot_SIR(*model.closed_SIR(1000 - infected, infected, 0, infection_rate, recovery_rate, timeframe), 'SIR', True, path)
+    elif(figure in ('nation-infected', 'state-infected') and not date):
+        instrument.error(f'No RKI publications in {settings.paths["RKI"]} - figure {figure} needs --rki or --date.')
+        return None
+    elif(figure == 'nation-infected'):
+        plot.plot_nation_currently_infected(date, True, path)
+    elif(figure == 'state-infected'):
+        plot.plot_state_currently_infected(date, True, path)
+    else:
+        files  = sorted(utility.file_list(settings.paths['admin_population_path']))
+        graphs = [con.administrative_population_graph(file) for file in utility.read_ahead(files)]
+        start  = start_date or str(graphs[0].graph['date_time'].date())
+        if(figure == 'nation-population'):
+            plot.plot_nation_population(graphs, start, True, path)
+        elif(figure == 'nation-population-aggregate'):
+            plot.plot_nation_population_time_aggregate(graphs, start, 7, True, path)
+        elif(figure == 'state-population'):
+            plot.plot_state_population(graphs, start, True, path)
+        else:
+            plot.plot_state_population_share(graphs, start, True, path)
+    return path
+
+def build(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Ingests all new or changed source files into the store (see ingest.ingest), optionally partitioned by country.
+    '''
+    import ingest
+    import partition
+    files   = ingest.ingest(paths, args.cache_dir, args.country, args.settle)
+    results = {'ingested': len(files)}
+    if(args.partition):
+        results['partitions'] = partition.partition(paths, args.cache_dir, jobs=args.jobs)
+    return results
+
+def aggregate(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Aggregates every stored table of --kind to coarser tiles (--level coarse) or administrative polygons (--level admin).
+    '''
+    import partition
+    names   = _names(args.cache_dir, args.kind, args.names)
+    results = partition.map_jobs(_aggregate_job, [(args.cache_dir, args.kind, name, args.output, args.level, args.delta, args.max_distance) for name in names], args.jobs)
+    return {'tables': sum(result is not None for result in results), 'failed': sum(result is None for result in results)}
+
+def time_aggregate(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Aggregates all source files of --kind over time with bounded memory (see aggregate), partial sums exceeding
+    --buffer are spilled to --spill-dir. Results are stored as <output>/<kind>_time/nodes|edges.pkl (movement)
+    or one table per slice named after its first file (population).
+    '''
+    import aggregate
+    directory = paths.get(PATH_OPTIONS[args.kind])
+    files     = utility.data_files(directory) if directory and Path(directory).is_dir() else []
+    options   = dict(country=args.country, memory_limit=args.buffer, partitions=args.partitions, directory=args.spill_dir)
+    if(args.kind in aggregate.MOVEMENT_KINDS):
+        nodes, edges = aggregate.time_aggregate_movement(files, args.kind, **options)
+        store.write_table(nodes, args.output, f'{args.kind}_time', 'nodes')
+        store.write_table(edges, args.output, f'{args.kind}_time', 'edges')
+        return {'files': len(files), 'nodes': len(nodes), 'edges': len(edges)}
+    slices = 0
+    for nodes in aggregate.time_aggregate_population(files, args.kind, args.slice, **options):
+        store.write_table(nodes, args.output, f'{args.kind}_time_{args.slice}', utility.source_name(nodes.attrs[aggregate.POPULATION_KINDS[args.kind][3]][0]))
+        slices += 1
+    return {'files': len(files), 'slices': slices}
+
+def tile_pyramid(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Builds the GeoJSON tile pyramid (see tiles.pyramid) of every stored table of --kind in <output>/tiles.
+    '''
+    import tiles
+    names   = _names(args.cache_dir, args.kind, args.names)
+    written = 0
+    for name in names:
+        written += tiles.pyramid(store.read_table(args.cache_dir, args.kind, [name]), str(Path(args.output, 'tiles')), args.min_zoom, args.max_zoom, args.detail, jobs=args.jobs)
+    return {'tables': len(names), 'tiles': written}
+
+def compute_metrics(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Computes node metrics (see metrics.node_metrics) of every stored movement table of --kind.
+    '''
+    import partition
+    names   = _names(args.cache_dir, args.kind, args.names)
+    results = partition.map_jobs(_metrics_job, [(args.cache_dir, args.kind, name, args.output, args.alpha) for name in names], args.jobs)
+    return {'tables': sum(result is not None for result in results), 'failed': sum(result is None for result in results)}
+
+def sir(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Runs a closed SIR model per country partition (see partition.run), seeded with the country's administrative population.
+    '''
+    import partition
+    results = partition.run('sir', args.cache_dir, args.countries, args.jobs, save=False, infected=args.infected,
+                            infection_rate=args.infection_rate, recovery_rate=args.recovery_rate, timeframe=args.timeframe)
+    if(not results):
+        instrument.error('No administrative population partitions - run the build command with --partition first.')
+    for country, result in results.items():
+        store.write_table(result, args.output, 'sir', country)
+    return {'countries': sorted(results)}
+
+def plots(args: argparse.Namespace, paths: Dict) -> Dict:
+    '''
+    Renders the selected figures to <output>/plots/<figure>.png, one worker process per figure.
+    '''
+    import partition
+    date    = args.date or max((path.name[-14:-4] for path in Path(paths['RKI']).glob('*/RKI_COVID19_*.csv')), default='')
+    figures = args.figures or PLOTS
+    for figure in set(figures).difference(PLOTS):
+        instrument.error(f'Unknown figure {figure}.')
+    figures = [figure for figure in figures if figure in PLOTS]
+    results = partition.map_jobs(_plot_job, [(figure, args.output, date, args.start_date, args.infected, args.infection_rate, args.recovery_rate, args.timeframe) for figure in figures], args.jobs)
+    return {figure: result for figure, result in zip(figures, results)}
+
+def parser() -> argparse.ArgumentParser:
+    '''
+    Argument parser of the command-line tool.
+    '''
+    main = argparse.ArgumentParser(description='Graph analysis pipeline: build the cached store, aggregate, compute metrics, run SIR models and render plots.')
+    main.add_argument('--config',           type=str,   default=None, help='JSON file of paths in the layout of settings.paths')
+    main.add_argument('--rki',              type=str,   default=None, help='RKI directory')
+    main.add_argument('--movement',         type=str,   default=None, help='Facebook movement (tile level) directory')
+    main.add_argument('--admin-movement',   type=str,   default=None, help='Facebook movement (administrative level) directory')
+    main.add_argument('--population',       type=str,   default=None, help='Facebook population (tile level) directory')
+    main.add_argument('--admin-population', type=str,   default=None, help='Facebook population (administrative level) directory')
+    main.add_argument('--cache',            type=str,   default=None, help="store directory (default: settings.paths['cache'])")
+    main.add_argument('--quarantine',       type=str,   default=None, help='directory for rows failing validation')
+    main.add_argument('--output',           type=str,   default=None, help='directory for results (default: the store directory)')
+    main.add_argument('--jobs',             type=int,   default=None, help='number of worker processes (default: number of CPUs)')
+    main.add_argument('--memory-limit',     type=memory_size, default=None, help="address space limit of the run, e.g. '4G'")
+    main.add_argument('--trace',            type=str,   default=None, help='record instrumentation and write a Chrome trace to this file')
+    commands = main.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('build', help='ingest new or changed source files into the store')
+    command.add_argument('--country',   type=str,   default=None, help="country code, e.g. 'DE'")
+    command.add_argument('--settle',    type=float, default=0,    help='minimum file age in seconds')
+    command.add_argument('--partition', action='store_true',      help='also split the sources into per-country partitions')
+    command.set_defaults(function=build)
+
+    command = commands.add_parser('aggregate', help='aggregate stored tables to coarser tiles or administrative polygons')
+    command.add_argument('--kind',         type=str,   default='movement', choices=['movement', 'population'])
+    command.add_argument('--level',        type=str,   default='coarse',   choices=['coarse', 'admin'])
+    command.add_argument('--delta',        type=int,   default=1,          help='number of tile levels to coarsen')
+    command.add_argument('--max-distance', type=float, default=None,       help='km to the nearest mapped tile for unmapped tiles (admin level)')
+    command.add_argument('--names',        nargs='*',  default=None,       help='stored tables to process (default: all)')
+    command.set_defaults(function=aggregate)
+
+    command = commands.add_parser('time-aggregate', help='aggregate source files over time with bounded memory')
+    command.add_argument('--kind',       type=str,         default='movement', choices=list(PATH_OPTIONS)[1:5])
+    command.add_argument('--country',    type=str,         default=None,       help="country code, e.g. 'DE'")
+    command.add_argument('--slice',      type=int,         default=3,          help='files per aggregate (population)')
+    command.add_argument('--buffer',     type=memory_size, default='1G',       help="memory for partial sums before spilling to disk, e.g. '2G'")
+    command.add_argument('--partitions', type=int,         default=16,         help='number of hash partitions')
+    command.add_argument('--spill-dir',  type=str,         default=None,       help='directory for spill files (default: system temporary directory)')
+    command.set_defaults(function=time_aggregate)
+
+    command = commands.add_parser('tiles', help='multi-zoom GeoJSON tile pyramid of stored tables for map viewers')
+    command.add_argument('--kind',     type=str,   default='population', choices=['movement', 'population'])
+    command.add_argument('--min-zoom', type=int,   default=2,            help='lowest zoom level')
+    command.add_argument('--max-zoom', type=int,   default=None,         help='highest zoom level (default: tile size of the data)')
+    command.add_argument('--detail',   type=int,   default=3,            help='quadkey levels of the data below the zoom level')
+    command.add_argument('--names',    nargs='*',  default=None,         help='stored tables to process (default: all)')
+    command.set_defaults(function=tile_pyramid)
+
+    command = commands.add_parser('metrics', help='node metrics of stored movement tables')
+    command.add_argument('--kind',  type=str,   default='movement', choices=['movement', 'admin_movement'])
+    command.add_argument('--alpha', type=float, default=0.85,       help='PageRank damping factor')
+    command.add_argument('--names', nargs='*',  default=None,       help='stored tables to process (default: all)')
+    command.set_defaults(function=compute_metrics)
+
+    for name, function, help in (('sir', sir, 'closed SIR model per country partition'), ('plot', plots, 'render figures')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--infected',       type=int,   default=10)
+        command.add_argument('--infection-rate', type=float, default=0.4)
+        command.add_argument('--recovery-rate',  type=float, default=0.04)
+        command.add_argument('--timeframe',      type=int,   default=365, help='number of days')
+        command.set_defaults(function=function)
+        if(name == 'sir'):
+            command.add_argument('--countries', nargs='*', default=None, help="countries to process, e.g. 'DE' 'AT'")
+        else:
+            command.add_argument('figures',      nargs='*', default=None, help=f'figures to render (default: all of {", ".join(PLOTS)})')
+            command.add_argument('--date',       type=str,  default=None, help='last date of RKI figures (default: latest publication)')
+            command.add_argument('--start-date', type=str,  default=None, help='first date of population figures (default: first time step)')
+    return main
+
+def main(argv: List[str] = None) -> Dict:
+    args  = parser().parse_args(argv)
+    paths = configure(args)
+    args.cache_dir = str(paths['cache'])
+    if(args.memory_limit):
+        set_memory_limit(args.memory_limit)
+    if(args.trace):
+        instrument.enable()
+
+    start   = time.perf_counter()
+    results = args.function(args, paths)
+    seconds = time.perf_counter() - start
+    run     = write_run(args, paths, seconds, results)
+    if(args.trace):
+        instrument.export_chrome_trace(args.trace)
+    print(f'[CLI] {args.command} finished in {seconds:.1f} s: {json.dumps(results, default=str)} (run record: {run})')
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import time
+import instrument
+import networkx     as nx
+import numpy        as np
+import pandas       as pd
+import scipy.sparse as sp
+from   networkx     import DiGraph
+from   typing       import List, Dict, Tuple, Hashable, Union
+
+'''
+Community detection (effective mobility regions) on weighted movement networks, with sparse matrices throughout.
+Flows are symmetrized (W = A + A^T) and partitioned by modularity with a vectorized Louvain scheme: in every sweep all
+nodes evaluate the gain of joining each neighbouring community at once (one sparse product), a random share of the
+improving nodes moves, communities are then collapsed into nodes (P^T W P) and the next level starts.
+Over a sequence of time steps every step warm-starts from the partition of the previous one (new nodes start alone),
+community labels are tracked (a community keeps the label of the previous community it overlaps most) and stability
+metrics (NMI, adjusted Rand index, share of nodes changing community) compare consecutive partitions on their common nodes.
+
+Usage:
+    labels            = community.graph_communities(con.time_aggregate_movement_graph(graphs))
+    labels, stability = community.track_communities(mov_table)                 # one partition per time step
+    labels, stability = community.track_communities(mov_table, window='W')     # weekly flows
+    labels, stability = community.track_communities(aggregated_graphs)         # list of (aggregated) graphs
+'''
+
+def _compact(labels: np.ndarray) -> np.ndarray:
+    return np.unique(labels, return_inverse=True)[1].astype(np.int64)
+
+def _membership(labels: np.ndarray) -> sp.csr_matrix:
+    '''
+    Sparse node x community indicator matrix.
+    '''
+    return sp.csr_matrix((np.ones(len(labels)), (np.arange(len(labels)), labels)), shape=(len(labels), int(labels.max()) + 1 if len(labels) else 0))
+
+def symmetrize(matrix: sp.spmatrix) -> sp.csr_matrix:
+    '''
+    Undirected weights W = A + A^T of a flow matrix A (self loops count twice, as in undirected networkx graphs).
+    '''
+    matrix = sp.csr_matrix(matrix, dtype=np.float64)
+    return (matrix + matrix.T).tocsr()
+
+def modularity(weights: sp.csr_matrix, labels: np.ndarray, resolution: float = 1.0) -> float:
+    '''
+    Modularity of the partition <labels> of the symmetric weight matrix <weights> (see symmetrize),
+    equal to networkx.community.modularity of the corresponding undirected graph.
+    '''
+    degree = np.asarray(weights.sum(axis=1)).ravel()
+    total  = degree.sum()
+    if(total <= 0):
+        return 0.0
+    labels     = _compact(labels)
+    membership = _membership(labels)
+    internal   = (membership.T @ weights @ membership).diagonal().sum()
+    sigma      = np.bincount(labels, degree)
+    return float(internal/total - resolution*np.sum(sigma**2)/total**2)
+
+def _move(weights: sp.csr_matrix, labels: np.ndarray, resolution: float, rng: np.random.Generator, max_iter: int) -> Tuple[np.ndarray, int]:
+    '''
+    Local moving phase: nodes join the neighbouring community of the largest modularity gain, a random share of the
+    improving nodes per sweep (synchronous moves of all of them oscillate). Sweeps lowering modularity are undone.
+
+    Returns:
+        labels: compact community of each node
+        sweeps: number of sweeps
+    '''
+    degree  = np.asarray(weights.sum(axis=1)).ravel()
+    total   = degree.sum()
+    loops   = weights.diagonal()
+    labels  = _compact(labels)
+    share   = 0.5
+    quality = modularity(weights, labels, resolution)
+    if(total <= 0):
+        return labels, 0
+    for sweep in range(1, max_iter + 1):
+        sigma = np.bincount(labels, degree)
+        links = (weights @ _membership(labels)).tocoo()
+        own   = links.col == labels[links.row]
+        gain  = links.data - np.where(own, loops[links.row], 0) - resolution*degree[links.row]*(sigma[links.col] - np.where(own, degree[links.row], 0))/total
+        stay  = -resolution*degree*(sigma[labels] - degree)/total
+        stay[links.row[own]] = gain[own]
+
+        rows, columns, gain = links.row[~own], links.col[~own], gain[~own]
+        order = np.lexsort((-gain, rows))
+        rows, columns, gain = rows[order], columns[order], gain[order]
+        best  = np.r_[True, rows[1:] != rows[:-1]] if len(rows) else np.zeros(0, dtype=bool)
+        rows, columns, gain = rows[best], columns[best], gain[best]
+        improving = gain > stay[rows] + 1e-12*total
+        if(not improving.any() or share < 1e-3):
+            return labels, sweep
+
+        moving = improving & (rng.random(len(rows)) < share)
+        moved  = labels.copy()
+        moved[rows[moving]] = columns[moving]
+        moved  = _compact(moved)
+        update = modularity(weights, moved, resolution)
+        if(update > quality):
+            labels, quality = moved, update
+        else:
+            share /= 2
+    return labels, max_iter
+
+def louvain(weights: sp.csr_matrix, init: np.ndarray = None, resolution: float = 1.0, seed: int = 0, max_iter: int = 50, max_levels: int = 10) -> Tuple[np.ndarray, Dict]:
+    '''
+    Vectorized Louvain partition of a symmetric weight matrix.
+
+    Args:
+        weights:    symmetric sparse weight matrix (see symmetrize)
+        init:       initial community of each node (warm start, default: every node alone)
+        resolution: modularity resolution (> 1: smaller communities)
+        seed:       seed of the random move selection
+        max_iter:   maximum number of sweeps per level
+        max_levels: maximum number of aggregation levels
+
+    Returns:
+        labels: compact community of each node
+        info:   dict of modularity, levels and sweeps
+    '''
+    weights = sp.csr_matrix(weights, dtype=np.float64)
+    rng     = np.random.default_rng(seed)
+    labels  = _compact(np.arange(weights.shape[0]) if init is None else np.asarray(init))
+    if(not len(labels)):
+        return labels, {'modularity': 0.0, 'levels': 0, 'sweeps': 0}
+    level_weights, level_labels, sweeps = weights, labels, 0
+    for level in range(1, max_levels + 1):
+        level_labels, count = _move(level_weights, level_labels, resolution, rng, max_iter)
+        sweeps += count
+        labels  = level_labels[labels] if level > 1 else level_labels
+        if(level > 1 and level_labels.max() + 1 == level_weights.shape[0]):
+            break
+        membership    = _membership(level_labels)
+        level_weights = (membership.T @ level_weights @ membership).tocsr()
+        level_labels  = np.arange(level_weights.shape[0])
+    return labels, {'modularity': modularity(weights, labels, resolution), 'levels': level, 'sweeps': sweeps}
+
+@instrument.timed('community')
+def graph_communities(graph: DiGraph, weight: str = 'n_crisis', resolution: float = 1.0, seed: int = 0) -> Dict[Hashable, int]:
+    '''
+    Communities of a movement graph (one time step or the output of construction.time_aggregate_movement_graph).
+
+    Args:
+        graph:      (Di)Graph object with edge weights
+        weight:     edge property used as weight
+        resolution: modularity resolution (> 1: smaller communities)
+        seed:       seed of the random move selection
+
+    Returns:
+        communities: dict of node and community (0 = largest community)
+    '''
+    nodes     = list(graph)
+    if(not nodes):
+        return {}
+    labels, _ = louvain(symmetrize(nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=weight)), resolution=resolution, seed=seed)
+    rank      = np.argsort(np.argsort(-np.bincount(labels), kind='stable'))
+    return dict(zip(nodes, rank[labels].tolist()))
+
+def compare_partitions(a: np.ndarray, b: np.ndarray) -> Dict[str, float]:
+    '''
+    Normalized mutual information (arithmetic mean normalization) and adjusted Rand index of two partitions of the same nodes.
+    '''
+    n = len(a)
+    if(n == 0):
+        return {'nmi': np.nan, 'ari': np.nan}
+    table = sp.coo_matrix((np.ones(n), (_compact(a), _compact(b)))).tocsr()
+    table.sum_duplicates()
+    count = table.data
+    rows  = np.asarray(table.sum(axis=1)).ravel()
+    cols  = np.asarray(table.sum(axis=0)).ravel()
+
+    entropy  = lambda sizes: -np.sum(sizes/n*np.log(sizes/n))
+    row, col = table.nonzero()
+    mutual   = np.sum(count/n*np.log(n*count/(rows[row]*cols[col])))
+    h_a, h_b = entropy(rows), entropy(cols)
+    nmi      = 1.0 if h_a + h_b == 0 else 2*mutual/(h_a + h_b)
+
+    pairs    = lambda sizes: np.sum(sizes*(sizes - 1)/2)
+    index    = pairs(count)
+    expected = pairs(rows)*pairs(cols)/(n*(n - 1)/2) if n > 1 else 0.0
+    maximum  = (pairs(rows) + pairs(cols))/2
+    ari      = 1.0 if maximum == expected else (index - expected)/(maximum - expected)
+    return {'nmi': float(nmi), 'ari': float(ari)}
+
+def _track(labels: np.ndarray, previous: np.ndarray, next_label: int) -> Tuple[np.ndarray, int]:
+    '''
+    Assigns tracked community ids: communities take the previous id they overlap most (largest overlaps first,
+    every previous id at most once), the others get new ids starting at <next_label>.
+
+    Args:
+        labels:     compact community of each node
+        previous:   tracked id of each node in the previous step (-1: absent)
+
+    Returns:
+        tracked:    tracked id of each node
+        next_label: next unused id
+    '''
+    known   = previous >= 0
+    overlap = pd.DataFrame({'community': labels[known], 'previous': previous[known]}).value_counts().reset_index()
+    overlap = overlap.sort_values(['count', 'community', 'previous'], ascending=[False, True, True], kind='stable')
+    ids     = np.full(labels.max() + 1 if len(labels) else 0, -1, dtype=np.int64)
+    taken   = set()
+    for community, label in zip(overlap['community'].to_numpy(), overlap['previous'].to_numpy()):
+        if(ids[community] < 0 and label not in taken):
+            ids[community] = label
+            taken.add(label)
+    new = np.flatnonzero(ids < 0)
+    ids[new] = next_label + np.arange(len(new))
+    return ids[labels], next_label + len(new)
+
+def _table_steps(table: pd.DataFrame, value: str, window: str = None):
+    '''
+    Yields date_time, global node codes and flow matrix (over the active nodes) of every time step of a movement table.
+    '''
+    date_time = table['date_time']
+    if(window):
+        date_time = date_time.dt.to_period(window).dt.start_time
+    steps, times = pd.factorize(date_time, sort=True)
+    start  = table['start'].cat.codes.to_numpy()
+    end    = table['end'].cat.codes.to_numpy()
+    values = table[value].to_numpy(dtype=np.float64)
+    sort   = np.argsort(steps, kind='stable')
+    bounds = np.searchsorted(steps[sort], np.arange(len(times) + 1))
+    for i, date in enumerate(times):
+        rows  = sort[bounds[i]:bounds[i + 1]]
+        nodes, local = np.unique(np.concatenate([start[rows], end[rows]]), return_inverse=True)
+        yield date, nodes, sp.coo_matrix((values[rows], (local[:len(rows)], local[len(rows):])), shape=(len(nodes), len(nodes))).tocsr()
+
+def _graph_steps(graphs: List[DiGraph], order: pd.Index, value: str, date_times: List):
+    for i, graph in enumerate(graphs):
+        nodes = list(graph)
+        if(not nodes):
+            continue
+        yield date_times[i], order.get_indexer(pd.Index(nodes, dtype=object, tupleize_cols=False)), nx.to_scipy_sparse_array(graph, nodelist=nodes, weight=value, format='csr')
+
+@instrument.timed('community')
+def track_communities(data: Union[pd.DataFrame, List[DiGraph]], value: str = 'n_crisis', window: str = None, resolution: float = 1.0,
+                      seed: int = 0, warm_start: bool = True, date_times: List = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Communities of every time step of a movement table or list of movement graphs, each step warm-started from the previous one.
+
+    Args:
+        data:       movement table (construction.movement_table, administrative_movement_table, coarsened/rolled up tables)
+                    or list of movement graphs (e.g. outputs of construction.time_aggregate_movement_graph)
+        value:      flow column / edge property
+        window:     partition flows summed over windows of this period instead of single time steps, e.g. 'D', 'W' (tables only)
+        resolution: modularity resolution (> 1: smaller communities)
+        seed:       seed of the random move selection
+        warm_start: start every step from the previous partition (False: from scratch)
+        date_times: date_time of each graph (default: graph property date_time, or the position of the graph)
+
+    Returns:
+        labels:    columns date_time, node, community (tracked id, stable across time steps)
+        stability: indexed by date_time, columns nodes, edges, communities, modularity, nmi, ari, changed (share of common
+                   nodes changing community), appeared/vanished (communities), levels, sweeps, seconds
+    '''
+    if(isinstance(data, pd.DataFrame)):
+        order = data['start'].cat.categories
+        steps = _table_steps(data, value, window)
+    else:
+        order      = pd.Index(list(dict.fromkeys(node for graph in data for node in graph)), dtype=object, tupleize_cols=False)
+        date_times = date_times or [graph.graph.get('date_time', i) for i, graph in enumerate(data)]
+        steps      = _graph_steps(data, order, value, date_times)
+
+    tracked    = np.full(len(order), -1, dtype=np.int64)
+    next_label = 0
+    labels, stability = [], []
+    for date_time, nodes, flows in steps:
+        begin    = time.perf_counter()
+        weights  = symmetrize(flows)
+        previous = tracked[nodes]
+        init     = None
+        if(warm_start and (previous >= 0).any()):
+            init = np.where(previous >= 0, previous, previous.max() + 1 + np.arange(len(nodes)))
+        communities, info = louvain(weights, init, resolution, seed)
+        current, next_label = _track(communities, previous, next_label)
+
+        common   = previous >= 0
+        metrics  = compare_partitions(previous[common], current[common]) if common.any() else {'nmi': np.nan, 'ari': np.nan}
+        before   = set(tracked[tracked >= 0].tolist())
+        after    = set(current.tolist())
+        tracked[:]     = -1
+        tracked[nodes] = current
+        labels.append(pd.DataFrame({'date_time': date_time, 'node': pd.Categorical.from_codes(nodes, categories=order), 'community': current.astype(np.int32)}))
+        stability.append({'date_time': date_time, 'nodes': len(nodes), 'edges': flows.nnz, 'communities': len(after), 'modularity': info['modularity'], **metrics,
+                          'changed': float(np.mean(previous[common] != current[common])) if common.any() else np.nan,
+                          'appeared': len(after - before), 'vanished': len(before - after), 'levels': info['levels'], 'sweeps': info['sweeps'],
+                          'seconds': time.perf_counter() - begin})
+    instrument.annotate(steps=len(stability), nodes=len(order))
+
+    if(not labels):
+        return pd.DataFrame(columns=['date_time', 'node', 'community']), pd.DataFrame(columns=['nodes', 'edges', 'communities', 'modularity']).rename_axis('date_time')
+    return pd.concat(labels, ignore_index=True), pd.DataFrame(stability).set_index('date_time')
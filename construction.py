@@ -1,10 +1,12 @@
 import analytics
-import csv
-import itertools
+import instrument
 import re
+import rki
 import settings
 import utility
+import validate
 import networkx  as     nx
+import numpy     as     np
 import pandas    as     pd
 from   functools import reduce
 from   pathlib   import Path
@@ -12,286 +14,338 @@ from   networkx  import Graph
 from   networkx  import DiGraph
 from   typing  import List, Set, Dict, Tuple, Optional
 
+# Optional Facebook columns (crisis vs. baseline statistics), loaded with baseline=True
+MOVEMENT_BASELINE_COLUMNS   = ['n_baseline', 'n_difference', 'percent_change', 'z_score']
+POPULATION_BASELINE_COLUMNS = ['n_baseline', 'n_difference', 'percent_change', 'clipped_z_score']
+
+# Columns (name: dtype) read and validated by the graph loaders
+MOVEMENT_COLUMNS         = {'date_time': str, 'tile_size': int, 'country': str, 'start_lat': float, 'start_lon': float, 'start_polygon_id': int, 'start_polygon_name': str,
+                            'start_quadkey': str, 'end_lat': float, 'end_lon': float, 'end_polygon_id': int, 'end_polygon_name': str, 'end_quadkey': str, 'n_crisis': int, 'length_km': float}
+ADMIN_MOVEMENT_COLUMNS   = {'date_time': str, 'tile_size': int, 'country': str, 'start_lat': float, 'start_lon': float, 'start_polygon_id': int, 'start_polygon_name': str,
+                            'end_lat': float, 'end_lon': float, 'end_polygon_id': int, 'end_polygon_name': str, 'n_crisis': int, 'length_km': float}
+POPULATION_COLUMNS       = {'date_time': str, 'quadkey': str, 'lat': float, 'lon': float, 'country': str, 'n_crisis': float}
+ADMIN_POPULATION_COLUMNS = {'date_time': str, 'lat': float, 'lon': float, 'country': str, 'polygon_name': str, 'n_crisis': float}
+
+def _float(value: str) -> float:
+    '''
+    Converts an optional numeric .csv value, empty fields become NaN.
+    '''
+    return float(value) if value not in ('', None) else float('nan')
+
 ###########################################################################
 ### Disclaimer - All RKI related functions work perfectly,              ###
 ### but RKI data set is inconsistent (missing/added columns over time). ###
 ### Consistency starts around 2020-06-01+.                              ###
 ###########################################################################
 
-def movement_graph(path: str, country: str = None) -> DiGraph:
+@instrument.timed('construction')
+def movement_graph(path: str, country: str = None, baseline: bool = False) -> DiGraph:
     '''
     Creates a movement graph from a .csv file at <path>
 
     Args:
-        path:    path pointing to the .csv file
-        country: country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        path:     path pointing to the .csv file (plain, .gz/.zst compressed or member of a .zip archive, see utility.open_text)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally store MOVEMENT_BASELINE_COLUMNS as edge properties
         
     Returns:
-        graph: DiGraph data structure
+        graph: DiGraph data structure, None if the file could not be read
     '''    
-    
-    with open(Path(path), encoding='utf8') as csvfile:
-        dict_reader = csv.DictReader(csvfile, delimiter=',')  
-        
-        edges, nodes = [], []
-        
-        for row in dict_reader:
-            try:
-                date_time          = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
-                tile_size          = int(row['tile_size'])
-                file               = path.name
-                _country           = row['country']
-                start_lat          = float(row['start_lat'])
-                start_lon          = float(row['start_lon'])
-                start_polygon_id   = int(row['start_polygon_id'])
-                start_polygon_name = row['start_polygon_name']
-                start_quadkey      = row['start_quadkey']
-                end_lat            = float(row['end_lat'])
-                end_lon            = float(row['end_lon'])
-                end_polygon_id     = int(row['end_polygon_id'])
-                end_polygon_name   = row['end_polygon_name']
-                end_quadkey        = row['end_quadkey']
-                n_crisis           = int(row['n_crisis'])
-                length_km          = float(row['length_km'])
-            except:
-                print(f'[ERROR] Unable to read data.')
-                return None
-                
-            if(country and country != _country):
-                continue
-                
-            graph_properties = {
-                'date_time': date_time,
-                'tile_size': tile_size,
-                'mov_file':  file,
-            }
-            start_node_properties = {
-                'lat':          start_lat,
-                'lon':          start_lon,
-                'polygon_id':   start_polygon_id,
-                'polygon_name': start_polygon_name,
-                'country':      _country,
-            }
-            end_node_properties   = {
-                'lat':          end_lat,
-                'lon':          end_lon,
-                'polygon_id':   end_polygon_id,
-                'polygon_name': end_polygon_name,
-                'country':      _country,
-            }
-            edge_properties  = {
-                'n_crisis':  n_crisis,
-                'length_km': length_km,
-            }
-                
-            start_node = (start_quadkey, start_node_properties)
-            end_node   = (end_quadkey, end_node_properties)    
-            nodes.extend([start_node, end_node])
-            edges.append((start_quadkey, end_quadkey, edge_properties))
-                       
+    columns = {**MOVEMENT_COLUMNS, **(dict.fromkeys(MOVEMENT_BASELINE_COLUMNS, float) if baseline else {})}
+    try:
+        rows, errors = validate.read_valid(path, columns)
+    except (OSError, ValueError):
+        instrument.error(f'Unable to read file at location {path}.')
+        return None
+    rows = validate.convert(rows, columns)
+    edges, nodes = [], []
+    dropped      = 0
+    graph_properties = {'mov_file': Path(path).name}
+
+    for row in rows.to_dict('records'):
+        date_time          = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
+        tile_size          = int(row['tile_size'])
+        _country           = row['country']
+        start_lat          = float(row['start_lat'])
+        start_lon          = float(row['start_lon'])
+        start_polygon_id   = int(row['start_polygon_id'])
+        start_polygon_name = row['start_polygon_name']
+        start_quadkey      = row['start_quadkey']
+        end_lat            = float(row['end_lat'])
+        end_lon            = float(row['end_lon'])
+        end_polygon_id     = int(row['end_polygon_id'])
+        end_polygon_name   = row['end_polygon_name']
+        end_quadkey        = row['end_quadkey']
+        n_crisis           = int(row['n_crisis'])
+        length_km          = float(row['length_km'])
+        statistics         = {column: _float(row[column]) for column in MOVEMENT_BASELINE_COLUMNS} if baseline else {}
+            
+        if(country and country != _country):
+            dropped += 1
+            continue
+            
+        graph_properties = {
+            'date_time': date_time,
+            'tile_size': tile_size,
+            'mov_file':  Path(path).name,
+        }
+        start_node_properties = {
+            'lat':          start_lat,
+            'lon':          start_lon,
+            'polygon_id':   start_polygon_id,
+            'polygon_name': start_polygon_name,
+            'country':      _country,
+        }
+        end_node_properties   = {
+            'lat':          end_lat,
+            'lon':          end_lon,
+            'polygon_id':   end_polygon_id,
+            'polygon_name': end_polygon_name,
+            'country':      _country,
+        }
+        edge_properties  = {
+            'n_crisis':  n_crisis,
+            'length_km': length_km,
+            **statistics,
+        }
+            
+        start_node = (start_quadkey, start_node_properties)
+        end_node   = (end_quadkey, end_node_properties)    
+        nodes.extend([start_node, end_node])
+        edges.append((start_quadkey, end_quadkey, edge_properties))
+                   
+    instrument.annotate(file=str(path), rows=len(edges) + dropped + errors, dropped_country=dropped, quarantined=errors)
     graph = nx.DiGraph(**graph_properties)
     graph.add_nodes_from(nodes)
     graph.add_edges_from(edges)
     
     return graph
 
-def administrative_movement_graph(path: str, country: str = None) -> DiGraph:
+@instrument.timed('construction')
+def administrative_movement_graph(path: str, country: str = None, baseline: bool = False) -> DiGraph:
     '''
     Creates a movement graph (administrative level) from a .csv file at <path>
 
     Args:
-        path:    path pointing to the .csv file
-        country: country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        path:     path pointing to the .csv file (plain, .gz/.zst compressed or member of a .zip archive, see utility.open_text)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally store MOVEMENT_BASELINE_COLUMNS as edge properties
         
     Returns:
-        graph: DiGraph data structure
+        graph: DiGraph data structure, None if the file could not be read
     '''    
-    with open(Path(path), encoding='utf8') as csvfile:
-        dict_reader = csv.DictReader(csvfile, delimiter=',')  
-        
-        edges, nodes = [], []
-        
-        for row in dict_reader:
-            try:
-                date_time          = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
-                tile_size          = int(row['tile_size'])
-                file               = path.name
-                _country           = row['country']
-                start_lat          = float(row['start_lat'])
-                start_lon          = float(row['start_lon'])
-                start_polygon_id   = int(row['start_polygon_id'])
-                start_polygon_name = row['start_polygon_name']
-                end_lat            = float(row['end_lat'])
-                end_lon            = float(row['end_lon'])
-                end_polygon_id     = int(row['end_polygon_id'])
-                end_polygon_name   = row['end_polygon_name']
-                n_crisis           = int(row['n_crisis'])
-                length_km          = float(row['length_km'])
-            except:
-                print(f'[ERROR] Unable to read data.')
-                return None
-                
-            if(country and country != _country):
-                continue
-                
-            graph_properties = {
-                'date_time':      date_time,
-                'tile_size':      tile_size,
-                'mov_admin_file': file,
-            }
-            start_node_properties = {
-                'polygon_id':   start_polygon_id,
-                'polygon_name': start_polygon_name,
-                'country':      _country,
-            }
-            end_node_properties   = {
-                'polygon_id':   end_polygon_id,
-                'polygon_name': end_polygon_name,
-                'country':      _country,
-            }
-            edge_properties  = {
-                'n_crisis':  n_crisis,
-                'length_km': length_km,
-            }
-            start_node_id = (start_lat, start_lon)
-            end_node_id = (end_lat, end_lon)
-            start_node = (start_node_id, start_node_properties)
-            end_node   = (end_node_id, end_node_properties)
+    columns = {**ADMIN_MOVEMENT_COLUMNS, **(dict.fromkeys(MOVEMENT_BASELINE_COLUMNS, float) if baseline else {})}
+    try:
+        rows, errors = validate.read_valid(path, columns)
+    except (OSError, ValueError):
+        instrument.error(f'Unable to read file at location {path}.')
+        return None
+    rows = validate.convert(rows, columns)
+    edges, nodes = [], []
+    dropped      = 0
+    graph_properties = {'mov_admin_file': Path(path).name}
+
+    for row in rows.to_dict('records'):
+        date_time          = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
+        tile_size          = int(row['tile_size'])
+        _country           = row['country']
+        start_lat          = float(row['start_lat'])
+        start_lon          = float(row['start_lon'])
+        start_polygon_id   = int(row['start_polygon_id'])
+        start_polygon_name = row['start_polygon_name']
+        end_lat            = float(row['end_lat'])
+        end_lon            = float(row['end_lon'])
+        end_polygon_id     = int(row['end_polygon_id'])
+        end_polygon_name   = row['end_polygon_name']
+        n_crisis           = int(row['n_crisis'])
+        length_km          = float(row['length_km'])
+        statistics         = {column: _float(row[column]) for column in MOVEMENT_BASELINE_COLUMNS} if baseline else {}
             
-            nodes.extend([start_node, end_node])
-            edges.append((start_node_id, end_node_id, edge_properties))
-                       
+        if(country and country != _country):
+            dropped += 1
+            continue
+            
+        graph_properties = {
+            'date_time':      date_time,
+            'tile_size':      tile_size,
+            'mov_admin_file': Path(path).name,
+        }
+        start_node_properties = {
+            'polygon_id':   start_polygon_id,
+            'polygon_name': start_polygon_name,
+            'country':      _country,
+        }
+        end_node_properties   = {
+            'polygon_id':   end_polygon_id,
+            'polygon_name': end_polygon_name,
+            'country':      _country,
+        }
+        edge_properties  = {
+            'n_crisis':  n_crisis,
+            'length_km': length_km,
+            **statistics,
+        }
+        start_node_id = (start_lat, start_lon)
+        end_node_id = (end_lat, end_lon)
+        start_node = (start_node_id, start_node_properties)
+        end_node   = (end_node_id, end_node_properties)
+        
+        nodes.extend([start_node, end_node])
+        edges.append((start_node_id, end_node_id, edge_properties))
+                   
+    instrument.annotate(file=str(path), rows=len(edges) + dropped + errors, dropped_country=dropped, quarantined=errors)
     graph = nx.DiGraph(**graph_properties)
     graph.add_nodes_from(nodes)
     graph.add_edges_from(edges)
     
     return graph
    
-def population_graph(path: str, country: str = None) -> Graph:
+@instrument.timed('construction')
+def population_graph(path: str, country: str = None, baseline: bool = False) -> Graph:
     '''
     Creates a population graph from a .csv file at <path>
 
     Args:
-        path:    path pointing to the .csv file
-        country: country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        path:     path pointing to the .csv file (plain, .gz/.zst compressed or member of a .zip archive, see utility.open_text)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally store POPULATION_BASELINE_COLUMNS as node properties
         
     Returns:
-        graph: Graph data structure
+        graph: Graph data structure, None if the file could not be read
     ''' 
-    nodes = []
-
-    with open(Path(path), encoding='utf8') as csvfile:
-        dict_reader = csv.DictReader(csvfile, delimiter=',')
-        for row in dict_reader:
-            try:
-                date_time  = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
-                quadkey    = row['quadkey']
-                lat        = float(row['lat'])
-                lon        = float(row['lon'])
-                _country    = row['country']
-                population = float(row['n_crisis'])
-            except:
-                continue
-                
-            if(country and country != _country):
-                continue
+    columns = {**POPULATION_COLUMNS, **(dict.fromkeys(POPULATION_BASELINE_COLUMNS, float) if baseline else {})}
+    try:
+        rows, errors = validate.read_valid(path, columns)
+    except (OSError, ValueError):
+        instrument.error(f'Unable to read file at location {path}.')
+        return None
+    rows = validate.convert(rows, columns)
+    nodes   = []
+    dropped = 0
+    graph_properties = {'pop_file': Path(path).name}
+
+    for row in rows.to_dict('records'):
+        date_time  = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
+        quadkey    = row['quadkey']
+        lat        = float(row['lat'])
+        lon        = float(row['lon'])
+        _country    = row['country']
+        population = float(row['n_crisis'])
+        statistics = {column: _float(row[column]) for column in POPULATION_BASELINE_COLUMNS} if baseline else {}
             
-            graph_properties = {
-                'date_time': date_time,
-                'tile_size': len(str(quadkey)),
-                'pop_file':  Path(path).name,
-            }
-            node_properties = {
-                'lat':        lat,
-                'lon':        lon,
-                'country':    _country,
-                'population': population,
-            }
-            node = (quadkey, node_properties)
-            nodes.append(node)
+        if(country and country != _country):
+            dropped += 1
+            continue
         
+        graph_properties = {
+            'date_time': date_time,
+            'tile_size': len(str(quadkey)),
+            'pop_file':  Path(path).name,
+        }
+        node_properties = {
+            'lat':        lat,
+            'lon':        lon,
+            'country':    _country,
+            'population': population,
+            **statistics,
+        }
+        node = (quadkey, node_properties)
+        nodes.append(node)
+    
+    instrument.annotate(file=str(path), rows=len(nodes) + dropped + errors, dropped_country=dropped, quarantined=errors)
     graph = nx.Graph(**graph_properties)
     graph.add_nodes_from(nodes)
         
     return graph
 
-def administrative_population_graph(path: str, country = None) -> Graph:
+@instrument.timed('construction')
+def administrative_population_graph(path: str, country = None, baseline: bool = False) -> Graph:
     '''
     Creates a population graph (administrative level) from a .csv file at <path>
 
     Args:
-        path:    path pointing to the .csv file
-        country: country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        path:     path pointing to the .csv file (plain, .gz/.zst compressed or member of a .zip archive, see utility.open_text)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally store POPULATION_BASELINE_COLUMNS as node properties
         
     Returns:
-        graph: Graph data structure
+        graph: Graph data structure, None if the file could not be read
     ''' 
-    nodes = []
-    with open(Path(path), encoding='utf8') as csvfile:
-        dict_reader = csv.DictReader(csvfile, delimiter=',')
-        for row in dict_reader:
-            try:
-                date_time    = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
-                lat          = float(row['lat'])
-                lon          = float(row['lon'])
-                _country     = row['country']
-                polygon_name = row['polygon_name']
-                population   = float(row['n_crisis'])
-            except:
-                continue
-            
-            if(country and country != _country):
-                continue
-            
-            graph_properties = {
-                'date_time':       date_time,
-                'pop_admin_file': Path(path).name,
-            }
-            node_properties = {
-                'country':      _country,
-                'polygon_name': polygon_name,
-                'population':   population,
-            }
-            node_id = (lat, lon)
-            node    = (node_id, node_properties)
-            nodes.append(node)
+    columns = {**ADMIN_POPULATION_COLUMNS, **(dict.fromkeys(POPULATION_BASELINE_COLUMNS, float) if baseline else {})}
+    try:
+        rows, errors = validate.read_valid(path, columns)
+    except (OSError, ValueError):
+        instrument.error(f'Unable to read file at location {path}.')
+        return None
+    rows = validate.convert(rows, columns)
+    nodes   = []
+    dropped = 0
+    graph_properties = {'pop_admin_file': Path(path).name}
+
+    for row in rows.to_dict('records'):
+        date_time    = pd.to_datetime(row['date_time'], format='%Y-%m-%d %H%M')
+        lat          = float(row['lat'])
+        lon          = float(row['lon'])
+        _country     = row['country']
+        polygon_name = row['polygon_name']
+        population   = float(row['n_crisis'])
+        statistics   = {column: _float(row[column]) for column in POPULATION_BASELINE_COLUMNS} if baseline else {}
         
+        if(country and country != _country):
+            dropped += 1
+            continue
+        
+        graph_properties = {
+            'date_time':       date_time,
+            'pop_admin_file': Path(path).name,
+        }
+        node_properties = {
+            'country':      _country,
+            'polygon_name': polygon_name,
+            'population':   population,
+            **statistics,
+        }
+        node_id = (lat, lon)
+        node    = (node_id, node_properties)
+        nodes.append(node)
+    
+    instrument.annotate(file=str(path), rows=len(nodes) + dropped + errors, dropped_country=dropped, quarantined=errors)
     graph = nx.Graph(**graph_properties)
     graph.add_nodes_from(nodes)
         
     return graph
 
+@instrument.timed('construction')
 def administrative_radiation_graph(path: str, country: str = None) -> DiGraph:
     graph = administrative_population_graph(Path(path), country).to_directed()
+    nodes = list(graph)
+    population = np.array([graph.nodes[node]['population'] for node in nodes], dtype=float)
     
-    edges = []
-    for source, destination in itertools.product(graph, graph):
-        edge = (source, destination, {'distance': analytics.orthodrome_length(*source, *destination)})
-        edges.append(edge)
-    graph.add_edges_from(edges)
+    # Pairwise orthodrome lengths, sorted per source: the population s within radius r of a source
+    # (without source and destination) is a cumulative sum up to the last node not farther than r.
+    distance = np.array([[analytics.orthodrome_length(*source, *destination) for destination in nodes] for source in nodes]).reshape(len(nodes), len(nodes))
     
     edges = []
-    for source, destination in itertools.product(graph, graph):
-        m = graph.nodes[source]['population']
-        n = graph.nodes[destination]['population']
-        r = analytics.orthodrome_length(*source, *destination)        
-        s = 0
-        for edge in graph.edges(source):
-            if(edge[1] == destination or edge[1] == source):
-                continue
-            data = graph.get_edge_data(*edge)
-            if(data['distance'] <= r):
-                s += graph.nodes[edge[1]]['population']
-        
-        p     = (m*n)/((m+s)*(m+n+s))
-        avg_T = m*p
-        
-        edges.append((source, destination, {'n_crisis': avg_T, 'probability': p}))
+    for i, source in enumerate(nodes):
+        order      = np.argsort(distance[i], kind='stable')
+        order      = order[order != i]
+        cumulative = np.concatenate([[0.0], np.cumsum(population[order])])
+        within     = cumulative[np.searchsorted(distance[i][order], distance[i], side='right')]
+        m = population[i]
+        for j, destination in enumerate(nodes):
+            n = population[j]
+            s = within[j] - (n if j != i else 0.0)
+            
+            p     = (m*n)/((m+s)*(m+n+s))
+            avg_T = m*p
+            
+            edges.append((source, destination, {'distance': distance[i, j], 'n_crisis': avg_T, 'probability': p}))
     graph.add_edges_from(edges)
     
     return graph   
     
 # If time: Add name parameter for more convenient use, add more file formats     
+@instrument.timed('construction')
 def save_graph(graph: Graph, path: str, format: str = 'GraphML'):
     '''
     Stores a graph data structure in files of type <format> at <path>.
@@ -307,10 +361,11 @@ def save_graph(graph: Graph, path: str, format: str = 'GraphML'):
         try:
             nx.write_graphml(graph, Path(path))
         except:
-            print(f'[ERROR] Unable to write graph to file at location {path}.')
+            instrument.error(f'Unable to write graph to file at location {path}.')
         return
-    print('[ERROR] Unknown data format.')  
+    instrument.error('Unknown data format.')  
     
+@instrument.timed('construction')
 def read_graph(path: str, format: str = 'GraphML') -> Graph:
     '''
     Reads a graph data structure from file of type <format> at <path>.
@@ -328,11 +383,12 @@ def read_graph(path: str, format: str = 'GraphML') -> Graph:
             graph.graph['date_time'] = pd.Timestamp(graph.graph['date_time'])
             return graph
         except:
-            print(f'[ERROR] Unable to read file at location {path}.')
+            instrument.error(f'Unable to read file at location {path}.')
             return
-    print('[ERROR] Unknown data format.')
+    instrument.error('Unknown data format.')
 
 # If time: border tiles? Add lat lon and country?    
+@instrument.timed('construction')
 def space_aggregate_population_graph(graph: Graph, delta: int = 1) -> Graph:
     '''
     Aggregates an existing population graph to arbitrarily lower tile resolution.
@@ -377,7 +433,51 @@ def space_aggregate_population_graph(graph: Graph, delta: int = 1) -> Graph:
     
     return space_aggregate_population_graph(agg_graph, delta-1)
 
+@instrument.timed('construction')
+def space_aggregate_movement_graph(graph: DiGraph, delta: int = 1, self_loops: bool = True) -> DiGraph:
+    '''
+    Aggregates a (tile level) movement graph to arbitrarily lower tile resolution.
+    Both endpoints of every edge are mapped to their parent quadkey, flows between the same parents are summed.
+
+    Args:
+        graph:      DiGraph data structure
+        delta:      change of tile level
+        self_loops: keep flows within a parent tile (as self loops)
+        
+    Returns:
+        graph: DiGraph data structure, edges with n_crisis (sum) and length_km (flow-weighted mean),
+               nodes with lat/lon of the tile center and country
+    '''
+    if(delta < 1):
+        return graph
+    tile_size = graph.graph['tile_size'] - delta
+    if(tile_size < 1):
+        instrument.error('Unable to aggregate movement graph below tile level 1.')
+        return None
+    
+    agg_edges = {}
+    for start, end, data in graph.edges.data():
+        key = (start[:tile_size], end[:tile_size])
+        if(not self_loops and key[0] == key[1]):
+            continue
+        n_crisis, flow_km = agg_edges.get(key, (0, 0.0))
+        agg_edges[key] = (n_crisis + data['n_crisis'], flow_km + data['n_crisis']*data['length_km'])
+    
+    countries = {}
+    for node, data in graph.nodes.data():
+        countries.setdefault(node[:tile_size], data.get('country'))
+    
+    agg_graph = nx.DiGraph(**dict(graph.graph, tile_size=tile_size))
+    for quadkey in sorted({key for edge in agg_edges for key in edge}):
+        lat, lon = analytics.quadkey_to_lat_lon(quadkey)
+        agg_graph.add_node(quadkey, lat=lat, lon=lon, country=countries[quadkey])
+    for (start, end), (n_crisis, flow_km) in agg_edges.items():
+        agg_graph.add_edge(start, end, n_crisis=n_crisis, length_km=flow_km/n_crisis if n_crisis else 0.0)
+    
+    return agg_graph
+
 # If time: Add parameter for slicing/timeframe
+@instrument.timed('construction')
 def time_aggregate_movement_graph(graphs: list) -> Graph:
     '''
     Aggregates a set of (administrative) movement graphs over an arbitrary timeframe.
@@ -389,7 +489,7 @@ def time_aggregate_movement_graph(graphs: list) -> Graph:
         merged_graph: DiGraph object 
     '''
     if(not graphs):
-        print('[ERROR] Empty list - no graphs to aggregate.')
+        instrument.error('Empty list - no graphs to aggregate.')
         
     agg_graph = nx.DiGraph()
     
@@ -407,6 +507,7 @@ def time_aggregate_movement_graph(graphs: list) -> Graph:
                 
     return agg_graph
     
+@instrument.timed('construction')
 def time_aggregate_admin_population_graph(graphs: List[Graph], slice: int = 3) -> Graph:
     '''
     Aggregates a set of (administrative) population graphs over an arbitrary timeframe.
@@ -419,7 +520,7 @@ def time_aggregate_admin_population_graph(graphs: List[Graph], slice: int = 3) -
         merged_graph: Graph object 
     '''
     if(not graphs):
-        print('[ERROR] Empty list - no graphs to aggregate.')
+        instrument.error('Empty list - no graphs to aggregate.')
         
     agg_graphs = []
     
@@ -441,9 +542,11 @@ def time_aggregate_admin_population_graph(graphs: List[Graph], slice: int = 3) -
         
     return agg_graphs    
    
+@instrument.timed('construction')
 def merge_population_with_movement_graph(pop_graph, mov_graph) -> DiGraph:
     '''
-    Merges (nodes, edges, graph properties of) population graph with movement graph of identical tile resolution.
+    Merges (nodes, edges, graph properties of) population graph with movement graph,
+    the graph of higher tile resolution is aggregated to the resolution of the other one.
 
     Args:
         pop_graph:  (population) Graph object
@@ -458,16 +561,355 @@ def merge_population_with_movement_graph(pop_graph, mov_graph) -> DiGraph:
     mov_tile_size = mov_graph.graph['tile_size']
     
     if(pop_date_time != mov_date_time):
-        print('[ERROR] Unable to merge graphs with different date_time.')
-        return None
-    if(pop_tile_size < mov_tile_size):
-        print('[ERROR] Unable to merge movement graph with lower resolution population graph.')
+        instrument.error('Unable to merge graphs with different date_time.')
         return None
         
     pop_graph = space_aggregate_population_graph(pop_graph, pop_tile_size - mov_tile_size)
+    mov_graph = space_aggregate_movement_graph(mov_graph, mov_tile_size - pop_tile_size)
     merged_graph = nx.compose(mov_graph, pop_graph)
     return merged_graph            
   
+###########################################################################
+### Tables - array-backed counterparts of the graphs above.             ###
+### One row per node/edge and time step, node keys stored as shared     ###
+### categoricals ('start'/'end' for movement, 'node' for population).   ###
+### Tile level keys are quadkeys, administrative keys (lat, lon) tuples ###
+### as in the graphs (polygon names are not unique).                   ###
+###########################################################################
+
+def _read_table(paths: List[str], columns: Dict, country: str = None) -> pd.DataFrame:
+    '''
+    Reads the <columns> (name: dtype) of all .csv files at <paths> into one DataFrame with parsed date_time.
+    Rows failing validation (see validate) are quarantined, the valid rows of a file are kept.
+
+    Args:
+        paths:   list of paths pointing to .csv files (plain, compressed or archive members, see utility.data_files)
+        columns: dict of column name and dtype
+        country: country code to filter rows for a single nation, e.g. 'DE' for Germany
+
+    Returns:
+        table: DataFrame of all rows, empty if no file could be read
+    '''
+    tables, rows, dropped, errors, quarantined = [], 0, 0, 0, 0
+    for path in utility.read_ahead(paths):
+        try:
+            valid, invalid = validate.read_valid(path, columns)
+        except (OSError, ValueError):
+            instrument.error(f'Unable to read file at location {path}.')
+            errors += 1
+            continue
+        table        = validate.convert(valid, columns)
+        rows        += len(table) + invalid
+        quarantined += invalid
+        if(country):
+            kept     = table['country'] == country
+            dropped += int((~kept).sum())
+            table    = table[kept]
+        tables.append(table)
+    instrument.annotate(files=len(tables), rows=rows, dropped_country=dropped, quarantined=quarantined, file_errors=errors)
+
+    if(not tables):
+        return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in columns.items()})
+
+    table = pd.concat(tables, ignore_index=True)
+    table['date_time'] = pd.to_datetime(table['date_time'], format='%Y-%m-%d %H%M')
+    return table
+
+def _categorize_nodes(table: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    '''
+    Converts node key <columns> of <table> (in place) to categoricals sharing one sorted set of categories.
+
+    Args:
+        table:   DataFrame
+        columns: names of node key columns
+
+    Returns:
+        table: DataFrame with categorical node keys
+    '''
+    keys  = [np.asarray(table[column], dtype=object) for column in columns]
+    nodes = np.unique(np.concatenate(keys)) if len(table) else np.array([], dtype=object)
+    for column, key in zip(columns, keys):
+        table[column] = pd.Categorical(key, categories=pd.Index(nodes, dtype=object, tupleize_cols=False))
+    return table
+
+def _coordinate_keys(lat: pd.Series, lon: pd.Series) -> np.ndarray:
+    '''
+    Node keys (lat, lon) of administrative rows, the node ids of the administrative graphs.
+    '''
+    return pd.MultiIndex.from_arrays([lat, lon]).to_numpy()
+
+@instrument.timed('construction')
+def movement_table(paths: List[str], country: str = None, baseline: bool = False) -> pd.DataFrame:
+    '''
+    Creates a movement table (one row per edge and time step) from a list of .csv files at <paths>.
+    Array-backed counterpart of movement_graph, node keys 'start'/'end' are quadkeys.
+
+    Args:
+        paths:    list of paths pointing to .csv files (plain, compressed or archive members, see utility.data_files)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally load MOVEMENT_BASELINE_COLUMNS (float32)
+
+    Returns:
+        table: DataFrame with one row per edge and date_time
+    '''
+    columns = {
+        'date_time':          str,
+        'tile_size':          np.int8,
+        'country':            'category',
+        'start_lat':          np.float64,
+        'start_lon':          np.float64,
+        'start_polygon_id':   np.int64,
+        'start_polygon_name': 'category',
+        'start_quadkey':      str,
+        'end_lat':            np.float64,
+        'end_lon':            np.float64,
+        'end_polygon_id':     np.int64,
+        'end_polygon_name':   'category',
+        'end_quadkey':        str,
+        'n_crisis':           np.int32,
+        'length_km':          np.float64,
+    }
+    if(baseline):
+        columns.update({column: np.float32 for column in MOVEMENT_BASELINE_COLUMNS})
+    table = _read_table(paths, columns, country)
+    table = table.rename(columns={'start_quadkey': 'start', 'end_quadkey': 'end'})
+    return _categorize_nodes(table, ['start', 'end'])
+
+@instrument.timed('construction')
+def administrative_movement_table(paths: List[str], country: str = None, baseline: bool = False) -> pd.DataFrame:
+    '''
+    Creates a movement table (administrative level) from a list of .csv files at <paths>.
+    Array-backed counterpart of administrative_movement_graph, node keys 'start'/'end' are (lat, lon) tuples as in the graph
+    (polygon names are kept as start/end_polygon_name, they are not unique, e.g. a city and the district around it).
+
+    Args:
+        paths:    list of paths pointing to .csv files (plain, compressed or archive members, see utility.data_files)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally load MOVEMENT_BASELINE_COLUMNS (float32)
+
+    Returns:
+        table: DataFrame with one row per edge and date_time
+    '''
+    columns = {
+        'date_time':          str,
+        'tile_size':          np.int8,
+        'country':            'category',
+        'start_lat':          np.float64,
+        'start_lon':          np.float64,
+        'start_polygon_id':   np.int64,
+        'start_polygon_name': 'category',
+        'end_lat':            np.float64,
+        'end_lon':            np.float64,
+        'end_polygon_id':     np.int64,
+        'end_polygon_name':   'category',
+        'n_crisis':           np.int32,
+        'length_km':          np.float64,
+    }
+    if(baseline):
+        columns.update({column: np.float32 for column in MOVEMENT_BASELINE_COLUMNS})
+    table = _read_table(paths, columns, country)
+    table.insert(1, 'start', _coordinate_keys(table['start_lat'], table['start_lon']))
+    table.insert(2, 'end',   _coordinate_keys(table['end_lat'], table['end_lon']))
+    return _categorize_nodes(table, ['start', 'end'])
+
+@instrument.timed('construction')
+def population_table(paths: List[str], country: str = None, baseline: bool = False) -> pd.DataFrame:
+    '''
+    Creates a population table (one row per node and time step) from a list of .csv files at <paths>.
+    Array-backed counterpart of population_graph, node key 'node' is the quadkey.
+
+    Args:
+        paths:    list of paths pointing to .csv files (plain, compressed or archive members, see utility.data_files)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally load POPULATION_BASELINE_COLUMNS (float32)
+
+    Returns:
+        table: DataFrame with one row per node and date_time
+    '''
+    columns = {
+        'date_time': str,
+        'quadkey':   str,
+        'lat':       np.float64,
+        'lon':       np.float64,
+        'country':   'category',
+        'n_crisis':  np.float64,
+    }
+    if(baseline):
+        columns.update({column: np.float32 for column in POPULATION_BASELINE_COLUMNS})
+    table = _read_table(paths, columns, country)
+    table = table.rename(columns={'quadkey': 'node', 'n_crisis': 'population'})
+    table = table.dropna(subset=['population'])
+    table.insert(1, 'tile_size', table['node'].str.len().astype(np.int8))
+    return _categorize_nodes(table, ['node'])
+
+@instrument.timed('construction')
+def administrative_population_table(paths: List[str], country: str = None, baseline: bool = False) -> pd.DataFrame:
+    '''
+    Creates a population table (administrative level) from a list of .csv files at <paths>.
+    Array-backed counterpart of administrative_population_graph, node key 'node' is the (lat, lon) tuple as in the graph
+    (the polygon name is kept as polygon_name, it is not unique).
+
+    Args:
+        paths:    list of paths pointing to .csv files (plain, compressed or archive members, see utility.data_files)
+        country:  country code to filter nodes for a single nation, e.g. 'DE' for Germany
+        baseline: additionally load POPULATION_BASELINE_COLUMNS (float32)
+
+    Returns:
+        table: DataFrame with one row per node and date_time
+    '''
+    columns = {
+        'date_time':    str,
+        'lat':          np.float64,
+        'lon':          np.float64,
+        'country':      'category',
+        'polygon_name': 'category',
+        'n_crisis':     np.float64,
+    }
+    if(baseline):
+        columns.update({column: np.float32 for column in POPULATION_BASELINE_COLUMNS})
+    table = _read_table(paths, columns, country)
+    table = table.rename(columns={'n_crisis': 'population'})
+    table = table.dropna(subset=['population'])
+    table.insert(1, 'node', _coordinate_keys(table['lat'], table['lon']))
+    return _categorize_nodes(table, ['node'])
+
+@instrument.timed('construction')
+def space_aggregate_population_table(table: pd.DataFrame, delta: int = 1) -> pd.DataFrame:
+    '''
+    Aggregates a (tile level) population table to arbitrarily lower tile resolution for all time steps at once.
+    Works on the quadkey categories only, rows are summed with a single groupby.
+
+    Args:
+        table: population table
+        delta: change of tile level
+
+    Returns:
+        table: population table with columns date_time, tile_size, node, population
+    '''
+    if(delta < 1 or table.empty):
+        return table
+
+    tile_size = int(table['tile_size'].max()) - delta
+    if(tile_size < 1):
+        instrument.error('Unable to aggregate population table below tile level 1.')
+        return None
+
+    parents       = table['node'].cat.categories.str[:tile_size]
+    codes, nodes  = pd.factorize(parents, sort=True)
+    parent_codes  = codes[table['node'].cat.codes.to_numpy()]
+    agg_table     = pd.DataFrame({
+        'date_time':  table['date_time'].to_numpy(),
+        'node':       pd.Categorical.from_codes(parent_codes, categories=nodes),
+        'population': table['population'].to_numpy(),
+    })
+    agg_table = agg_table.groupby(['date_time', 'node'], observed=True, sort=True)['population'].sum().reset_index()
+    agg_table.insert(1, 'tile_size', np.int8(tile_size))
+    return agg_table
+
+@instrument.timed('construction')
+def space_aggregate_movement_table(table: pd.DataFrame, delta: int = 1, self_loops: bool = True) -> pd.DataFrame:
+    '''
+    Aggregates a (tile level) movement table to arbitrarily lower tile resolution for all time steps at once.
+    Both endpoints are mapped to their parent quadkey on the categories only, flows are summed with a single groupby.
+
+    Args:
+        table:      movement table
+        delta:      change of tile level
+        self_loops: keep flows within a parent tile (as self loops)
+
+    Returns:
+        table: movement table with columns date_time, tile_size, start, end, country, n_crisis (sum),
+               length_km (flow-weighted mean), start_lat/lon, end_lat/lon (tile centers)
+               and, if loaded, n_baseline, n_difference (sums) and percent_change
+    '''
+    if(delta < 1 or table.empty):
+        return table
+
+    tile_size = int(table['tile_size'].max()) - delta
+    if(tile_size < 1):
+        instrument.error('Unable to aggregate movement table below tile level 1.')
+        return None
+
+    parents      = table['start'].cat.categories.str[:tile_size]
+    codes, nodes = pd.factorize(parents, sort=True)
+    start        = codes[table['start'].cat.codes.to_numpy()]
+    end          = codes[table['end'].cat.codes.to_numpy()]
+    kept         = np.ones(len(table), dtype=bool) if self_loops else start != end
+
+    sums     = [column for column in ('n_crisis', 'n_baseline', 'n_difference') if column in table.columns]
+    n_crisis = table['n_crisis'].to_numpy()
+    agg_table = pd.DataFrame({
+        'date_time': table['date_time'].to_numpy()[kept],
+        'start':     start[kept],
+        'end':       end[kept],
+        'country':   table['country'].to_numpy()[kept],
+        **{column: table[column].to_numpy()[kept] for column in sums},
+        'flow_km':   (n_crisis*table['length_km'].to_numpy())[kept],
+    }).groupby(['date_time', 'start', 'end', 'country'], observed=True, sort=True).sum().reset_index()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        agg_table['length_km'] = np.where(agg_table['n_crisis'] > 0, agg_table['flow_km']/agg_table['n_crisis'], 0.0)
+        if('n_baseline' in sums):
+            agg_table['percent_change'] = 100*agg_table['n_difference']/agg_table['n_baseline'].where(agg_table['n_baseline'] > 0)
+    agg_table = agg_table.drop(columns='flow_km')
+
+    centers = np.array([analytics.quadkey_to_lat_lon(node) for node in nodes]).reshape(-1, 2)
+    for side in ('start', 'end'):
+        codes = agg_table[side].to_numpy()
+        agg_table[f'{side}_lat'] = centers[codes, 0]
+        agg_table[f'{side}_lon'] = centers[codes, 1]
+        agg_table[side] = pd.Categorical.from_codes(codes, categories=nodes)
+    agg_table.insert(1, 'tile_size', np.int8(tile_size))
+    return agg_table
+
+@instrument.timed('construction')
+def merge_population_with_movement_table(pop_table: pd.DataFrame, mov_table: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Joins a population table with a movement table for all time steps at once, the table of higher tile resolution
+    is aggregated to the resolution of the other one. Array-backed replacement of merge_population_with_movement_graph, no graph is copied.
+
+    Args:
+        pop_table: population table (any number of time steps)
+        mov_table: movement table   (any number of time steps)
+
+    Returns:
+        edges: movement rows with additional columns origin_population, destination_population
+        nodes: columns date_time, node, population, inflow, outflow, net_flow (inflow - outflow)
+    '''
+    if(pop_table.empty or mov_table.empty):
+        instrument.error('Empty table - nothing to merge.')
+        return None
+
+    pop_tile_size = int(pop_table['tile_size'].max())
+    mov_tile_size = int(mov_table['tile_size'].max())
+
+    pop_table = space_aggregate_population_table(pop_table, pop_tile_size - mov_tile_size)
+    mov_table = space_aggregate_movement_table(mov_table, mov_tile_size - pop_tile_size)
+
+    nodes      = mov_table['start'].cat.categories.union(pop_table['node'].cat.categories)
+    start      = mov_table['start'].cat.set_categories(nodes)
+    end        = mov_table['end'].cat.set_categories(nodes)
+    population = pd.Series(
+        pop_table['population'].to_numpy(),
+        index=pd.MultiIndex.from_arrays([pop_table['date_time'], pop_table['node'].cat.set_categories(nodes)]),
+    )
+    population = population.groupby(level=[0, 1], observed=True).sum()
+
+    edges = mov_table.copy(deep=False)
+    edges['start'], edges['end'] = start, end
+    edges['origin_population']      = population.reindex(pd.MultiIndex.from_arrays([edges['date_time'], start])).to_numpy()
+    edges['destination_population'] = population.reindex(pd.MultiIndex.from_arrays([edges['date_time'], end])).to_numpy()
+
+    outflow = edges.groupby(['date_time', 'start'], observed=True)['n_crisis'].sum().rename_axis(['date_time', 'node'])
+    inflow  = edges.groupby(['date_time', 'end'], observed=True)['n_crisis'].sum().rename_axis(['date_time', 'node'])
+    nodes   = pd.concat([population.rename_axis(['date_time', 'node']).rename('population'), inflow.rename('inflow'), outflow.rename('outflow')], axis=1)
+    nodes[['inflow', 'outflow']] = nodes[['inflow', 'outflow']].fillna(0)
+    nodes['net_flow'] = nodes['inflow'] - nodes['outflow']
+    nodes = nodes.sort_index().reset_index()
+
+    return edges, nodes
+
+@instrument.timed('construction')
 def cumulated_infected(start_date: str = '2020-06-01', end_date: str = '', **kwargs) -> int:
     '''
     Calculates the number of infected people within <start_date> and <end_date> (both dates inclusive).
@@ -477,6 +919,7 @@ def cumulated_infected(start_date: str = '2020-06-01', end_date: str = '', **kwa
         start_date: date-string of format 'DD.MM.YY'
         end_date:   date-string of format 'DD.MM.YY'
         kwargs:     filter for values of columns in .csv file, e.g. Bundesland='Bayern' or Altersgruppe='A15-A34'
+                    (filters on Bundesland, Landkreis and Altersgruppe only are answered from the publication's cube, see rki)
         
     Returns:
         count: number of infected people 
@@ -489,6 +932,8 @@ def cumulated_infected(start_date: str = '2020-06-01', end_date: str = '', **kwa
     
     path = Path(f"{settings.paths['RKI']}/{end.month_name()}{end.year}/RKI_COVID19_{end.date()}.csv")
     print(path)
+    if(set(kwargs) <= set(rki.DIMENSIONS[1:])):
+        return rki.cumulated('infected', start_date, end_date, **kwargs)
     col  = ['AnzahlFall', 'NeuerFall', 'Meldedatum'] + list(kwargs)
     
     df = pd.read_csv(path, usecols=col, parse_dates=['Meldedatum'])
@@ -497,9 +942,10 @@ def cumulated_infected(start_date: str = '2020-06-01', end_date: str = '', **kwa
     for key, value in kwargs.items():
         mask &= (df[key] == value)
     
-    count = df.loc[mask].sum()['AnzahlFall']
+    count = df.loc[mask, 'AnzahlFall'].sum()
     return count
     
+@instrument.timed('construction')
 def cumulated_recovered(start_date: str = '2020-06-01', end_date: str = '', **kwargs) -> int:
     '''
     Calculates the number of recovered people within <start_date> and <end_date> (both dates inclusive).
@@ -509,6 +955,7 @@ def cumulated_recovered(start_date: str = '2020-06-01', end_date: str = '', **kw
         start_date: date-string of format 'YYYY-MM-DD'
         end_date:   date-string of format 'YYYY-MM-DD'
         kwargs:     filter for values of columns in .csv file, e.g. Bundesland='Bayern' or Altersgruppe='A15-A34'
+                    (filters on Bundesland, Landkreis and Altersgruppe only are answered from the publication's cube, see rki)
         
     Returns:
         count: number of recovered people 
@@ -520,6 +967,8 @@ def cumulated_recovered(start_date: str = '2020-06-01', end_date: str = '', **kw
         end = pd.Timestamp.now().normalize()
         
     path  = Path(f"{settings.paths['RKI']}/{end.month_name()}{end.year}/RKI_COVID19_{end.date()}.csv")
+    if(set(kwargs) <= set(rki.DIMENSIONS[1:])):
+        return rki.cumulated('recovered', start_date, end_date, **kwargs)
     col   = ['AnzahlGenesen', 'NeuGenesen', 'Meldedatum'] + list(kwargs)
     df    = pd.read_csv(path, usecols=col, parse_dates=['Meldedatum'])
     
@@ -527,9 +976,10 @@ def cumulated_recovered(start_date: str = '2020-06-01', end_date: str = '', **kw
     for key, value in kwargs.items():
         mask &= (df[key] == value)
     
-    count = df.loc[mask].sum()['AnzahlGenesen']
+    count = df.loc[mask, 'AnzahlGenesen'].sum()
     return count
 
+@instrument.timed('construction')
 def cumulated_dead(start_date: str = '2020-06-01', end_date: str = '', **kwargs) -> int:
     '''
     Calculates the number of deaths within <start_date> and <end_date> (both dates inclusive).
@@ -539,6 +989,7 @@ def cumulated_dead(start_date: str = '2020-06-01', end_date: str = '', **kwargs)
         start_date: date-string of format 'YYYY-MM-DD'
         end_date:   date-string of format 'YYYY-MM-DD'
         kwargs:     filter for values of columns in .csv file, e.g. Bundesland='Bayern' or Altersgruppe='A15-A34'
+                    (filters on Bundesland, Landkreis and Altersgruppe only are answered from the publication's cube, see rki)
         
     Returns:
         count: number of deaths
@@ -550,6 +1001,8 @@ def cumulated_dead(start_date: str = '2020-06-01', end_date: str = '', **kwargs)
         end = pd.Timestamp.now().normalize()
     
     path  = Path(f"{settings.paths['RKI']}/{end.month_name()}{end.year}/RKI_COVID19_{end.date()}.csv")
+    if(set(kwargs) <= set(rki.DIMENSIONS[1:])):
+        return rki.cumulated('dead', start_date, end_date, **kwargs)
     col   = ['AnzahlTodesfall', 'NeuerTodesfall', 'Meldedatum'] + list(kwargs)
     df    = pd.read_csv(path, usecols=col, parse_dates=['Meldedatum'])
     
@@ -557,9 +1010,10 @@ def cumulated_dead(start_date: str = '2020-06-01', end_date: str = '', **kwargs)
     for key, value in kwargs.items(): 
         mask &= (df[key] == value)
         
-    count = df.loc[mask].sum()['AnzahlTodesfall']
+    count = df.loc[mask, 'AnzahlTodesfall'].sum()
     return count
     
+@instrument.timed('construction')
 def currently_infected(date: str = '', **kwargs) -> int:
     '''
     Calculates the number of infected people until <date> (date inclusive).
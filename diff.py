@@ -0,0 +1,157 @@
+import instrument
+import numpy    as np
+import pandas   as pd
+from   typing   import List, Tuple
+
+'''
+Temporal diff of movement and population tables: every time step (or window, e.g. a week) is compared with the one
+<lag> steps earlier in one call for the whole sequence. Keys of all time steps are encoded as one integer
+(time step, node / edge) and merged by sorting, instead of set operations over graph.edges per pair of graphs.
+Results list appeared, disappeared and persisting nodes/edges with the value before and after, delta and ratio.
+
+Usage:
+    edges   = diff.diff_edges(mov_table)                   # 00:00 -> 08:00 -> 16:00 -> ...
+    weekly  = diff.diff_edges(mov_table, window='W')       # this week vs. last week
+    nodes   = diff.diff_nodes(pop_table, lag=3)            # same time of day, previous day
+    summary = diff.diff_summary(edges)
+'''
+
+STATUS = ['appeared', 'disappeared', 'persisted']
+
+def _value(table: pd.DataFrame) -> str:
+    return 'n_crisis' if 'n_crisis' in table.columns else 'population'
+
+def _codes(columns: List[pd.Series]) -> Tuple[List[np.ndarray], pd.Index]:
+    '''
+    Node codes of node key <columns> (categoricals sharing their categories, or any values) and the node categories.
+    '''
+    if(all(isinstance(column.dtype, pd.CategoricalDtype) and column.cat.categories.equals(columns[0].cat.categories) for column in columns)):
+        return [column.cat.codes.to_numpy().astype(np.int64) for column in columns], columns[0].cat.categories
+    codes, nodes = pd.factorize(pd.concat([column.astype(object) for column in columns], ignore_index=True), sort=True)
+    return np.split(codes.astype(np.int64), len(columns)), nodes
+
+def _steps(table: pd.DataFrame, window: str = None) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+    date_time = table['date_time']
+    if(window):
+        date_time = date_time.dt.to_period(window).dt.start_time
+    steps, times = pd.factorize(date_time, sort=True)
+    return steps.astype(np.int64), pd.DatetimeIndex(times)
+
+def _merge(step: np.ndarray, key: np.ndarray, value: np.ndarray, size: int, steps: int, lag: int) -> Tuple:
+    '''
+    Sorted-key merge of every time step with the time step <lag> steps earlier.
+    Rows sharing a (step, key) pair are summed.
+
+    Args:
+        step:  time step of each row
+        key:   key (node or edge code, < <size>) of each row
+        value: value of each row
+        size:  number of possible keys
+        steps: number of time steps
+        lag:   number of time steps between the compared steps
+
+    Returns:
+        step:   time step of each merged pair (>= lag)
+        key:    key of each merged pair
+        before: summed value at step - lag (0 if absent)
+        after:  summed value at step (0 if absent)
+        status: code of STATUS
+    '''
+    current  = step*size + key
+    shifted  = step + lag < steps
+    previous = (step[shifted] + lag)*size + key[shifted]
+    codes, inverse = np.unique(np.concatenate([current, previous]), return_inverse=True)
+    now, earlier   = inverse[:len(current)], inverse[len(current):]
+
+    after   = np.bincount(now, value, len(codes))
+    before  = np.bincount(earlier, value[shifted], len(codes))
+    present = np.bincount(now, minlength=len(codes)) > 0
+    past    = np.bincount(earlier, minlength=len(codes)) > 0
+    status  = np.where(~past, 0, np.where(~present, 1, 2)).astype(np.int8)
+
+    step = codes // size
+    kept = step >= lag
+    return step[kept], codes[kept] % size, before[kept], after[kept], status[kept]
+
+def _changes(times: pd.DatetimeIndex, step: np.ndarray, lag: int, keys: List[Tuple[str, np.ndarray]], before: np.ndarray, after: np.ndarray, status: np.ndarray) -> pd.DataFrame:
+    changes = pd.DataFrame({'date_time': times[step], 'previous': times[step - lag], **dict(keys)})
+    changes['before'] = before
+    changes['after']  = after
+    changes['delta']  = after - before
+    with np.errstate(divide='ignore', invalid='ignore'):
+        changes['ratio'] = np.where(before > 0, after/before, np.nan)
+    changes['status'] = pd.Categorical.from_codes(status, categories=STATUS)
+    return changes
+
+@instrument.timed('diff')
+def diff_edges(table: pd.DataFrame, lag: int = 1, window: str = None, value: str = 'n_crisis') -> pd.DataFrame:
+    '''
+    Compares the edges of every time step of a movement table with the time step <lag> steps earlier.
+
+    Args:
+        table:  movement table (construction.movement_table, administrative_movement_table or coarsened/rolled up tables)
+        lag:    number of time steps between the compared steps (e.g. 3: same time of day on the previous day)
+        window: compare sums over windows of this period instead of single time steps, e.g. 'D' (day), 'W' (week), 'M' (month)
+        value:  flow column, e.g. 'n_crisis' or 'n_baseline'
+
+    Returns:
+        changes: one row per edge present in either step with columns date_time, previous (date_time of the compared step),
+                 start, end, before, after (flows, 0 if absent), delta (after - before), ratio (after / before, NaN if
+                 before is 0) and status (appeared, disappeared or persisted), sorted by date_time, start, end
+    '''
+    (start, end), nodes = _codes([table['start'], table['end']])
+    steps, times = _steps(table, window)
+    size         = np.int64(len(nodes))
+    instrument.annotate(rows=len(table), steps=len(times))
+
+    step, key, before, after, status = _merge(steps, start*size + end, table[value].to_numpy(dtype=np.float64), size*size, len(times), lag)
+    keys = [('start', pd.Categorical.from_codes(key // size, categories=nodes)), ('end', pd.Categorical.from_codes(key % size, categories=nodes))]
+    return _changes(times, step, lag, keys, before, after, status)
+
+@instrument.timed('diff')
+def diff_nodes(table: pd.DataFrame, lag: int = 1, window: str = None, value: str = None) -> pd.DataFrame:
+    '''
+    Compares the nodes of every time step of a population or movement table with the time step <lag> steps earlier.
+    A node of a movement table is present if it is the start or end of an edge, its value is the outgoing flow.
+
+    Args:
+        table:  population table (node, population) or movement table (start, end, n_crisis)
+        lag:    number of time steps between the compared steps (e.g. 3: same time of day on the previous day)
+        window: compare sums over windows of this period instead of single time steps, e.g. 'D' (day), 'W' (week), 'M' (month)
+        value:  value column (default: population, or n_crisis of movement tables)
+
+    Returns:
+        changes: one row per node present in either step with columns date_time, previous, node, before, after,
+                 delta, ratio and status (see diff_edges), sorted by date_time, node
+    '''
+    value        = value or _value(table)
+    steps, times = _steps(table, window)
+    instrument.annotate(rows=len(table), steps=len(times))
+    if('node' in table.columns):
+        (node,), nodes = _codes([table['node']])
+        values         = table[value].to_numpy(dtype=np.float64)
+    else:
+        (start, end), nodes = _codes([table['start'], table['end']])
+        node   = np.concatenate([start, end])
+        steps  = np.concatenate([steps, steps])
+        values = np.concatenate([table[value].to_numpy(dtype=np.float64), np.zeros(len(table))])
+
+    step, key, before, after, status = _merge(steps, node, values, np.int64(len(nodes)), len(times), lag)
+    return _changes(times, step, lag, [('node', pd.Categorical.from_codes(key, categories=nodes))], before, after, status)
+
+def diff_summary(changes: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Number of appeared, disappeared and persisting nodes/edges and total values per time step.
+
+    Args:
+        changes: output of diff_edges or diff_nodes
+
+    Returns:
+        summary: indexed by date_time, columns previous, appeared, disappeared, persisted, before, after, delta, ratio
+    '''
+    counts  = changes.groupby(['date_time', 'status'], observed=False).size().unstack('status', fill_value=0).reindex(columns=STATUS, fill_value=0)
+    summary = changes.groupby('date_time').agg(previous=('previous', 'first'), before=('before', 'sum'), after=('after', 'sum'))
+    summary = summary[['previous']].join(counts).join(summary[['before', 'after']])
+    summary['delta'] = summary['after'] - summary['before']
+    summary['ratio'] = summary['after']/summary['before'].where(summary['before'] > 0)
+    return summary
@@ -0,0 +1,269 @@
+import instrument
+import spatial
+import numpy    as np
+import pandas   as pd
+from   typing   import Dict, List
+
+'''
+Gravity models fitted to observed movement flows (n_crisis) of all time steps of a movement table in one batch,
+at tile or administrative level, compared with the parameter-free radiation model (construction.administrative_radiation_graph).
+
+Models (T: flow from i to j, m_i/m_j: masses of origin/destination, d: length_km of the edge):
+    'power':       T = K * m_i^alpha * m_j^beta * d^-gamma
+    'exponential': T = K * m_i^alpha * m_j^beta * exp(-d/scale_km)
+
+Masses are the populations of a population table (same nodes as the movement table), or, without population table,
+the observed outflow of the origin and inflow of the destination. Self loops and empty or zero-length edges are not fitted.
+Parameters of all time steps are estimated together: the normal equations of every time step are accumulated with
+bincounts and solved as one stack of 4x4 systems (least squares on log flows or Poisson regression by IRLS).
+
+Usage:
+    parameters = gravity.fit(mov_table, 'power')
+    report     = gravity.compare(mov_table)
+'''
+
+MODELS = ('power', 'exponential')
+
+def _mass_lookup(step: np.ndarray, node: np.ndarray, value: np.ndarray, size: int, steps: int) -> np.ndarray:
+    '''
+    Dense (time step x node) array of summed <value>, NaN where a node has no value in a time step.
+    '''
+    keys  = step.astype(np.int64)*size + node
+    mass  = np.bincount(keys, value, steps*size)
+    known = np.bincount(keys, minlength=steps*size) > 0
+    return np.where(known, mass, np.nan).reshape(steps, size)
+
+@instrument.timed('gravity')
+def prepare(table: pd.DataFrame, pop_table: pd.DataFrame = None) -> Dict:
+    '''
+    Extracts the arrays used for fitting from a movement table.
+
+    Args:
+        table:     movement table (construction.movement_table, administrative_movement_table, or coarsened/rolled up tables)
+        pop_table: optional population table of the same node keys (tile level: same tile size as <table>)
+
+    Returns:
+        flows: dict of arrays step, origin, destination (node codes), flow, distance, m_origin, m_destination,
+               mass (time step x node), outflow (time step x node) and times, nodes, lat, lon (node coordinates)
+    '''
+    steps, times = pd.factorize(table['date_time'], sort=True)
+    nodes  = table['start'].cat.categories
+    size   = len(nodes)
+    origin = table['start'].cat.codes.to_numpy().astype(np.int64)
+    target = table['end'].cat.codes.to_numpy().astype(np.int64)
+    flow   = table['n_crisis'].to_numpy(dtype=np.float64)
+    length = table['length_km'].to_numpy(dtype=np.float64)
+    fitted = (origin != target) & (flow > 0) & (length > 0)
+
+    outflow = _mass_lookup(steps[fitted], origin[fitted], flow[fitted], size, len(times))
+    if(pop_table is not None):
+        pop_steps = times.get_indexer(pop_table['date_time'])
+        pop_nodes = nodes.get_indexer(pop_table['node'].astype(object))
+        known     = (pop_steps >= 0) & (pop_nodes >= 0)
+        mass      = _mass_lookup(pop_steps[known], pop_nodes[known], pop_table['population'].to_numpy(dtype=np.float64)[known], size, len(times))
+        m_origin  = mass.ravel()[steps*size + origin]
+        m_target  = mass.ravel()[steps*size + target]
+    else:
+        inflow    = _mass_lookup(steps[fitted], target[fitted], flow[fitted], size, len(times))
+        mass      = outflow
+        m_origin  = outflow.ravel()[steps*size + origin]
+        m_target  = inflow.ravel()[steps*size + target]
+    fitted &= (m_origin > 0) & (m_target > 0)
+    instrument.annotate(rows=len(table), fitted=int(fitted.sum()))
+
+    coordinates = pd.DataFrame({
+        'node': np.concatenate([origin, target]),
+        'lat':  np.concatenate([table['start_lat'].to_numpy(), table['end_lat'].to_numpy()]),
+        'lon':  np.concatenate([table['start_lon'].to_numpy(), table['end_lon'].to_numpy()]),
+    }).drop_duplicates('node').set_index('node').reindex(np.arange(size))
+
+    return {
+        'step':          steps[fitted],
+        'origin':        origin[fitted],
+        'destination':   target[fitted],
+        'flow':          flow[fitted],
+        'distance':      length[fitted],
+        'm_origin':      m_origin[fitted],
+        'm_destination': m_target[fitted],
+        'mass':          mass,
+        'outflow':       outflow,
+        'times':         times,
+        'nodes':         nodes,
+        'lat':           coordinates['lat'].to_numpy(),
+        'lon':           coordinates['lon'].to_numpy(),
+    }
+
+def _design(flows: Dict, model: str) -> np.ndarray:
+    deterrence = np.log(flows['distance']) if model == 'power' else flows['distance']
+    return np.column_stack([np.ones(len(flows['flow'])), np.log(flows['m_origin']), np.log(flows['m_destination']), deterrence])
+
+def _solve(X: np.ndarray, y: np.ndarray, weight: np.ndarray, step: np.ndarray, steps: int) -> np.ndarray:
+    '''
+    Weighted least squares of every time step at once (coefficients: time step x columns of X).
+    '''
+    columns = X.shape[1]
+    A = np.empty((steps, columns, columns))
+    b = np.empty((steps, columns))
+    for i in range(columns):
+        b[:, i] = np.bincount(step, weight*X[:, i]*y, steps)
+        for j in range(i, columns):
+            A[:, i, j] = A[:, j, i] = np.bincount(step, weight*X[:, i]*X[:, j], steps)
+    return np.einsum('sij,sj->si', np.linalg.pinv(A), b)
+
+def _parameters(coefficients: np.ndarray, model: str, flows: Dict) -> pd.DataFrame:
+    parameters = pd.DataFrame({
+        'log_k': coefficients[:, 0],
+        'alpha': coefficients[:, 1],
+        'beta':  coefficients[:, 2],
+    }, index=pd.Index(flows['times'], name='date_time'))
+    with np.errstate(divide='ignore'):
+        if(model == 'power'):
+            parameters['gamma'] = -coefficients[:, 3]
+        else:
+            parameters['scale_km'] = -1/coefficients[:, 3]
+    parameters['edges'] = np.bincount(flows['step'], minlength=len(flows['times']))
+    return parameters
+
+@instrument.timed('gravity')
+def fit(table: pd.DataFrame, model: str = 'power', pop_table: pd.DataFrame = None, method: str = 'poisson', max_iter: int = 50, tol: float = 1e-08, flows: Dict = None) -> pd.DataFrame:
+    '''
+    Fits a gravity model to the observed flows of every time step of a movement table.
+
+    Args:
+        table:     movement table
+        model:     'power' or 'exponential'
+        pop_table: optional population table providing the masses (default: observed outflow/inflow)
+        method:    'ols' (least squares on log flows) or 'poisson' (Poisson pseudo maximum likelihood, starts from 'ols')
+        max_iter:  maximum number of IRLS iterations (method 'poisson')
+        tol:       convergence tolerance of the coefficients (method 'poisson')
+        flows:     output of prepare (skips the extraction if several models are fitted to the same table)
+
+    Returns:
+        parameters: indexed by date_time, columns log_k, alpha, beta, gamma (power) or scale_km (exponential), edges (fitted)
+                    and the goodness of fit against the observed flows (see goodness)
+    '''
+    if(model not in MODELS or method not in ('ols', 'poisson')):
+        instrument.error(f'Unknown gravity model {model} or method {method}.')
+        return None
+
+    flows = flows or prepare(table, pop_table)
+    steps = len(flows['times'])
+    X     = _design(flows, model)
+    y     = flows['flow']
+    step  = flows['step']
+
+    coefficients = _solve(X, np.log(y), np.ones(len(y)), step, steps)
+    if(method == 'poisson'):
+        for _ in range(max_iter):
+            eta      = np.einsum('ij,ij->i', X, coefficients[step])
+            mu       = np.exp(eta)
+            update   = _solve(X, eta + (y - mu)/mu, mu, step, steps)
+            converged = np.nanmax(np.abs(update - coefficients)) < tol if steps else True
+            coefficients = update
+            if(converged):
+                break
+        else:
+            instrument.error(f'Gravity model did not converge within {max_iter} iterations.')
+
+    parameters = _parameters(coefficients, model, flows)
+    return parameters.join(goodness(y, predict(flows, parameters, model), step, flows['times']))
+
+def predict(flows: Dict, parameters: pd.DataFrame, model: str = 'power') -> np.ndarray:
+    '''
+    Predicted flows of the fitted edges of <flows> (output of prepare) with the <parameters> of fit.
+    '''
+    third = -parameters['gamma'].to_numpy() if model == 'power' else -1/parameters['scale_km'].to_numpy()
+    coefficients = np.column_stack([parameters['log_k'].to_numpy(), parameters['alpha'].to_numpy(), parameters['beta'].to_numpy(), third])
+    return np.exp(np.einsum('ij,ij->i', _design(flows, model), coefficients[flows['step']]))
+
+@instrument.timed('gravity')
+def radiation(flows: Dict) -> np.ndarray:
+    '''
+    Radiation model predictions of the fitted edges of <flows> (output of prepare), vectorized per time step:
+    T_ij = O_i * m_i*m_j / ((m_i + s_ij)*(m_i + m_j + s_ij)), where O_i is the observed outflow of i,
+    m the masses and s_ij the mass of all other nodes within the distance of i and j (as in construction.administrative_radiation_graph,
+    with great-circle distances between node coordinates). Memory grows with the square of the active nodes per time step.
+    '''
+    size       = len(flows['nodes'])
+    prediction = np.zeros(len(flows['flow']))
+    order      = np.argsort(flows['step'], kind='stable')
+    bounds     = np.searchsorted(flows['step'][order], np.arange(len(flows['times']) + 1))
+    for step in range(len(flows['times'])):
+        edges = order[bounds[step]:bounds[step + 1]]
+        if(not len(edges)):
+            continue
+        mass   = flows['mass'][step]
+        active = np.flatnonzero(np.isfinite(mass) & (mass > 0))
+        local  = np.full(size, -1)
+        local[active] = np.arange(len(active))
+
+        distance = spatial.distance_matrix(flows['lat'][active], flows['lon'][active])
+        sort     = np.argsort(distance, axis=1, kind='stable')
+        ranked   = np.take_along_axis(distance, sort, axis=1)
+        within   = np.cumsum(mass[active][sort], axis=1)
+
+        i, j   = local[flows['origin'][edges]], local[flows['destination'][edges]]
+        known  = (i >= 0) & (j >= 0)
+        i, j   = i[known], j[known]
+        # Number of nodes not farther from i than j: one searchsorted on rows shifted apart by row index.
+        offset = (ranked.max() + 1.0)*np.arange(len(active))[:, None]
+        count  = np.searchsorted((ranked + offset).ravel(), distance[i, j] + offset[i, 0], side='right') - i*len(active)
+        m, n   = mass[active][i], mass[active][j]
+        s      = within[i, count - 1] - m - n
+        p      = m*n/((m + s)*(m + n + s))
+        result = np.zeros(len(edges))
+        result[known] = flows['outflow'][step][flows['origin'][edges][known]]*p
+        prediction[edges] = result
+    return prediction
+
+def goodness(observed: np.ndarray, predicted: np.ndarray, step: np.ndarray, times: pd.Index) -> pd.DataFrame:
+    '''
+    Goodness of fit of <predicted> against <observed> flows per time step.
+
+    Returns:
+        goodness: indexed by date_time, columns cpc (common part of commuters, 2*sum(min)/(sum observed + sum predicted)),
+                  r2_log (coefficient of determination of log flows), pearson (correlation of flows), rmse
+    '''
+    steps = len(times)
+    count = np.bincount(step, minlength=steps).astype(float)
+    sums  = lambda values: np.bincount(step, values, steps)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_observed, log_predicted = np.log(observed), np.log(np.maximum(predicted, 1e-300))
+        mean_log = sums(log_observed)/count
+        mean_o, mean_p = sums(observed)/count, sums(predicted)/count
+        covariance = sums(observed*predicted)/count - mean_o*mean_p
+        variance_o = sums(observed**2)/count - mean_o**2
+        variance_p = sums(predicted**2)/count - mean_p**2
+        return pd.DataFrame({
+            'cpc':     2*sums(np.minimum(observed, predicted))/(sums(observed) + sums(predicted)),
+            'r2_log':  1 - sums((log_observed - log_predicted)**2)/sums((log_observed - mean_log[step])**2),
+            'pearson': covariance/np.sqrt(variance_o*variance_p),
+            'rmse':    np.sqrt(sums((observed - predicted)**2)/count),
+        }, index=pd.Index(times, name='date_time'))
+
+@instrument.timed('gravity')
+def compare(table: pd.DataFrame, pop_table: pd.DataFrame = None, models: List[str] = MODELS, method: str = 'poisson') -> pd.DataFrame:
+    '''
+    Fits all gravity <models> and reports their goodness of fit against the observed flows and against the radiation model,
+    together with the radiation model against the observed flows.
+
+    Args:
+        table:     movement table
+        pop_table: optional population table providing the masses
+        models:    gravity models to fit
+        method:    fitting method, see fit
+
+    Returns:
+        report: indexed by (date_time, model, reference) with reference 'observed' or 'radiation', columns cpc, r2_log, pearson, rmse
+    '''
+    flows     = prepare(table, pop_table)
+    step      = flows['step']
+    radiated  = radiation(flows)
+    positive  = radiated > 0
+    reports   = [goodness(flows['flow'], radiated, step, flows['times']).assign(model='radiation', reference='observed')]
+    for model in models:
+        parameters = fit(table, model, method=method, flows=flows)
+        predicted  = predict(flows, parameters, model)
+        reports.append(goodness(flows['flow'], predicted, step, flows['times']).assign(model=model, reference='observed'))
+        reports.append(goodness(radiated[positive], predicted[positive], step[positive], flows['times']).assign(model=model, reference='radiation'))
+    return pd.concat(reports).set_index(['model', 'reference'], append=True).sort_index()
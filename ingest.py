@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+import time
+import construction as con
+import instrument
+import rki
+import rollup
+import settings
+import store
+import utility
+import pandas       as pd
+from   pathlib      import Path
+from   typing       import List, Dict, Tuple
+
+'''
+Incremental ingestion: watches the directories configured in settings.paths and ingests only new or changed
+Facebook files and RKI publications into the cached store (settings.paths['cache']).
+Sources may be plain .csv files, .csv.gz/.csv.zst files or .csv members of .zip archives (no extraction needed).
+Derived daily, weekly and 7-day rolling aggregates and the population/flow/case series are updated for the
+affected dates only. Files removed from the directories are dropped from the store and the derived aggregates. Progress is recorded in a local checkpoint (<cache>/checkpoint.json) after every file,
+an interrupted run resumes where it stopped.
+
+Usage: python ingest.py [--once] [--interval 300] [--country DE]
+'''
+
+KINDS = {
+    'movement':         ('movement_path',         con.movement_table),
+    'admin_movement':   ('admin_movement_path',   con.administrative_movement_table),
+    'population':       ('population_path',       con.population_table),
+    'admin_population': ('admin_population_path', con.administrative_population_table),
+}
+
+def read_checkpoint(cache: str) -> Dict:
+    '''
+    Reads the checkpoint of the store at <cache> (empty checkpoint if none exists yet).
+    '''
+    path = Path(cache, 'checkpoint.json')
+    if(not path.exists()):
+        return {'files': {}}
+    with open(path, encoding='utf8') as file:
+        return json.load(file)
+
+def write_checkpoint(cache: str, checkpoint: Dict):
+    '''
+    Writes <checkpoint> to <cache>/checkpoint.json (atomic).
+    '''
+    path = Path(cache, 'checkpoint.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    with open(temp, 'w', encoding='utf8') as file:
+        json.dump(checkpoint, file, indent=1)
+    os.replace(temp, path)
+
+def _sources(paths: Dict) -> List[Tuple[str, Path]]:
+    '''
+    Lists all (kind, file) pairs found in the directories of <paths>.
+    '''
+    sources = []
+    for kind, (key, _) in KINDS.items():
+        if(paths.get(key) and Path(paths[key]).is_dir()):
+            sources.extend((kind, path) for path in utility.data_files(paths[key]))
+    if(paths.get('RKI') and Path(paths['RKI']).is_dir()):
+        for directory in [Path(paths['RKI'])] + [path for path in Path(paths['RKI']).iterdir() if path.is_dir()]:
+            sources.extend(('RKI', path) for path in utility.data_files(directory, key='RKI_COVID19_'))
+    return sorted(sources, key=lambda source: (source[0], utility.source_name(source[1])))
+
+def scan(paths: Dict, checkpoint: Dict, settle: float = 5) -> List[Tuple[str, Path]]:
+    '''
+    Returns all (kind, file) pairs which are new or changed (size, modification time) since the <checkpoint>.
+    Files modified within the last <settle> seconds are skipped, they might still be written.
+
+    Args:
+        paths:      dict in the layout of settings.paths
+        checkpoint: output of read_checkpoint
+        settle:     minimum file age in seconds
+
+    Returns:
+        sources: list of (kind, path)
+    '''
+    now, pending = time.time(), []
+    for kind, path in _sources(paths):
+        if(now - utility.split_archive(path)[0].stat().st_mtime < settle):
+            continue
+        fingerprint = utility.fingerprint(path)
+        known = checkpoint['files'].get(kind, {}).get(str(path))
+        if(known is None or any(known[key] != value for key, value in fingerprint.items())):
+            pending.append((kind, path))
+    return pending
+
+def _exists(path: str) -> bool:
+    try:
+        utility.fingerprint(path)
+        return True
+    except (OSError, KeyError):
+        return False
+
+def prune(checkpoint: Dict) -> Dict[str, List[Dict]]:
+    '''
+    Drops the files of the <checkpoint> which no longer exist (deleted files, archives or archive members).
+
+    Returns:
+        removed: dict of kind and checkpoint entries of its removed files
+    '''
+    removed = {}
+    for kind, files in checkpoint['files'].items():
+        for path in [path for path in files if not _exists(path)]:
+            removed.setdefault(kind, []).append(files.pop(path))
+    return removed
+
+def remove_files(cache: str, kind: str, entries: List[Dict], checkpoint: Dict):
+    '''
+    Removes the stored tables of the removed files <entries> (see prune) unless another file of the <checkpoint>
+    has the same name, and updates the derived aggregates of their dates.
+    '''
+    names = {entry['name'] for entry in checkpoint['files'].get(kind, {}).values()}
+    for entry in entries:
+        if(entry['name'] not in names):
+            store.remove_table(cache, kind, entry['name'])
+            if(kind == 'RKI'):
+                store.remove_table(cache, rki.CUBE_KIND, entry['name'])
+                store.remove_table(cache, rki.DELTA_KIND, entry['name'])
+    update_derived(cache, kind, sorted({pd.Timestamp(date) for entry in entries for date in entry['dates']}), checkpoint)
+
+@instrument.timed('ingest')
+def ingest_file(kind: str, path: Path, cache: str, country: str = None) -> List[pd.Timestamp]:
+    '''
+    Builds the table of a single source file and writes it to the store.
+    RKI publications are stored in compact dtypes together with their case cube (see rki).
+    Tiles of movement files are added to the persistent tile -> polygon mapping (rollup.load_mapping).
+
+    Args:
+        kind:    'movement', 'admin_movement', 'population', 'admin_population' or 'RKI'
+        path:    source file
+        cache:   path pointing to the store directory
+        country: country code to filter Facebook rows for a single nation, e.g. 'DE' for Germany
+
+    Returns:
+        dates: dates (days) covered by the file
+    '''
+    if(kind == 'RKI'):
+        table = rki.read_publication(path)
+        dates = [pd.Timestamp(utility.source_name(path)[-10:])]
+        rki.save_cube(rki.cube(table), cache, utility.source_name(path))
+    else:
+        table = KINDS[kind][1]([path], country)
+        dates = sorted(table['date_time'].dt.normalize().unique())
+    if(kind == 'movement' and not table.empty):
+        rollup.save_mapping(rollup.update_mapping(rollup.load_mapping(cache), rollup.tile_polygon_mapping(table)), cache)
+    store.write_table(table, cache, kind, utility.source_name(path))
+    return [pd.Timestamp(date) for date in dates]
+
+def _names_by_date(checkpoint: Dict, kind: str, dates: List[pd.Timestamp]) -> List[str]:
+    days = {str(date.date()) for date in dates}
+    return sorted(entry['name'] for entry in checkpoint['files'].get(kind, {}).values() if days.intersection(entry['dates']))
+
+def _daily(kind: str, table: pd.DataFrame) -> pd.DataFrame:
+    if(kind in ('population', 'admin_population')):
+        return table.groupby('node', observed=True).agg(population=('population', 'sum'), steps=('date_time', 'nunique')).reset_index()
+    return table.groupby(['start', 'end'], observed=True).agg(n_crisis=('n_crisis', 'sum'), length_km=('length_km', 'mean'), steps=('date_time', 'nunique')).reset_index()
+
+def _combine(kind: str, tables: List[pd.DataFrame], mean: bool = False) -> pd.DataFrame:
+    keys  = ['node'] if kind in ('population', 'admin_population') else ['start', 'end']
+    value = 'population' if kind in ('population', 'admin_population') else 'n_crisis'
+    table = pd.concat([table.astype({key: object for key in keys}) for table in tables], ignore_index=True)
+    agg   = table.groupby(keys).agg(**{value: (value, 'sum'), 'steps': ('steps', 'sum'), 'days': ('steps', 'size')}).reset_index()
+    if(mean):
+        # Population: mean per time step, movement: mean flow per day.
+        agg[value] = agg[value]/(agg['steps'] if value == 'population' else agg['days'])
+    return agg
+
+def update_derived(cache: str, kind: str, dates: List[pd.Timestamp], checkpoint: Dict):
+    '''
+    Recomputes the derived aggregates of <kind> affected by new, changed or removed data for <dates>:
+    daily sums (<kind>_daily), weekly sums (<kind>_weekly, weeks starting on monday),
+    7-day rolling means ending on each of the following 7 days (<kind>_rolling) and the series of totals per time step (series/<kind>).
+    Aggregates without any remaining data are removed.
+    For 'RKI' the case series per publication and Bundesland (series/RKI) and the reporting triangle (rki.update_triangle) are updated.
+
+    Args:
+        cache:      path pointing to the store directory
+        kind:       table kind
+        dates:      dates (days) with new or changed data
+        checkpoint: checkpoint including the ingested files
+    '''
+    if(kind == 'RKI'):
+        rki.update_triangle(cache, dates)
+        return _update_rki_series(cache, dates, checkpoint)
+
+    value = 'population' if kind in ('population', 'admin_population') else 'n_crisis'
+    for date in dates:
+        names = _names_by_date(checkpoint, kind, [date])
+        table = store.read_table(cache, kind, names)
+        known = store.read_table(cache, 'series', [kind])
+        if(table is None):
+            store.remove_table(cache, f'{kind}_daily', str(date.date()))
+            if(known is not None):
+                store.write_table(known[known.index.normalize() != date], cache, 'series', kind)
+            continue
+        table = table[table['date_time'].dt.normalize() == date]
+        store.write_table(_daily(kind, table), cache, f'{kind}_daily', str(date.date()))
+
+        series = table.groupby('date_time')[value].sum()
+        if(known is not None):
+            series = pd.concat([known.loc[~known.index.isin(series.index) & (known.index.normalize() != date), value], series]).sort_index()
+        store.write_table(series.to_frame(), cache, 'series', kind)
+
+    daily = set(store.list_tables(cache, f'{kind}_daily'))
+    weeks = sorted({date - pd.Timedelta(days=date.weekday()) for date in dates})
+    for week in weeks:
+        names = [str(day.date()) for day in pd.date_range(week, periods=7) if str(day.date()) in daily]
+        if(not names):
+            store.remove_table(cache, f'{kind}_weekly', str(week.date()))
+            continue
+        store.write_table(_combine(kind, [store.read_table(cache, f'{kind}_daily', [name]) for name in names]), cache, f'{kind}_weekly', str(week.date()))
+
+    last = max(pd.Timestamp(name) for name in daily) if daily else None
+    ends = sorted({date + pd.Timedelta(days=offset) for date in dates for offset in range(7)})
+    for end in ends:
+        names = [str(day.date()) for day in pd.date_range(end=end, periods=7) if str(day.date()) in daily]
+        if(last is None or end > last or not names):
+            store.remove_table(cache, f'{kind}_rolling', str(end.date()))
+            continue
+        store.write_table(_combine(kind, [store.read_table(cache, f'{kind}_daily', [name]) for name in names], mean=True), cache, f'{kind}_rolling', str(end.date()))
+
+def _update_rki_series(cache: str, dates: List[pd.Timestamp], checkpoint: Dict):
+    '''
+    Case numbers per publication and Bundesland (all reporting dates up to the publication), as in construction.cumulated_*.
+    '''
+    rows, removed = [], []
+    for date in dates:
+        names = _names_by_date(checkpoint, 'RKI', [date])
+        cube  = rki.read_cube(cache, names)
+        if(cube is None):
+            removed.append(date)
+            continue
+        cube   = cube[cube.index.get_level_values('Meldedatum') <= date]
+        counts = cube.groupby(level='Bundesland', observed=True).sum()
+        counts['current'] = counts['infected'] - counts['recovered'] - counts['dead']
+        counts['publication'] = date
+        rows.append(counts.reset_index().set_index(['publication', 'Bundesland']))
+    known  = store.read_table(cache, 'series', ['RKI'])
+    if(not rows and (known is None or not removed)):
+        return
+
+    series = pd.concat(rows) if rows else None
+    if(known is not None):
+        dropped = removed + (list(series.index.get_level_values(0)) if rows else [])
+        series  = pd.concat([known[~known.index.get_level_values(0).isin(dropped)]] + ([series] if rows else []))
+    store.write_table(series.sort_index(), cache, 'series', 'RKI')
+
+def ingest(paths: Dict = None, cache: str = None, country: str = None, settle: float = 5) -> List[Path]:
+    '''
+    Single ingestion pass: ingests all new or changed files, updates the derived aggregates and the checkpoint after every file.
+    The next files are read ahead on background threads while the current one is processed (see utility.read_ahead).
+
+    Args:
+        paths:   dict in the layout of settings.paths (default: settings.paths)
+        cache:   path pointing to the store directory (default: settings.paths['cache'])
+        country: country code to filter Facebook rows for a single nation, e.g. 'DE' for Germany
+        settle:  minimum file age in seconds
+
+    Returns:
+        files: list of ingested files
+    '''
+    paths      = paths or settings.paths
+    cache      = cache or paths['cache']
+    checkpoint = read_checkpoint(cache)
+    ingested   = []
+
+    for kind, entries in prune(checkpoint).items():
+        remove_files(cache, kind, entries, checkpoint)
+        write_checkpoint(cache, checkpoint)
+        print(f'[INGEST] {kind}: removed {len(entries)} files')
+
+    for kind, path in utility.read_ahead(scan(paths, checkpoint, settle), locate=lambda source: source[1]):
+        try:
+            dates = ingest_file(kind, path, cache, country)
+        except Exception as exception:
+            instrument.error(f'Unable to ingest file at location {path} ({exception}).')
+            continue
+
+        known = checkpoint['files'].setdefault(kind, {}).get(str(path))
+        old   = [pd.Timestamp(date) for date in known['dates']] if known else []
+        checkpoint['files'][kind][str(path)] = dict(utility.fingerprint(path), name=utility.source_name(path), dates=[str(date.date()) for date in dates])
+        update_derived(cache, kind, sorted(set(dates + old)), checkpoint)
+        write_checkpoint(cache, checkpoint)
+        ingested.append(path)
+        print(f'[INGEST] {kind}: {path.name}')
+
+    return ingested
+
+def watch(paths: Dict = None, cache: str = None, country: str = None, interval: float = 300, settle: float = 5):
+    '''
+    Long-running ingestion: repeats ingest every <interval> seconds until interrupted (Ctrl+C).
+
+    Args:
+        paths:    dict in the layout of settings.paths (default: settings.paths)
+        cache:    path pointing to the store directory (default: settings.paths['cache'])
+        country:  country code to filter Facebook rows for a single nation, e.g. 'DE' for Germany
+        interval: seconds between two scans
+        settle:   minimum file age in seconds
+    '''
+    try:
+        while(True):
+            ingest(paths, cache, country, settle)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print('[INGEST] Stopped.')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Incremental ingestion of Facebook and RKI files into the cached store.')
+    parser.add_argument('--cache',    type=str,   default=None,  help="store directory (default: settings.paths['cache'])")
+    parser.add_argument('--country',  type=str,   default=None,  help="country code, e.g. 'DE'")
+    parser.add_argument('--interval', type=float, default=300,   help='seconds between two scans')
+    parser.add_argument('--settle',   type=float, default=5,     help='minimum file age in seconds')
+    parser.add_argument('--once',     action='store_true',       help='single pass instead of watching')
+    args = parser.parse_args()
+
+    if(args.once):
+        ingest(cache=args.cache, country=args.country, settle=args.settle)
+    else:
+        watch(cache=args.cache, country=args.country, interval=args.interval, settle=args.settle)
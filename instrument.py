@@ -0,0 +1,241 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from   pathlib import Path
+from   typing  import List, Dict, Callable
+
+'''
+Pipeline instrumentation: timing spans, counters (rows parsed/dropped, graph sizes) and peak RSS per stage.
+Disabled by default (every hook returns immediately), enable with instrument.enable() or environment variable INSTRUMENT=1.
+Recorded events can be exported as JSON lines or as Chrome trace (chrome://tracing, https://ui.perfetto.dev).
+
+Usage:
+    instrument.enable()
+    graph = construction.movement_graph(path)
+    instrument.export_chrome_trace('trace.json')
+'''
+
+_enabled = os.environ.get('INSTRUMENT', '') not in ('', '0')
+_events  = []
+_lock    = threading.Lock()
+_local   = threading.local()
+_origin  = time.perf_counter()
+
+def enable(flag: bool = True):
+    '''
+    Enables (or disables) recording of spans, counters and errors.
+    '''
+    global _enabled
+    _enabled = flag
+
+def enabled() -> bool:
+    return _enabled
+
+def reset():
+    '''
+    Discards all recorded events.
+    '''
+    with _lock:
+        _events.clear()
+
+def events() -> List[Dict]:
+    '''
+    Returns a copy of all recorded events.
+    '''
+    with _lock:
+        return list(_events)
+
+def peak_rss() -> float:
+    '''
+    Returns the peak resident set size of the process in MB (None if unavailable on this platform).
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
+
+def _timestamp() -> float:
+    return (time.perf_counter() - _origin)*1e6
+
+def _record(event: Dict):
+    event.setdefault('pid', os.getpid())
+    event.setdefault('tid', threading.get_ident())
+    with _lock:
+        _events.append(event)
+
+def _stack() -> List:
+    if(not hasattr(_local, 'stack')):
+        _local.stack = []
+    return _local.stack
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **fields):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class _Span:
+    def __init__(self, name: str, category: str, fields: Dict):
+        self.name     = name
+        self.category = category
+        self.fields   = fields
+
+    def __enter__(self):
+        _stack().append(self)
+        self.start    = _timestamp()
+        self.rss_peak = peak_rss()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = _timestamp() - self.start
+        _stack().pop()
+        rss_peak = peak_rss()
+        if(exc_type is not None):
+            self.fields['exception'] = f'{exc_type.__name__}: {exc_value}'
+        if('rows' in self.fields and duration > 0):
+            self.fields['rows_per_second'] = self.fields['rows']/(duration/1e6)
+        _record({
+            'type':          'span',
+            'name':          self.name,
+            'category':      self.category,
+            'ts':            self.start,
+            'dur':           duration,
+            'rss_peak_mb':   rss_peak,
+            'rss_growth_mb': rss_peak - self.rss_peak if rss_peak is not None else None,
+            'fields':        self.fields,
+        })
+        return False
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+def span(name: str, category: str = '', **fields):
+    '''
+    Context manager timing the enclosed block. Further fields can be attached with span.set(...) or instrument.annotate(...).
+
+    Args:
+        name:     span name, e.g. 'construction.movement_graph'
+        category: stage of span (construction, analytics, model, plot, ...)
+        fields:   additional values stored with the span, e.g. file=path
+
+    Returns:
+        span: context manager (no-op if instrumentation is disabled)
+    '''
+    if(not _enabled):
+        return _NULL_SPAN
+    return _Span(name, category, fields)
+
+def annotate(**fields):
+    '''
+    Attaches <fields> to the innermost open span of the current thread, e.g. rows=..., dropped_country=...
+    '''
+    if(not _enabled):
+        return
+    stack = _stack()
+    if(stack):
+        stack[-1].set(**fields)
+
+def count(name: str, value: float = 1, **fields):
+    '''
+    Records a counter value, e.g. number of files processed.
+    '''
+    if(not _enabled):
+        return
+    _record({'type': 'counter', 'name': name, 'ts': _timestamp(), 'value': value, 'fields': fields})
+
+def error(message: str, **fields):
+    '''
+    Reports an error: prints '[ERROR] <message>' and, if enabled, records it as event of the innermost span.
+    '''
+    print(f'[ERROR] {message}')
+    if(not _enabled):
+        return
+    stack = _stack()
+    _record({'type': 'error', 'name': stack[-1].name if stack else '', 'ts': _timestamp(), 'message': message, 'fields': fields})
+
+def _describe(result) -> Dict:
+    '''
+    Size of a function result: nodes/edges of graphs, rows of tables, length of lists.
+    '''
+    if(hasattr(result, 'number_of_nodes') and hasattr(result, 'number_of_edges')):
+        return {'nodes': result.number_of_nodes(), 'edges': result.number_of_edges()}
+    if(hasattr(result, 'shape') and hasattr(result, 'columns')):
+        return {'result_rows': int(result.shape[0])}
+    if(isinstance(result, (list, tuple))):
+        return {'result_items': len(result)}
+    return {}
+
+def timed(category: str) -> Callable:
+    '''
+    Decorator wrapping every call of a function in a span named '<module>.<function>', the size of the result
+    (graph nodes/edges, table rows) is added to the span.
+
+    Args:
+        category: stage of the function (construction, analytics, model, plot, ...)
+    '''
+    def decorator(function: Callable) -> Callable:
+        name = f'{function.__module__}.{function.__name__}'
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if(not _enabled):
+                return function(*args, **kwargs)
+            with _Span(name, category, {}) as span:
+                result = function(*args, **kwargs)
+                span.set(**_describe(result))
+            return result
+        return wrapper
+    return decorator
+
+def export_jsonl(path: str):
+    '''
+    Writes all recorded events as JSON lines to <path>.
+    '''
+    with open(Path(path), 'w', encoding='utf8') as file:
+        for event in events():
+            file.write(json.dumps(event, default=str) + '\n')
+
+def export_chrome_trace(path: str):
+    '''
+    Writes all recorded events in Chrome trace event format to <path>.
+    '''
+    trace = []
+    for event in events():
+        base = {'name': event['name'], 'pid': event['pid'], 'tid': event['tid'], 'ts': event['ts']}
+        if(event['type'] == 'span'):
+            args = dict(event['fields'], rss_peak_mb=event['rss_peak_mb'], rss_growth_mb=event['rss_growth_mb'])
+            trace.append(dict(base, ph='X', cat=event['category'], dur=event['dur'], args=args))
+        elif(event['type'] == 'counter'):
+            trace.append(dict(base, ph='C', args={event['name']: event['value']}))
+        else:
+            trace.append(dict(base, ph='i', s='t', cat='error', args=dict(event['fields'], message=event['message'])))
+    with open(Path(path), 'w', encoding='utf8') as file:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file, default=str)
+
+def summary() -> List[Dict]:
+    '''
+    Aggregates recorded spans by name: calls, total seconds, rows, rows per second, maximum peak RSS.
+    '''
+    stages = {}
+    for event in events():
+        if(event['type'] != 'span'):
+            continue
+        stage = stages.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'seconds': 0.0, 'rows': 0, 'rss_peak_mb': 0.0})
+        stage['calls']   += 1
+        stage['seconds'] += event['dur']/1e6
+        stage['rows']    += event['fields'].get('rows', 0)
+        stage['rss_peak_mb'] = max(stage['rss_peak_mb'], event['rss_peak_mb'] or 0.0)
+    for stage in stages.values():
+        stage['rows_per_second'] = stage['rows']/stage['seconds'] if stage['seconds'] else None
+    return list(stages.values())
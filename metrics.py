@@ -0,0 +1,156 @@
+import instrument
+import numpy        as np
+import pandas       as pd
+import scipy.sparse as sp
+from   typing       import Tuple
+
+'''
+Vectorized mobility metrics for all time steps of a movement table (construction.movement_table) in one pass.
+Nodes and edges of every time step are mapped to one compact index of active (date_time, node) pairs,
+so all indicators are computed with bincounts and a single block-diagonal sparse matrix instead of per-graph loops.
+'''
+
+def _index(table: pd.DataFrame) -> Tuple:
+    '''
+    Compact index of all active (date_time, node) pairs of a movement table.
+
+    Returns:
+        source:   position of each edge's (date_time, start) pair
+        target:   position of each edge's (date_time, end) pair
+        block:    time step of each pair
+        node:     node code of each pair
+        times:    sorted unique date_times
+        nodes:    node categories
+    '''
+    steps, times = pd.factorize(table['date_time'], sort=True)
+    nodes  = table['start'].cat.categories
+    size   = np.int64(len(nodes))
+    start  = steps.astype(np.int64)*size + table['start'].cat.codes.to_numpy()
+    end    = steps.astype(np.int64)*size + table['end'].cat.codes.to_numpy()
+    keys, inverse = np.unique(np.concatenate([start, end]), return_inverse=True)
+    source, target = inverse[:len(table)], inverse[len(table):]
+    return source, target, keys // size, keys % size, times, nodes
+
+def pagerank(source: np.ndarray, target: np.ndarray, weight: np.ndarray, block: np.ndarray, alpha: float = 0.85, max_iter: int = 100, tol: float = 1e-06) -> np.ndarray:
+    '''
+    Weighted PageRank of all time steps at once: power iteration on one block-diagonal transition matrix
+    (same definition as networkx.pagerank with weight, uniform teleport and dangling distribution per time step).
+
+    Args:
+        source:   edge start positions in the compact index
+        target:   edge end positions in the compact index
+        weight:   edge weights
+        block:    time step of each position
+        alpha:    damping factor
+        max_iter: maximum number of iterations
+        tol:      error tolerance per node (as in networkx)
+
+    Returns:
+        rank: PageRank of each position (sums to 1 per time step)
+    '''
+    size     = len(block)
+    blocks   = int(block.max()) + 1 if size else 0
+    count    = np.bincount(block, minlength=blocks).astype(float)[block]
+    strength = np.bincount(source, weight, size)
+    dangling = strength == 0
+
+    transition = sp.csr_matrix((weight/strength[source], (target, source)), shape=(size, size))
+    rank = 1/count
+    for _ in range(max_iter):
+        dangling_mass = np.bincount(block[dangling], rank[dangling], blocks)[block]
+        update = alpha*(transition @ rank + dangling_mass/count) + (1 - alpha)/count
+        error  = np.bincount(block, np.abs(update - rank), blocks)
+        rank   = update
+        if(np.all(error < np.bincount(block, minlength=blocks)*tol)):
+            return rank
+    instrument.error(f'PageRank did not converge within {max_iter} iterations.')
+    return rank
+
+@instrument.timed('metrics')
+def node_metrics(table: pd.DataFrame, alpha: float = 0.85) -> pd.DataFrame:
+    '''
+    Computes node mobility indicators for every time step of a movement table in one vectorized pass.
+
+    Args:
+        table: movement table (construction.movement_table or administrative_movement_table)
+        alpha: PageRank damping factor
+
+    Returns:
+        metrics: node x time table indexed by (date_time, node) with columns
+                 in_strength, out_strength (sum of n_crisis), net_flow (in - out), in_degree, out_degree,
+                 self_loop (n_crisis of self loop), self_loop_share (self loop / out_strength),
+                 mean_length_km (flow-weighted mean length_km of outgoing edges), pagerank
+    '''
+    source, target, block, node, times, nodes = _index(table)
+    size   = len(block)
+    weight = table['n_crisis'].to_numpy(dtype=np.float64)
+    length = table['length_km'].to_numpy(dtype=np.float64)
+    loop   = source == target
+
+    out_strength = np.bincount(source, weight, size)
+    in_strength  = np.bincount(target, weight, size)
+    self_loop    = np.bincount(source[loop], weight[loop], size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        self_loop_share = np.where(out_strength > 0, self_loop/out_strength, np.nan)
+        mean_length_km  = np.where(out_strength > 0, np.bincount(source, weight*length, size)/out_strength, np.nan)
+
+    index = pd.MultiIndex.from_arrays([times[block], nodes[node]], names=['date_time', 'node'])
+    return pd.DataFrame({
+        'in_strength':     in_strength,
+        'out_strength':    out_strength,
+        'net_flow':        in_strength - out_strength,
+        'in_degree':       np.bincount(target, minlength=size),
+        'out_degree':      np.bincount(source, minlength=size),
+        'self_loop':       self_loop,
+        'self_loop_share': self_loop_share,
+        'mean_length_km':  mean_length_km,
+        'pagerank':        pagerank(source, target, weight, block, alpha),
+    }, index=index)
+
+@instrument.timed('metrics')
+def edge_metrics(table: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Computes edge mobility indicators for every time step of a movement table in one vectorized pass.
+
+    Args:
+        table: movement table (construction.movement_table or administrative_movement_table)
+
+    Returns:
+        metrics: columns date_time, start, end, n_crisis, length_km, flow_km (n_crisis * length_km),
+                 origin_share (share of the origin's out_strength), destination_share (share of the destination's in_strength),
+                 self_loop (bool), reciprocal (n_crisis of the reverse edge in the same time step, 0 if absent)
+    '''
+    source, target, block, node, times, nodes = _index(table)
+    size   = len(block)
+    weight = table['n_crisis'].to_numpy(dtype=np.float64)
+
+    out_strength = np.bincount(source, weight, size)
+    in_strength  = np.bincount(target, weight, size)
+
+    # Reverse edge lookup with sorted keys of (source, target) pairs.
+    keys     = source.astype(np.int64)*size + target
+    reverse  = target.astype(np.int64)*size + source
+    order    = np.argsort(keys)
+    position = np.clip(np.searchsorted(keys[order], reverse), 0, max(len(keys) - 1, 0))
+    found    = keys[order][position] == reverse if len(keys) else np.zeros(0, dtype=bool)
+
+    metrics = table[['date_time', 'start', 'end', 'n_crisis', 'length_km']].copy()
+    metrics['flow_km']           = weight*table['length_km'].to_numpy(dtype=np.float64)
+    metrics['origin_share']      = weight/out_strength[source]
+    metrics['destination_share'] = weight/in_strength[target]
+    metrics['self_loop']         = source == target
+    metrics['reciprocal']        = np.where(found, weight[order][position], 0.0)
+    return metrics
+
+def node_time_table(metrics: pd.DataFrame, column: str) -> pd.DataFrame:
+    '''
+    Pivots one column of node_metrics into a node x date_time matrix (NaN where a node is not active).
+
+    Args:
+        metrics: output of node_metrics
+        column:  metric name, e.g. 'pagerank'
+
+    Returns:
+        table: DataFrame with nodes as rows and date_times as columns
+    '''
+    return metrics[column].unstack('date_time')
@@ -1,5 +1,5 @@
 import copy
-import plot
+import instrument
 import settings
 import sys
 import construction as con
@@ -13,7 +13,8 @@ from networkx import Graph, DiGraph
 ### problems with mobility movement data set. Will be revisited. ###
 ####################################################################
 
-def init_state_SIR(date: str): -> List[Set[Tuple]]
+@instrument.timed('model')
+def init_state_SIR(date: str) -> List[Set[Tuple]]:
     '''
     Returns list with initial distribution of infected, susceptible, recovered as share of total state population.
     
@@ -56,6 +57,7 @@ def init_state_SIR(date: str): -> List[Set[Tuple]]
         init_distribution[state] = {'rel_susceptible': rel_susceptible, 'rel_infected': rel_infected, 'rel_recovered': rel_recovered}
     return init_distribution
         
+@instrument.timed('model')
 def closed_SIR(susceptible: int, infected: int, recovered: int, infection_rate: float, recovery_rate: float, timeframe: int) -> Tuple[List[float]]:
     '''
     Simulation of the most basic SIR model.
@@ -97,6 +99,7 @@ def closed_SIR(susceptible: int, infected: int, recovered: int, infection_rate:
     return ts_susceptible, ts_infected, ts_recovered, ts_scale
 
 # Fix: type(Graph.graph['date_time']) = pandas.Timestamp() now, not str
+@instrument.timed('model')
 def static_state_SIR(graph, infection_rate, recovery_rate, timeframe) -> Graph:
     '''
     Closed SIR-simulation for each node of Graph, initialised with RKI data.
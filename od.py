@@ -0,0 +1,249 @@
+import instrument
+import networkx     as nx
+import numpy        as np
+import pandas       as pd
+import scipy.io
+import scipy.sparse as sp
+from   networkx     import DiGraph
+from   pathlib      import Path
+from   typing       import List, Dict, Tuple, Hashable
+
+'''
+Origin-destination (OD) matrices: export and import of movement tables and graphs as scipy.sparse .npz,
+Matrix Market (.mtx) and long format Parquet (.parquet, requires package pyarrow).
+Matrix rows are origins, columns destinations, both in the order of the node file <directory>/nodes.csv,
+which is shared by all time steps of a directory and only ever extended (new nodes are appended), so a matrix
+position refers to the same node in every file. Matrices are built from the categorical codes of a movement table,
+no Python tuples are created.
+
+Layout:
+    <directory>/nodes.csv                 node order (column node, or lat, lon for administrative graphs)
+    <directory>/<YYYY-MM-DD HHMM>.npz     one matrix per time step or window (format 'npz')
+    <directory>/<YYYY-MM-DD HHMM>.mtx     one matrix per time step or window (format 'mtx')
+    <directory>/<YYYY-MM-DD HHMM>.parquet one long table per time step or window, columns date_time, origin, destination, <value> (format 'parquet')
+
+Exporting again replaces the files of the exported time steps only, so a campaign can be exported month by month.
+'''
+
+FORMATS = ('npz', 'mtx', 'parquet')
+
+def read_nodes(directory: str) -> pd.Index:
+    '''
+    Reads the node order of <directory> (empty index if there is none yet).
+    '''
+    path = Path(directory, 'nodes.csv')
+    if(not path.exists()):
+        return pd.Index([], dtype=object)
+    nodes = pd.read_csv(path, dtype={'node': str})
+    if('node' in nodes.columns):
+        return pd.Index(nodes['node'], dtype=object)
+    return pd.Index(list(zip(nodes['lat'], nodes['lon'])), dtype=object, tupleize_cols=False)
+
+def write_nodes(directory: str, nodes: List[Hashable]) -> pd.Index:
+    '''
+    Extends the node order of <directory> with the unknown ones of <nodes> (sorted) and writes it to <directory>/nodes.csv.
+
+    Returns:
+        order: complete node order
+    '''
+    known = read_nodes(directory)
+    new   = pd.Index(nodes, dtype=object, tupleize_cols=False).difference(known, sort=False)
+    order = known.append(pd.Index(sorted(new), dtype=object, tupleize_cols=False))
+    if(len(new) or not Path(directory, 'nodes.csv').exists()):
+        Path(directory).mkdir(parents=True, exist_ok=True)
+        if(len(order) and isinstance(order[0], tuple)):
+            frame = pd.DataFrame(list(order), columns=['lat', 'lon'])
+        else:
+            frame = pd.DataFrame({'node': order})
+        frame.to_csv(Path(directory, 'nodes.csv'), index=False)
+    return order
+
+def _name(date_time: pd.Timestamp) -> str:
+    return date_time.strftime('%Y-%m-%d %H%M')
+
+def _write_parquet(long: pd.DataFrame, directory: str) -> List[Path]:
+    '''
+    Writes the long OD table <long> (date_time, origin, destination, value) as one Parquet file per time step.
+    '''
+    files = []
+    for date_time, rows in long.groupby('date_time', sort=True):
+        path = Path(directory, _name(pd.Timestamp(date_time)) + '.parquet')
+        rows.to_parquet(path, index=False)
+        files.append(path)
+    return files
+
+def _read_parquet(directory: str) -> pd.DataFrame:
+    '''
+    Reads and concatenates all Parquet files of <directory> (in date_time order).
+    '''
+    parts = [pd.read_parquet(path) for path in sorted(Path(directory).glob('*.parquet'))]
+    if(not parts):
+        return pd.DataFrame({'date_time': pd.Series(dtype='datetime64[us]'), 'origin': pd.Series(dtype=np.int32), 'destination': pd.Series(dtype=np.int32), 'value': pd.Series(dtype=np.float64)})
+    return pd.concat(parts, ignore_index=True)
+
+def _write_matrix(matrix: sp.csr_matrix, path: Path, format: str):
+    if(format == 'npz'):
+        sp.save_npz(path.with_suffix('.npz'), matrix)
+    else:
+        scipy.io.mmwrite(str(path.with_suffix('.mtx')), matrix)
+
+@instrument.timed('od')
+def export_table(table: pd.DataFrame, directory: str, format: str = 'npz', value: str = 'n_crisis', window: str = None) -> List[Path]:
+    '''
+    Exports a movement table (any number of time steps) as OD matrices.
+
+    Args:
+        table:     movement table (construction.movement_table, administrative_movement_table or coarsened/rolled up tables)
+        directory: output directory
+        format:    'npz', 'mtx' or 'parquet'
+        value:     column to export, e.g. 'n_crisis' or 'n_baseline'
+        window:    aggregate (sum) time steps within windows of this period, e.g. 'D' (day), 'W' (week), 'M' (month)
+
+    Returns:
+        files: written matrix (or Parquet) files, one per time step or window
+    '''
+    if(format not in FORMATS):
+        instrument.error(f'Unknown OD matrix format {format}.')
+        return []
+
+    order     = write_nodes(directory, table['start'].cat.categories)
+    positions = order.get_indexer(table['start'].cat.categories)
+    origin    = positions[table['start'].cat.codes.to_numpy()].astype(np.int32)
+    target    = positions[table['end'].cat.codes.to_numpy()].astype(np.int32)
+    values    = table[value].to_numpy()
+    date_time = table['date_time']
+    if(window):
+        date_time = date_time.dt.to_period(window).dt.start_time
+    instrument.annotate(rows=len(table), nodes=len(order))
+
+    if(format == 'parquet'):
+        long = pd.DataFrame({'date_time': date_time.to_numpy(), 'origin': origin, 'destination': target, value: values})
+        long = long.groupby(['date_time', 'origin', 'destination'], sort=True).sum().reset_index()
+        return _write_parquet(long, directory)
+
+    steps, times = pd.factorize(date_time, sort=True)
+    sort   = np.argsort(steps, kind='stable')
+    bounds = np.searchsorted(steps[sort], np.arange(len(times) + 1))
+    files  = []
+    for i, time in enumerate(times):
+        rows   = sort[bounds[i]:bounds[i + 1]]
+        matrix = sp.coo_matrix((values[rows], (origin[rows], target[rows])), shape=(len(order), len(order))).tocsr()
+        matrix.sum_duplicates()
+        path   = Path(directory, _name(time) + '.' + format)
+        _write_matrix(matrix, path, format)
+        files.append(path)
+    return files
+
+def graph_matrix(graph: DiGraph, nodes: pd.Index, value: str = 'n_crisis') -> sp.csr_matrix:
+    '''
+    OD matrix of a movement graph in the order of <nodes> (must contain all nodes of <graph>).
+    '''
+    matrix = nx.to_scipy_sparse_array(graph, nodelist=list(graph), weight=value, format='coo')
+    positions = nodes.get_indexer(pd.Index(list(graph), dtype=object, tupleize_cols=False))
+    return sp.coo_matrix((matrix.data, (positions[matrix.row], positions[matrix.col])), shape=(len(nodes), len(nodes))).tocsr()
+
+@instrument.timed('od')
+def export_graphs(graphs: List[DiGraph], directory: str, format: str = 'npz', value: str = 'n_crisis', date_times: List[pd.Timestamp] = None) -> List[Path]:
+    '''
+    Exports movement graphs (e.g. one per time step, or aggregated windows of time_aggregate_movement_graph) as OD matrices,
+    the file name is the date_time of each graph.
+
+    Args:
+        graphs:     list of DiGraph objects
+        directory:  output directory
+        format:     'npz', 'mtx' or 'parquet'
+        value:      edge property to export
+        date_times: date_time of each graph (default: graph property date_time, required for aggregated graphs)
+
+    Returns:
+        files: written matrix (or Parquet) files, one per time step
+    '''
+    if(format not in FORMATS):
+        instrument.error(f'Unknown OD matrix format {format}.')
+        return []
+
+    date_times = date_times or [graph.graph.get('date_time') for graph in graphs]
+    if(any(date_time is None for date_time in date_times)):
+        instrument.error('Graph without date_time - pass date_times for aggregated graphs.')
+        return []
+
+    order = write_nodes(directory, [node for graph in graphs for node in graph])
+    files, rows = [], []
+    for graph, date_time in zip(graphs, date_times):
+        matrix    = graph_matrix(graph, order, value)
+        date_time = pd.Timestamp(date_time)
+        if(format == 'parquet'):
+            matrix = matrix.tocoo()
+            rows.append(pd.DataFrame({'date_time': date_time, 'origin': matrix.row.astype(np.int32), 'destination': matrix.col.astype(np.int32), value: matrix.data}))
+            continue
+        path = Path(directory, _name(date_time) + '.' + format)
+        _write_matrix(matrix, path, format)
+        files.append(path)
+
+    if(format == 'parquet' and rows):
+        files = _write_parquet(pd.concat(rows, ignore_index=True), directory)
+    return files
+
+@instrument.timed('od')
+def read_matrices(directory: str, format: str = 'npz') -> Tuple[Dict[pd.Timestamp, sp.csr_matrix], pd.Index]:
+    '''
+    Reads all OD matrices of <directory>.
+
+    Args:
+        directory: directory written by export_table / export_graphs
+        format:    'npz', 'mtx' or 'parquet'
+
+    Returns:
+        matrices: dict of date_time and csr matrix (shape: number of nodes, files written before the node order was extended are padded)
+        nodes:    node order of matrix rows and columns
+    '''
+    nodes = read_nodes(directory)
+    size  = len(nodes)
+    matrices = {}
+    if(format == 'parquet'):
+        long  = _read_parquet(directory)
+        value = long.columns[-1]
+        for date_time, rows in long.groupby('date_time', sort=True):
+            matrices[pd.Timestamp(date_time)] = sp.csr_matrix((rows[value].to_numpy(), (rows['origin'].to_numpy(), rows['destination'].to_numpy())), shape=(size, size))
+        return matrices, nodes
+
+    for path in sorted(Path(directory).glob(f'*.{format}')):
+        matrix = sp.load_npz(path) if format == 'npz' else scipy.io.mmread(str(path))
+        matrix = sp.csr_matrix(matrix)
+        if(matrix.shape != (size, size)):
+            matrix.resize((size, size))
+        matrices[pd.to_datetime(path.stem, format='%Y-%m-%d %H%M')] = matrix
+    return matrices, nodes
+
+@instrument.timed('od')
+def read_table(directory: str, format: str = 'npz', value: str = 'n_crisis') -> pd.DataFrame:
+    '''
+    Reads all OD matrices of <directory> as long movement table.
+
+    Args:
+        directory: directory written by export_table / export_graphs
+        format:    'npz', 'mtx' or 'parquet'
+        value:     name of the value column
+
+    Returns:
+        table: columns date_time, start, end (categoricals in node order), <value>
+    '''
+    nodes = read_nodes(directory)
+    if(format == 'parquet'):
+        long = _read_parquet(directory)
+        origin, target, values, date_time = long['origin'].to_numpy(), long['destination'].to_numpy(), long[long.columns[-1]].to_numpy(), long['date_time'].to_numpy()
+    else:
+        matrices, nodes = read_matrices(directory, format)
+        coo = [matrix.tocoo() for matrix in matrices.values()]
+        origin    = np.concatenate([matrix.row for matrix in coo]) if coo else np.zeros(0, dtype=np.int32)
+        target    = np.concatenate([matrix.col for matrix in coo]) if coo else np.zeros(0, dtype=np.int32)
+        values    = np.concatenate([matrix.data for matrix in coo]) if coo else np.zeros(0)
+        date_time = np.repeat(np.array(list(matrices), dtype='datetime64[us]'), [matrix.nnz for matrix in coo])
+
+    categories = nodes.to_numpy(dtype=object)
+    return pd.DataFrame({
+        'date_time': date_time,
+        'start':     pd.Categorical.from_codes(origin, categories=categories),
+        'end':       pd.Categorical.from_codes(target, categories=categories),
+        value:       values,
+    })
@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import construction as con
+import instrument
+import ingest
+import settings
+import store
+import utility
+import pandas       as pd
+from   concurrent.futures import ProcessPoolExecutor
+from   pathlib      import Path
+from   typing       import List, Dict, Callable
+
+'''
+Per-country partitions: every Facebook source file is parsed once (without country filter) and split into one binary
+table per country in the cached store, <cache>/partitions/<country>/<kind>/<name>.pkl. Analyzing several countries
+of the same export then costs one parse instead of one per country, and country-level jobs run in parallel
+(one process per partition). A manifest (<cache>/partitions/manifest.json) records the partitioned files,
+unchanged files are not parsed again.
+
+Usage: python partition.py --jobs 4 --run node_metrics
+'''
+
+def _run_sir(table: pd.DataFrame, infected: int = 10, infection_rate: float = 0.4, recovery_rate: float = 0.04, timeframe: int = 365) -> pd.DataFrame:
+    '''
+    Closed SIR simulation seeded with the mean population per time step of a country (administrative population partition).
+    '''
+    import model
+    population = table.groupby('date_time')['population'].sum().mean()
+    susceptible, infected, recovered, steps = model.closed_SIR(population - infected, infected, 0, infection_rate, recovery_rate, timeframe)
+    return pd.DataFrame({'susceptible': susceptible, 'infected': infected, 'recovered': recovered}, index=pd.Index(steps, name='step'))
+
+def _run_node_metrics(table: pd.DataFrame) -> pd.DataFrame:
+    import metrics
+    return metrics.node_metrics(table)
+
+def _run_coarsen(table: pd.DataFrame, delta: int = 1) -> pd.DataFrame:
+    return con.space_aggregate_movement_table(table, delta)
+
+def _run_population_totals(table: pd.DataFrame) -> pd.DataFrame:
+    return table.groupby('date_time')['population'].sum().to_frame()
+
+# Country-level jobs: name: (kind of partition, function(table, **kwargs) -> DataFrame)
+JOBS = {
+    'node_metrics':      ('movement',         _run_node_metrics),
+    'coarsen':           ('movement',         _run_coarsen),
+    'population_totals': ('population',       _run_population_totals),
+    'sir':               ('admin_population', _run_sir),
+}
+
+def partition_path(country: str, kind: str) -> str:
+    '''
+    Store kind (sub directory of <cache>) of the <kind> partition of <country>.
+    '''
+    return str(Path('partitions', country, kind))
+
+def read_manifest(cache: str) -> Dict:
+    '''
+    Reads the partition manifest of the store at <cache> (empty manifest if none exists yet).
+    '''
+    path = Path(cache, 'partitions', 'manifest.json')
+    if(not path.exists()):
+        return {'files': {}}
+    with open(path, encoding='utf8') as file:
+        return json.load(file)
+
+def write_manifest(cache: str, manifest: Dict):
+    '''
+    Writes <manifest> to <cache>/partitions/manifest.json (atomic).
+    '''
+    path = Path(cache, 'partitions', 'manifest.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    with open(temp, 'w', encoding='utf8') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(temp, path)
+
+def _split(table: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    '''
+    Splits a table by country, node categories of each part are reduced to the nodes of the part.
+    '''
+    keys  = [column for column in ('start', 'end', 'node') if column in table.columns]
+    parts = {}
+    for country, part in table.groupby('country', observed=True, sort=True):
+        part = part.reset_index(drop=True)
+        part['country'] = part['country'].cat.remove_unused_categories()
+        parts[str(country)] = con._categorize_nodes(part, keys)
+    return parts
+
+@instrument.timed('partition')
+def partition_file(kind: str, path: Path, cache: str) -> List[str]:
+    '''
+    Parses one source file and writes its rows of each country to the partitions of the store.
+
+    Args:
+        kind:  'movement', 'admin_movement', 'population' or 'admin_population'
+        path:  source file (plain, compressed or archive member)
+        cache: path pointing to the store directory
+
+    Returns:
+        countries: countries found in the file
+    '''
+    table = ingest.KINDS[kind][1]([path])
+    name  = utility.source_name(path)
+    parts = _split(table)
+    for country, part in parts.items():
+        store.write_table(part, cache, partition_path(country, kind), name)
+    instrument.annotate(rows=len(table), countries=len(parts))
+    return sorted(parts)
+
+@instrument.timed('partition')
+def partition(paths: Dict = None, cache: str = None, kinds: List[str] = None, jobs: int = None) -> Dict[str, List[str]]:
+    '''
+    Partitions all new or changed Facebook files by country, files are parsed in parallel.
+
+    Args:
+        paths: dict in the layout of settings.paths (default: settings.paths)
+        cache: path pointing to the store directory (default: settings.paths['cache'])
+        kinds: kinds to partition (default: all kinds of ingest.KINDS with a configured directory)
+        jobs:  number of worker processes (default: number of CPUs, 1: no worker processes)
+
+    Returns:
+        countries: dict of kind and all countries with partitions of that kind
+    '''
+    paths    = paths or settings.paths
+    cache    = cache or paths['cache']
+    kinds    = kinds or list(ingest.KINDS)
+    manifest = read_manifest(cache)
+
+    sources = []
+    for kind in kinds:
+        directory = paths.get(ingest.KINDS[kind][0])
+        if(not directory or not Path(directory).is_dir()):
+            continue
+        known = manifest['files'].setdefault(kind, {})
+        for path in utility.data_files(directory):
+            entry = known.get(str(path))
+            if(entry is None or {key: entry.get(key) for key in utility.fingerprint(path)} != utility.fingerprint(path)):
+                sources.append((kind, path))
+
+    results = map_jobs(partition_file, [(kind, path, cache) for kind, path in sources], jobs)
+    for (kind, path), countries in zip(sources, results):
+        if(countries is None):
+            continue
+        manifest['files'][kind][str(path)] = dict(utility.fingerprint(path), name=utility.source_name(path), countries=countries)
+    write_manifest(cache, manifest)
+    print(f'[PARTITION] {len(sources)} files parsed.')
+
+    return {kind: sorted({country for entry in manifest['files'].get(kind, {}).values() for country in entry['countries']}) for kind in kinds}
+
+def countries(cache: str, kind: str) -> List[str]:
+    '''
+    Returns the countries with partitions of <kind> in the store at <cache>.
+    '''
+    root = Path(cache, 'partitions')
+    return sorted(path.name for path in root.iterdir() if Path(path, kind).is_dir()) if root.is_dir() else []
+
+def read_partition(cache: str, kind: str, country: str, names: List[str] = None) -> pd.DataFrame:
+    '''
+    Reads the <kind> partition of <country> (all files, or the files given by their source <names>).
+    '''
+    return store.read_table(cache, partition_path(country, kind), names)
+
+def _call(function: Callable, args: tuple):
+    try:
+        return function(*args)
+    except Exception as exception:
+        instrument.error(f'{function.__name__}{args} failed ({exception}).')
+        return None
+
+def _init_worker(paths: Dict):
+    settings.paths.update(paths)
+
+def map_jobs(function: Callable, arguments: List[tuple], jobs: int = None) -> List:
+    '''
+    Calls <function> with every tuple of <arguments>, in <jobs> worker processes (1: in this process).
+    Workers start with the settings.paths of this process (also under spawn, where they re-import settings).
+    A failing call is reported and returns None.
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    if(jobs == 1 or len(arguments) <= 1):
+        return [_call(function, args) for args in arguments]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(arguments)), initializer=_init_worker, initargs=(dict(settings.paths),)) as executor:
+        return list(executor.map(_call, [function]*len(arguments), arguments))
+
+def _run_partition(job: str, cache: str, country: str, kwargs: Dict):
+    kind, function = JOBS[job]
+    table = read_partition(cache, kind, country)
+    if(table is None):
+        return None
+    with instrument.span(f'partition.{job}', 'partition', country=country, rows=len(table)):
+        return function(table, **kwargs)
+
+@instrument.timed('partition')
+def run(job: str, cache: str = None, selection: List[str] = None, jobs: int = None, save: bool = True, **kwargs) -> Dict[str, pd.DataFrame]:
+    '''
+    Runs a country-level job on every partition in parallel (one process per country).
+
+    Args:
+        job:       name of a job in JOBS
+        cache:     path pointing to the store directory (default: settings.paths['cache'])
+        selection: countries to process (default: all countries with partitions of the job's kind)
+        jobs:      number of worker processes (default: number of CPUs)
+        save:      store each result as <cache>/results/<job>/<country>.pkl
+        kwargs:    passed on to the job function
+
+    Returns:
+        results: dict of country and result table
+    '''
+    cache     = cache or settings.paths['cache']
+    kind      = JOBS[job][0]
+    selection = selection or countries(cache, kind)
+    results   = map_jobs(_run_partition, [(job, cache, country, kwargs) for country in selection], jobs)
+    results   = {country: result for country, result in zip(selection, results) if result is not None}
+    if(save):
+        for country, result in results.items():
+            store.write_table(result, cache, str(Path('results', job)), country)
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per-country partitions of Facebook files and parallel country-level jobs.')
+    parser.add_argument('--cache',     type=str, default=None, help="store directory (default: settings.paths['cache'])")
+    parser.add_argument('--jobs',      type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--kinds',     nargs='*', default=None, choices=list(ingest.KINDS), help='kinds to partition')
+    parser.add_argument('--run',       nargs='*', default=[], choices=list(JOBS), help='country-level jobs to run after partitioning')
+    parser.add_argument('--countries', nargs='*', default=None, help="countries to process, e.g. 'DE' 'AT'")
+    args = parser.parse_args()
+
+    print(partition(cache=args.cache, kinds=args.kinds, jobs=args.jobs))
+    for job in args.run:
+        results = run(job, args.cache, args.countries, args.jobs)
+        print(f'[PARTITION] {job}: {", ".join(results) or "no partitions"}')
@@ -1,10 +1,12 @@
 import analytics
 import simplekml
 import copy
+import instrument
 import construction      as con
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
 import model    as md
+import rki
 import networkx as nx
 import numpy    as np
 import pandas   as pd
@@ -21,6 +23,13 @@ import matplotlib.dates as mdates
 ### Went a couple times for a 'quick' solution over the 'clean' solution. Sorry!       ###
 ##########################################################################################
 
+def _darkgrid():
+    '''
+    Applies the darkgrid style (renamed to 'seaborn-v0_8-darkgrid' in matplotlib 3.6).
+    '''
+    plt.style.use('seaborn-darkgrid' if 'seaborn-darkgrid' in plt.style.available else 'seaborn-v0_8-darkgrid')
+
+@instrument.timed('plot')
 def tile_kml(graph: Graph, name: str):
     '''
     Generates a KML-file showing the outlines of every tile at geospatial position.
@@ -39,6 +48,7 @@ def tile_kml(graph: Graph, name: str):
         pol.style.polystyle.outline = 1
     kml.save(name + '.kml')
 
+@instrument.timed('plot')
 def plot_nation_currently_infected(date: str = '2020-06-01', store: bool = False, name: str = 'nation-active-infections-plot.png'):
     '''
     DISCLAIMER: RKI data set inconsistent (columns removed/added over time). Stable since June.
@@ -57,10 +67,11 @@ def plot_nation_currently_infected(date: str = '2020-06-01', store: bool = False
     '''
     
     fig = plt.figure()
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
     
     ts_scale = list(pd.date_range('2020-06-01', date))
+    rki.load_cubes(ts_scale)
     
     ts_currently_infected = []
     for curr in ts_scale:
@@ -91,6 +102,7 @@ def plot_nation_currently_infected(date: str = '2020-06-01', store: bool = False
 
     return fig  
 
+@instrument.timed('plot')
 def plot_state_currently_infected(date: str = '2020-06-01', store: bool = False, name: str = 'state-active-infections-plot.png'):
     '''
     DISCLAIMER: RKI data set inconsistent (columns removed/added over time). Stable since June.
@@ -108,10 +120,11 @@ def plot_state_currently_infected(date: str = '2020-06-01', store: bool = False,
         fig:   Resulting graph-figure
     '''
     fig = plt.figure()
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
     
     ts_scale = list(pd.date_range('2020-06-01', date))
+    rki.load_cubes(ts_scale)
     
     states = ['Baden-Württemberg', 'Bayern', 'Berlin', 'Brandenburg',
               'Bremen', 'Hamburg', 'Hessen', 'Mecklenburg-Vorpommern',
@@ -159,7 +172,8 @@ def plot_state_currently_infected(date: str = '2020-06-01', store: bool = False,
 
     return fig  
     
-def plot_SIR(ts_susceptible: List[float], ts_infected: List[float], ts_recovered: List[float], ts_scale: List[float], title: str, store: bool = False, name: str = 'SIR-plot.png'):
+@instrument.timed('plot')
+def plot_SIR(ts_susceptible: List[float], ts_infected: List[float], ts_recovered: List[float], ts_scale: List[float], title: str, store: bool = False, name: str = 'SIR-plot.png', time_unit: str = 'days'):
     '''
     Creates and saves a plot of susceptible, infected and recovered people over time of an SIR-model.
 
@@ -167,6 +181,8 @@ def plot_SIR(ts_susceptible: List[float], ts_infected: List[float], ts_recovered
         ts_susceptible: time series of number of susceptible people
         ts_infected:    time series of number of infected people
         ts_recovered:   time series of number of recovered people
+        ts_scale:       time steps
+        time_unit:      label of the time axis
         
     Returns:
         plot: 'plot object' of SIR dynamics (need to look up type)
@@ -190,6 +206,7 @@ def plot_SIR(ts_susceptible: List[float], ts_infected: List[float], ts_recovered
     return plot
 
 # Change position based slicing to date slicing, use None value for missing data points, add timeframe slicing   
+@instrument.timed('plot')
 def plot_state_population(graphs: List[Graph], start_date: str = '2020-03-25', store: bool = False, name: str = 'state-population-plot.png'):
     '''
     DISCLAIMER: Two missing dates in Facebook data set. Lack of time => went for the 'quick' solution. Will make function more error robust.
@@ -206,7 +223,7 @@ def plot_state_population(graphs: List[Graph], start_date: str = '2020-03-25', s
         fig: resulting graph-figure
     '''
     fig = plt.figure(figsize=(32, 18))
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
     
     curr_date = pd.to_datetime(start_date, format='%Y-%m-%d')
@@ -287,6 +304,7 @@ def plot_state_population(graphs: List[Graph], start_date: str = '2020-03-25', s
     return fig
 
 # Change position based slicing to date slicing, add timeframe slicing
+@instrument.timed('plot')
 def plot_nation_population(graphs: List[Graph], start_date: str = '2020-03-25', store: bool = False, name: str = 'nation-population-plot.png'):
     '''    
     Generates plot of total Facebook population on national level over time.
@@ -320,7 +338,7 @@ def plot_nation_population(graphs: List[Graph], start_date: str = '2020-03-25',
         })
         
     fig = plt.figure()
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
         
     plt.plot(df['date'], df['population'], marker='', color=palette(1), alpha=0.9)
@@ -344,6 +362,7 @@ def plot_nation_population(graphs: List[Graph], start_date: str = '2020-03-25',
     return fig
 
 # Use 8 hour timeframe instead of days as slice and replace plot_nation_population()?
+@instrument.timed('plot')
 def plot_nation_population_time_aggregate(graphs: List[Graph], start_date: str = '2020-03-25', slice: int = 7, store: bool = False, name: str = 'nation-population-time-aggregate-plot.png'):
     '''    
     Generates plot of time aggregated Facebook population on national level over time (default: 1 week aggregate).
@@ -379,7 +398,7 @@ def plot_nation_population_time_aggregate(graphs: List[Graph], start_date: str =
         })
         
     fig = plt.figure()
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
         
     plt.plot(df['date'], df['population'], marker='', color=palette(1), alpha=0.9)
@@ -403,6 +422,7 @@ def plot_nation_population_time_aggregate(graphs: List[Graph], start_date: str =
     return fig
 
 # Change position based slicing to date slicing, add timeframe slicing
+@instrument.timed('plot')
 def plot_state_population_share(graphs: List[Graph], start_date: str = '2020-03-25', store: bool = False, name: str = 'state-population-share-plot.png', equalize: bool = False):
     '''    
     Generates plot of relative share of Facebook population on national level over time for each state.
@@ -418,7 +438,7 @@ def plot_state_population_share(graphs: List[Graph], start_date: str = '2020-03-
         fig: resulting graph-figure
     '''
     fig = plt.figure(figsize=(32, 18))
-    plt.style.use('seaborn-darkgrid')
+    _darkgrid()
     palette = plt.get_cmap('Set1')
     
     graphs = con.time_aggregate_admin_population_graph(graphs, slice = 3)
@@ -0,0 +1,337 @@
+import instrument
+import settings
+import store
+import utility
+import numpy    as np
+import pandas   as pd
+from   collections import OrderedDict
+from   pathlib  import Path
+from   typing   import List, Dict
+
+'''
+Compact RKI publications: the columns needed for the case numbers are read with categorical Bundesland, Landkreis
+and Altersgruppe, narrow integer counts and Meldedatum parsed once per distinct value (instead of object columns and
+string comparisons on every query). Each publication is reduced to a cube of infected, recovered and dead cases per
+(Meldedatum, Bundesland, Landkreis, Altersgruppe), counting only rows with Neuer*/Neu* >= 0 as construction.cumulated_* does.
+Landkreis-level series and the cumulated_* queries are answered from the cube; cubes are kept in memory per publication
+and stored as <cache>/RKI_cube/<name>.pkl by the ingestion.
+Consecutive cubes are diffed into a reporting triangle (reporting date x publication date, update_triangle), which gives
+backfilled series including late arrivals and the reporting delay distribution without re-reading old publications.
+'''
+
+# Columns of a publication (name: dtype), Meldedatum is parsed separately
+COLUMNS = {
+    'Bundesland':      'category',
+    'Landkreis':       'category',
+    'Altersgruppe':    'category',
+    'Meldedatum':      'category',
+    'AnzahlFall':      np.int32,
+    'NeuerFall':       np.int8,
+    'AnzahlGenesen':   np.int32,
+    'NeuGenesen':      np.int8,
+    'AnzahlTodesfall': np.int32,
+    'NeuerTodesfall':  np.int8,
+}
+
+DIMENSIONS = ['Meldedatum', 'Bundesland', 'Landkreis', 'Altersgruppe']
+
+# Cube column: (count column, flag column)
+COUNTS = {
+    'infected':  ('AnzahlFall',      'NeuerFall'),
+    'recovered': ('AnzahlGenesen',   'NeuGenesen'),
+    'dead':      ('AnzahlTodesfall', 'NeuerTodesfall'),
+}
+
+CUBE_KIND  = 'RKI_cube'
+DELTA_KIND = 'RKI_delta'
+
+MAX_CUBES  = 8
+
+_cubes = OrderedDict()
+_limit = MAX_CUBES
+
+def publication_path(date: pd.Timestamp, directory: str = None) -> Path:
+    '''
+    Location of the publication of <date> in the RKI directory (default: settings.paths['RKI']), <MonthYear>/RKI_COVID19_<YYYY-MM-DD>.csv.
+    '''
+    date = pd.Timestamp(date)
+    return Path(directory or settings.paths['RKI'], f'{date.month_name()}{date.year}', f'RKI_COVID19_{date.date()}.csv')
+
+@instrument.timed('rki')
+def read_publication(path: str) -> pd.DataFrame:
+    '''
+    Reads the columns of an RKI publication needed for the case numbers in compact dtypes.
+
+    Args:
+        path: path pointing to RKI_COVID19_<YYYY-MM-DD>.csv (plain, compressed or archive member)
+
+    Returns:
+        table: DataFrame of COLUMNS (Meldedatum as datetime64) with additional column 'publication' (date of publication)
+    '''
+    with utility.open_text(path) as csvfile:
+        table = pd.read_csv(csvfile, usecols=list(COLUMNS), dtype=COLUMNS)
+    dates = table['Meldedatum'].cat
+    table['Meldedatum']  = pd.to_datetime(dates.categories, format='mixed').take(dates.codes).to_numpy()
+    table['publication'] = pd.Timestamp(utility.source_name(path)[-10:])
+    instrument.annotate(rows=len(table), bytes=int(table.memory_usage(deep=True).sum()))
+    return table
+
+@instrument.timed('rki')
+def cube(table: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Aggregates a publication to infected, recovered and dead cases per (Meldedatum, Bundesland, Landkreis, Altersgruppe).
+
+    Args:
+        table: output of read_publication
+
+    Returns:
+        cube: DataFrame with MultiIndex DIMENSIONS (observed combinations only) and int64 columns infected, recovered, dead
+    '''
+    counts = pd.DataFrame({column: table[count].where(table[flag] >= 0, 0).astype(np.int64) for column, (count, flag) in COUNTS.items()})
+    for dimension in DIMENSIONS:
+        counts[dimension] = table[dimension]
+    result = counts.groupby(DIMENSIONS, observed=True, sort=True).sum()
+    instrument.annotate(rows=len(table), cells=len(result))
+    return result
+
+def save_cube(result: pd.DataFrame, cache: str, name: str) -> Path:
+    '''
+    Stores the cube of publication <name> (source name, e.g. 'RKI_COVID19_2020-06-01') as <cache>/RKI_cube/<name>.pkl (long format).
+    '''
+    return store.write_table(result.reset_index(), cache, CUBE_KIND, name)
+
+def read_cube(cache: str, names: List[str]) -> pd.DataFrame:
+    '''
+    Reads the stored cubes of publications <names> (None if there is none), see save_cube.
+    '''
+    result = store.read_table(cache, CUBE_KIND, names)
+    return result.set_index(DIMENSIONS) if result is not None else None
+
+def load_cube(date: pd.Timestamp, cache: str = None, directory: str = None) -> pd.DataFrame:
+    '''
+    Cube of the publication of <date>: from memory, the store at <cache> (default: settings.paths['cache'] if set)
+    or built from the publication in <directory> (default: settings.paths['RKI']).
+    Memory keeps the least recently used cubes up to MAX_CUBES (or the dates of the latest load_cubes call).
+
+    Returns:
+        cube: see cube
+    '''
+    path  = publication_path(date, directory)
+    cache = cache or settings.paths.get('cache')
+    key   = (str(path), str(cache))
+    if(key in _cubes):
+        _cubes.move_to_end(key)
+        return _cubes[key]
+
+    result = read_cube(cache, [path.stem]) if cache else None
+    if(result is None):
+        result = cube(read_publication(path))
+    _cubes[key] = result
+    _trim()
+    return result
+
+def _trim():
+    while(len(_cubes) > _limit):
+        _cubes.popitem(last=False)
+
+def load_cubes(dates: List[pd.Timestamp], cache: str = None, directory: str = None, ahead: int = 4):
+    '''
+    Loads the cubes of the publications of <dates> into memory (see load_cube), publications which are not stored yet
+    are read ahead on background threads while the previous one is aggregated. Missing publications are skipped.
+    Memory keeps max(MAX_CUBES, len(<dates>)) cubes until the next load_cubes or clear_cubes call.
+    '''
+    global _limit
+    _limit = max(MAX_CUBES, len(dates))
+    _trim()
+    cache = cache or settings.paths.get('cache')
+    paths = [publication_path(date, directory) for date in dates]
+    stored = set(store.list_tables(cache, CUBE_KIND)) if cache else set()
+    paths  = [path for path in paths if (str(path), str(cache)) not in _cubes and path.stem not in stored and path.exists()]
+    for path in utility.read_ahead(paths, ahead):
+        load_cube(pd.Timestamp(path.stem[-10:]), cache, directory)
+    for date in dates:
+        if(publication_path(date, directory).stem in stored):
+            load_cube(date, cache, directory)
+
+def clear_cubes():
+    '''
+    Drops all cubes kept in memory (e.g. after a publication was replaced).
+    '''
+    global _limit
+    _limit = MAX_CUBES
+    _cubes.clear()
+
+def _select(result: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp, filters: Dict) -> pd.DataFrame:
+    dates = result.index.get_level_values('Meldedatum')
+    mask  = (dates >= start) & (dates <= end)
+    for key, value in filters.items():
+        mask &= result.index.get_level_values(key) == value
+    return result[mask]
+
+def cumulated(column: str, start_date: str = '2020-06-01', end_date: str = '', **kwargs) -> int:
+    '''
+    Number of <column> cases ('infected', 'recovered' or 'dead') reported within <start_date> and <end_date> (both inclusive)
+    according to the publication of <end_date>, see construction.cumulated_*.
+
+    Args:
+        column:     cube column
+        start_date: date-string of format 'YYYY-MM-DD'
+        end_date:   date-string of format 'YYYY-MM-DD' (default: today)
+        kwargs:     filter for values of DIMENSIONS except Meldedatum, e.g. Bundesland='Bayern' or Altersgruppe='A15-A34'
+
+    Returns:
+        count: number of cases
+    '''
+    start = pd.to_datetime(start_date, format='%Y-%m-%d')
+    end   = pd.to_datetime(end_date, format='%Y-%m-%d') if end_date else pd.Timestamp.now().normalize()
+    return _select(load_cube(end), start, end, kwargs)[column].sum()
+
+@instrument.timed('rki')
+def series(date: str, level: str = 'Landkreis', start_date: str = None, cumulative: bool = False, cache: str = None, **kwargs) -> pd.DataFrame:
+    '''
+    Daily case series per <level> (by Meldedatum) according to the publication of <date>, taken from its cube.
+
+    Args:
+        date:       date of the publication, 'YYYY-MM-DD'
+        level:      'Landkreis', 'Bundesland' or 'Altersgruppe' (None: national series)
+        start_date: first Meldedatum (default: first Meldedatum of the publication)
+        cumulative: cumulated sums instead of daily numbers
+        cache:      store directory (default: settings.paths['cache'])
+        kwargs:     filter for values of DIMENSIONS except Meldedatum, e.g. Bundesland='Bayern'
+
+    Returns:
+        series: DataFrame with MultiIndex (Meldedatum, <level>) and columns infected, recovered, dead
+                (all days from <start_date> to the publication date, missing days are 0)
+    '''
+    end    = pd.Timestamp(date)
+    result = load_cube(end, cache)
+    start  = pd.Timestamp(start_date) if start_date else result.index.get_level_values('Meldedatum').min()
+    result = _select(result, start, end, kwargs)
+
+    keys  = ['Meldedatum'] + ([level] if level else [])
+    daily = result.groupby(level=keys, observed=True).sum()
+    days  = pd.date_range(start, end, name='Meldedatum')
+    if(level):
+        groups = daily.index.get_level_values(level).unique().sort_values()
+        daily  = daily.reindex(pd.MultiIndex.from_product([days, groups], names=keys), fill_value=0)
+    else:
+        daily  = daily.reindex(days, fill_value=0)
+    if(cumulative):
+        daily = daily.groupby(level=level, observed=True).cumsum() if level else daily.cumsum()
+    return daily
+
+def delta(previous: pd.DataFrame, current: pd.DataFrame, publication: pd.Timestamp) -> pd.DataFrame:
+    '''
+    Changes of the cube of <publication> against the cube of the previous publication (cases published, corrected or recovered/dead in between).
+
+    Args:
+        previous:    cube of the previous publication (None for the first publication: all cases count as published by it)
+        current:     cube of <publication>
+        publication: date of publication of <current>
+
+    Returns:
+        delta: long DataFrame with columns DIMENSIONS, infected, recovered, dead (non-zero changes only) and publication
+    '''
+    frames = [current.reset_index()]
+    if(previous is not None):
+        frames.append((-previous).reset_index())
+    changes = pd.concat([frame.astype({dimension: object for dimension in DIMENSIONS[1:]}) for frame in frames], ignore_index=True)
+    changes = changes.groupby(DIMENSIONS, sort=True).sum().reset_index()
+    changes = changes[(changes[list(COUNTS)] != 0).any(axis=1)].reset_index(drop=True)
+    for dimension in DIMENSIONS[1:]:
+        changes[dimension] = changes[dimension].astype('category')
+    changes['publication'] = pd.Timestamp(publication)
+    return changes
+
+@instrument.timed('rki')
+def update_triangle(cache: str, dates: List[pd.Timestamp]):
+    '''
+    Updates the reporting triangle of the store at <cache> for new or changed publications of <dates>: the change of each
+    publication against its predecessor (cubes of <cache>/RKI_cube, see delta) is stored as <cache>/RKI_delta/<name>.pkl and
+    the triangle per Bundesland (series/RKI_triangle, index publication, Meldedatum, Bundesland) is updated for the affected
+    publications only. A publication inserted between known ones (or removed from the store) also updates the delta of its successor,
+    the triangle rows of removed publications are dropped.
+
+    Args:
+        cache: path pointing to the store directory
+        dates: dates of new, changed or removed publications
+    '''
+    names        = store.list_tables(cache, CUBE_KIND)
+    publications = [pd.Timestamp(name[-10:]) for name in names]
+    days         = {pd.Timestamp(date) for date in dates}
+    removed      = sorted(days.difference(publications))
+    affected     = {index for i, publication in enumerate(publications) if publication in days for index in (i, i + 1)}
+    affected.update(sum(publication < date for publication in publications) for date in removed)
+    affected     = sorted(index for index in affected if index < len(names))
+
+    rows = []
+    for i in affected:
+        previous = read_cube(cache, [names[i - 1]]) if i else None
+        changes  = delta(previous, read_cube(cache, [names[i]]), publications[i])
+        store.write_table(changes, cache, DELTA_KIND, names[i])
+        rows.append(changes.groupby(['publication', 'Meldedatum', 'Bundesland'], observed=True)[list(COUNTS)].sum())
+    instrument.annotate(publications=len(affected))
+    known    = store.read_table(cache, 'series', ['RKI_triangle'])
+    if(not rows and (known is None or not removed)):
+        return
+
+    triangle = pd.concat(rows) if rows else None
+    if(known is not None):
+        dropped  = removed + (list(triangle.index.get_level_values(0)) if rows else [])
+        triangle = pd.concat([known[~known.index.get_level_values(0).isin(dropped)]] + ([triangle] if rows else []))
+    store.write_table(triangle.sort_index(), cache, 'series', 'RKI_triangle')
+
+def triangle(cache: str, column: str = 'infected', **kwargs) -> pd.DataFrame:
+    '''
+    Reporting triangle: change of <column> cases per reporting date (rows) and publication (columns), see update_triangle.
+
+    Args:
+        cache:  path pointing to the store directory
+        column: 'infected', 'recovered' or 'dead'
+        kwargs: filter for values of DIMENSIONS except Meldedatum, e.g. Bundesland='Bayern' or Landkreis='SK Köln'
+                (filters other than Bundesland read the per-Landkreis deltas)
+
+    Returns:
+        triangle: DataFrame with index Meldedatum and one column per publication (0 where nothing changed)
+    '''
+    if(set(kwargs) <= {'Bundesland'}):
+        changes = store.read_table(cache, 'series', ['RKI_triangle'])
+        changes = changes.reset_index() if changes is not None else None
+    else:
+        changes = store.read_table(cache, DELTA_KIND)
+    if(changes is None):
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='Meldedatum'), columns=pd.DatetimeIndex([], name='publication'), dtype=np.int64)
+
+    mask = np.ones(len(changes), dtype=bool)
+    for key, value in kwargs.items():
+        mask &= (changes[key] == value).to_numpy()
+    changes = changes[mask]
+    return changes.pivot_table(index='Meldedatum', columns='publication', values=column, aggfunc='sum', fill_value=0)
+
+def backfilled(triangle: pd.DataFrame, publication: str = None) -> pd.Series:
+    '''
+    Cases per reporting date as known by <publication> (default: latest), i.e. including all cases published late up to then.
+    '''
+    if(publication):
+        triangle = triangle.loc[:, triangle.columns <= pd.Timestamp(publication)]
+    return triangle.sum(axis=1)
+
+def reporting_delay(triangle: pd.DataFrame, first: bool = False) -> pd.DataFrame:
+    '''
+    Distribution of the reporting delay (days between Meldedatum and publication) of a reporting triangle.
+
+    Args:
+        triangle: output of triangle
+        first:    include the first publication (its column holds all earlier cases, their delay is unknown)
+
+    Returns:
+        delays: DataFrame with index delay (days) and columns cases and share
+    '''
+    if(not first):
+        triangle = triangle.iloc[:, 1:]
+    cases = triangle.stack()
+    cases = cases[cases != 0]
+    delay = (cases.index.get_level_values('publication') - cases.index.get_level_values('Meldedatum')).days
+    delays = cases.groupby(pd.Index(delay, name='delay')).sum().to_frame('cases')
+    delays['share'] = delays['cases']/delays['cases'].sum() if len(delays) else []
+    return delays
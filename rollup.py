@@ -0,0 +1,251 @@
+import analytics
+import instrument
+import spatial
+import store
+import numpy    as np
+import pandas   as pd
+
+'''
+Roll-up of tile level data to administrative (polygon) level.
+The tile -> polygon mapping is learned from tile movement tables (start/end_polygon_id/name of every quadkey) and can be
+persisted in the cached store. Movement and population tables of any number of time steps are aggregated to polygon level
+with one groupby, without building graphs. Results have the layout of administrative_movement_table /
+administrative_population_table: polygons are told apart by polygon_id (names are not unique), node keys are
+(lat, lon) of the polygon as in the administrative tables if the mapping knows them, polygon ids otherwise.
+
+Usage:
+    mapping    = rollup.tile_polygon_mapping(mov_table, admin_pop_table)
+    admin_mov  = rollup.rollup_movement(mov_table, mapping)
+    admin_pop  = rollup.rollup_population(pop_table, mapping)
+'''
+
+MAPPING_KIND = 'mapping'
+MAPPING_NAME = 'tile_polygon'
+
+SUM_COLUMNS = ['n_crisis', 'n_baseline', 'n_difference']
+
+@instrument.timed('rollup')
+def tile_polygon_mapping(mov_table: pd.DataFrame, admin_table: pd.DataFrame = None) -> pd.DataFrame:
+    '''
+    Creates the tile -> polygon mapping from the start/end columns of a tile movement table.
+    A quadkey assigned to several polygons (e.g. border tiles in different files) is mapped to the most frequent one.
+
+    Args:
+        mov_table:   movement table (construction.movement_table)
+        admin_table: optional administrative population or movement table, adds polygon coordinates
+                     (polygon_lat, polygon_lon = node keys of the administrative graphs)
+
+    Returns:
+        mapping: DataFrame indexed by quadkey with columns tile_size, lat, lon, polygon_id, polygon_name, country
+                 (and polygon_lat, polygon_lon)
+    '''
+    sides = []
+    for side in ('start', 'end'):
+        sides.append(pd.DataFrame({
+            'quadkey':      mov_table[side].astype(str).to_numpy(),
+            'lat':          mov_table[f'{side}_lat'].to_numpy(),
+            'lon':          mov_table[f'{side}_lon'].to_numpy(),
+            'polygon_id':   mov_table[f'{side}_polygon_id'].to_numpy(),
+            'polygon_name': mov_table[f'{side}_polygon_name'].astype(str).to_numpy(),
+            'country':      mov_table['country'].astype(str).to_numpy(),
+        }))
+    tiles = pd.concat(sides, ignore_index=True)
+
+    counts  = tiles.groupby(['quadkey', 'polygon_id'], sort=False).size().rename('count').reset_index()
+    counts  = counts.sort_values(['quadkey', 'count', 'polygon_id'], ascending=[True, False, True]).drop_duplicates('quadkey')
+    first   = tiles.drop_duplicates(['quadkey', 'polygon_id']).set_index(['quadkey', 'polygon_id'])
+    mapping = first.loc[pd.MultiIndex.from_frame(counts[['quadkey', 'polygon_id']])].reset_index().set_index('quadkey')
+    mapping.insert(0, 'tile_size', mapping.index.str.len().astype(np.int8))
+    mapping = mapping[['tile_size', 'lat', 'lon', 'polygon_id', 'polygon_name', 'country']]
+
+    if(admin_table is not None):
+        mapping = add_polygon_coordinates(mapping, admin_table)
+    return mapping.sort_index()
+
+def add_polygon_coordinates(mapping: pd.DataFrame, admin_table: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Adds columns polygon_lat, polygon_lon (coordinates used by administrative graphs as node keys) to <mapping>.
+
+    Movement tables are matched by polygon id, population tables (no ids) by polygon name, names shared by several
+    polygons (of <admin_table> or <mapping>) are ambiguous and left without coordinates.
+
+    Args:
+        mapping:     output of tile_polygon_mapping
+        admin_table: administrative population table (polygon_name, lat, lon) or movement table
+                     (start/end_polygon_id, start_lat/lon, end_lat/lon)
+
+    Returns:
+        mapping: DataFrame with polygon coordinates (NaN for polygons missing in <admin_table>)
+    '''
+    if('polygon_name' in admin_table.columns):
+        key      = 'polygon_name'
+        polygons = admin_table[['polygon_name', 'lat', 'lon']].set_axis([key, 'polygon_lat', 'polygon_lon'], axis=1)
+        polygons = polygons.astype({key: str}).drop_duplicates()
+        shared   = mapping.drop_duplicates('polygon_id')['polygon_name'].astype(str)
+        polygons = polygons[~polygons[key].duplicated(keep=False) & ~polygons[key].isin(shared[shared.duplicated()])]
+    else:
+        key      = 'polygon_id'
+        columns  = [key, 'polygon_lat', 'polygon_lon']
+        polygons = pd.concat([admin_table[['start_polygon_id', 'start_lat', 'start_lon']].set_axis(columns, axis=1),
+                              admin_table[['end_polygon_id', 'end_lat', 'end_lon']].set_axis(columns, axis=1)], ignore_index=True)
+        polygons = polygons.drop_duplicates(key)
+    mapping = mapping.drop(columns=['polygon_lat', 'polygon_lon'], errors='ignore')
+    return mapping.join(polygons.set_index(key), on=key)
+
+def update_mapping(mapping: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Adds the quadkeys of mapping <new> which are missing in <mapping> (known quadkeys keep their polygon).
+    '''
+    if(mapping is None):
+        return new
+    return pd.concat([mapping, new[~new.index.isin(mapping.index)]]).sort_index()
+
+def save_mapping(mapping: pd.DataFrame, cache: str):
+    '''
+    Stores <mapping> in the cached store at <cache> (<cache>/mapping/tile_polygon.pkl).
+    '''
+    store.write_table(mapping, cache, MAPPING_KIND, MAPPING_NAME)
+
+def load_mapping(cache: str) -> pd.DataFrame:
+    '''
+    Reads the tile -> polygon mapping from the cached store at <cache> (None if none was stored yet).
+    '''
+    return store.read_table(cache, MAPPING_KIND, [MAPPING_NAME])
+
+def _polygon_codes(quadkeys: pd.Index, mapping: pd.DataFrame, max_distance_km: float = None) -> np.ndarray:
+    '''
+    Position in <mapping> of the polygon of each quadkey (-1 if unmapped).
+    Quadkeys of a higher tile level than the mapping are mapped by their parent tile, quadkeys missing in the mapping
+    are assigned to the polygon of the nearest mapped tile within <max_distance_km> (no fallback if None).
+    '''
+    tile_size = int(mapping['tile_size'].max())
+    keys      = pd.Index(quadkeys.astype(str))
+    keys      = keys.where(keys.str.len() <= tile_size, keys.str[:tile_size])
+    codes     = mapping.index.get_indexer(keys)
+
+    missing = np.flatnonzero(codes < 0)
+    if(len(missing) and max_distance_km is not None):
+        index = spatial.SpatialIndex(np.arange(len(mapping)), mapping['lat'].to_numpy(), mapping['lon'].to_numpy())
+        for i in missing:
+            lat, lon = analytics.quadkey_to_lat_lon(keys[i])
+            nearest  = index.nearest(lat, lon, 1)
+            if(nearest and nearest[0][1] <= max_distance_km):
+                codes[i] = nearest[0][0]
+    return codes
+
+def _polygons(mapping: pd.DataFrame, rows: np.ndarray):
+    '''
+    Converts mapping row positions to polygon codes, polygons are identified by polygon_id.
+
+    Returns:
+        codes:    polygon code of each row position (-1 for unmapped positions)
+        polygons: DataFrame with one row per polygon (sorted by polygon_id) indexed by node key,
+                  (polygon_lat, polygon_lon) if known and unique for every polygon, polygon_id otherwise
+    '''
+    polygon, ids = pd.factorize(mapping['polygon_id'], sort=True)
+    columns  = [column for column in ('polygon_id', 'polygon_name', 'polygon_lat', 'polygon_lon') if column in mapping.columns]
+    polygons = mapping[columns].groupby(polygon).first()
+    coordinates = pd.Index(list(zip(polygons['polygon_lat'], polygons['polygon_lon'])), dtype=object, tupleize_cols=False) if 'polygon_lat' in polygons.columns else None
+    if(coordinates is not None and polygons[['polygon_lat', 'polygon_lon']].notna().all(axis=None) and coordinates.is_unique):
+        polygons.index = coordinates
+    else:
+        polygons.index = pd.Index(ids, dtype=object)
+    return np.where(rows >= 0, polygon[np.maximum(rows, 0)], -1), polygons
+
+@instrument.timed('rollup')
+def rollup_movement(table: pd.DataFrame, mapping: pd.DataFrame, max_distance_km: float = None) -> pd.DataFrame:
+    '''
+    Aggregates a tile movement table to polygon level for all time steps at once.
+    Flows between tiles of the same polygon become self loops of the polygon, length_km is the flow-weighted mean length
+    (0.0 for edges without flow, as in construction.space_aggregate_movement_table).
+
+    Args:
+        table:           movement table (construction.movement_table)
+        mapping:         output of tile_polygon_mapping / load_mapping
+        max_distance_km: assign quadkeys missing in the mapping to the nearest mapped tile within this distance (default: drop)
+
+    Returns:
+        table: movement table with columns date_time, start, end (node keys, see _polygons), start_polygon_id, end_polygon_id,
+               start_polygon_name, end_polygon_name, country, n_crisis (and n_baseline, n_difference, percent_change if loaded), length_km
+               (and start_lat/lon, end_lat/lon if the mapping has polygon coordinates)
+    '''
+    codes, polygons = _polygons(mapping, _polygon_codes(table['start'].cat.categories, mapping, max_distance_km))
+    start = codes[table['start'].cat.codes.to_numpy()]
+    end   = codes[table['end'].cat.codes.to_numpy()]
+    kept  = (start >= 0) & (end >= 0)
+    instrument.annotate(rows=len(table), dropped_unmapped=int((~kept).sum()))
+
+    sums    = [column for column in SUM_COLUMNS if column in table.columns]
+    weight  = table['n_crisis'].to_numpy(dtype=np.float64)[kept]
+    grouped = pd.DataFrame({
+        'date_time': table['date_time'].to_numpy()[kept],
+        'start':     start[kept],
+        'end':       end[kept],
+        'country':   table['country'].astype(str).to_numpy()[kept],
+        **{column: table[column].to_numpy()[kept] for column in sums},
+        'flow_km':   weight*table['length_km'].to_numpy()[kept],
+    }).groupby(['date_time', 'start', 'end', 'country'], sort=True).sum().reset_index()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grouped['length_km'] = np.where(grouped['n_crisis'] > 0, grouped['flow_km']/grouped['n_crisis'], 0.0)
+        if('n_baseline' in sums):
+            grouped['percent_change'] = 100*(grouped['n_crisis'] - grouped['n_baseline'])/grouped['n_baseline'].where(grouped['n_baseline'] > 0)
+    grouped = grouped.drop(columns='flow_km')
+
+    start, end = grouped['start'].to_numpy(), grouped['end'].to_numpy()
+    nodes  = polygons.index
+    rolled = grouped.drop(columns=['start', 'end'])
+    rolled.insert(1, 'start', pd.Categorical.from_codes(start, categories=nodes))
+    rolled.insert(2, 'end',   pd.Categorical.from_codes(end,   categories=nodes))
+    rolled.insert(3, 'start_polygon_id', polygons['polygon_id'].to_numpy()[start])
+    rolled.insert(4, 'end_polygon_id',   polygons['polygon_id'].to_numpy()[end])
+    rolled.insert(5, 'start_polygon_name', pd.Categorical(polygons['polygon_name'].to_numpy()[start]))
+    rolled.insert(6, 'end_polygon_name',   pd.Categorical(polygons['polygon_name'].to_numpy()[end]))
+    rolled['country'] = rolled['country'].astype('category')
+    if('polygon_lat' in polygons.columns):
+        for side, codes in (('start', start), ('end', end)):
+            rolled[f'{side}_lat'] = polygons['polygon_lat'].to_numpy()[codes]
+            rolled[f'{side}_lon'] = polygons['polygon_lon'].to_numpy()[codes]
+    return rolled
+
+@instrument.timed('rollup')
+def rollup_population(table: pd.DataFrame, mapping: pd.DataFrame, max_distance_km: float = None) -> pd.DataFrame:
+    '''
+    Aggregates a tile population table to polygon level for all time steps at once.
+    Tiles of a higher level than the mapping (population tiles are usually one level finer than movement tiles)
+    are mapped by their parent quadkey.
+
+    Args:
+        table:           population table (construction.population_table)
+        mapping:         output of tile_polygon_mapping / load_mapping
+        max_distance_km: assign quadkeys missing in the mapping to the nearest mapped tile within this distance (default: drop)
+
+    Returns:
+        table: population table with columns date_time, node (node key, see _polygons), polygon_id, polygon_name, country, population
+               (and n_baseline, n_difference, percent_change if loaded; lat, lon if the mapping has polygon coordinates)
+    '''
+    codes, polygons = _polygons(mapping, _polygon_codes(table['node'].cat.categories, mapping, max_distance_km))
+    node  = codes[table['node'].cat.codes.to_numpy()]
+    kept  = node >= 0
+    instrument.annotate(rows=len(table), dropped_unmapped=int((~kept).sum()))
+
+    sums    = ['population'] + [column for column in SUM_COLUMNS[1:] if column in table.columns]
+    grouped = pd.DataFrame({
+        'date_time': table['date_time'].to_numpy()[kept],
+        'node':      node[kept],
+        'country':   table['country'].astype(str).to_numpy()[kept],
+        **{column: table[column].to_numpy()[kept] for column in sums},
+    }).groupby(['date_time', 'node', 'country'], sort=True).sum().reset_index()
+    if('n_baseline' in sums):
+        grouped['percent_change'] = 100*(grouped['population'] - grouped['n_baseline'])/grouped['n_baseline'].where(grouped['n_baseline'] > 0)
+
+    node   = grouped['node'].to_numpy()
+    rolled = grouped.drop(columns='node')
+    rolled.insert(1, 'node', pd.Categorical.from_codes(node, categories=polygons.index))
+    rolled.insert(2, 'polygon_id', polygons['polygon_id'].to_numpy()[node])
+    rolled.insert(3, 'polygon_name', pd.Categorical(polygons['polygon_name'].to_numpy()[node]))
+    rolled['country'] = rolled['country'].astype('category')
+    if('polygon_lat' in polygons.columns):
+        rolled['lat'] = polygons['polygon_lat'].to_numpy()[node]
+        rolled['lon'] = polygons['polygon_lon'].to_numpy()[node]
+    return rolled
@@ -12,4 +12,6 @@ paths = {
     'population_path': Path('D:/Eigene Dokumente/Arbeit/Studium/Bachelorarbeit/Data/Facebook/Germany Coronavirus Disease Prevention Map Mar 26 2020/Facebook Population (Tile Level)'),
     'admin_population_path': Path('D:/Eigene Dokumente/Arbeit/Studium/Bachelorarbeit/Data/Facebook/Germany Coronavirus Disease Prevention Map Mar 26 2020/Facebook Population (Administrative Regions)'),
     'root': Path('D:/Eigene Dokumente/Arbeit/Studium/Bachelorarbeit/Graph Analysis'),
+    'cache': Path('D:/Eigene Dokumente/Arbeit/Studium/Bachelorarbeit/Graph Analysis/Cache'),
+    'quarantine': Path('D:/Eigene Dokumente/Arbeit/Studium/Bachelorarbeit/Graph Analysis/Quarantine'),
 }
\ No newline at end of file
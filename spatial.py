@@ -0,0 +1,182 @@
+import instrument
+import numpy          as np
+import pandas         as pd
+from   networkx       import Graph
+from   typing         import List, Tuple, Hashable
+
+'''
+Spatial index over the nodes of a graph (or the nodes of a table) for bounding box, radius, k-nearest and quadkey prefix queries.
+Nodes are placed on the unit sphere and stored in a KD-tree, the chord length between two points grows monotonically with their
+great-circle distance, so radius and nearest neighbour queries are exact on the sphere (radius 6371.0088 km) and take logarithmic time.
+Graphs of different time steps usually share their node set, build the index once and reuse it (SpatialIndex.matches / graph_indices).
+
+Usage:
+    index = spatial.graph_index(graph)
+    index.radius(52.52, 13.40, 25)           # nodes within 25 km of Berlin
+    index.nearest(52.52, 13.40, 5)           # five nearest nodes with distance in km
+    index.bbox(47.3, 5.9, 55.1, 15.0)        # nodes inside lat/lon bounding box
+'''
+
+EARTH_RADIUS_KM = 6371.0088
+
+def _unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    return np.column_stack([np.cos(lat)*np.cos(lon), np.cos(lat)*np.sin(lon), np.sin(lat)])
+
+def _chord(distance_km: float) -> float:
+    '''
+    Chord length on the unit sphere of a great-circle distance in km.
+    '''
+    return 2*np.sin(min(distance_km/EARTH_RADIUS_KM, np.pi)/2)
+
+def _great_circle(chord: np.ndarray) -> np.ndarray:
+    '''
+    Great-circle distance in km of chord lengths on the unit sphere.
+    '''
+    return 2*EARTH_RADIUS_KM*np.arcsin(np.clip(np.asarray(chord)/2, 0, 1))
+
+def distance_matrix(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    '''
+    Great-circle distances in km between all pairs of points (n x n matrix, memory grows with n^2).
+    '''
+    points = _unit_vectors(lat, lon)
+    chords = np.sqrt(np.maximum(2 - 2*np.clip(points @ points.T, -1, 1), 0))
+    return _great_circle(chords)
+
+class SpatialIndex:
+    '''
+    KD-tree over node coordinates, queries return node keys (in order of increasing distance for radius and nearest).
+
+    Args:
+        nodes: node keys (quadkeys or (lat, lon) tuples)
+        lat:   latitude of each node in degrees
+        lon:   longitude of each node in degrees
+    '''
+    def __init__(self, nodes: List[Hashable], lat: np.ndarray, lon: np.ndarray):
+        self.nodes    = np.empty(len(nodes), dtype=object)
+        self.nodes[:] = list(nodes)
+        self.lat      = np.asarray(lat, dtype=np.float64)
+        self.lon      = np.asarray(lon, dtype=np.float64)
+        from scipy.spatial import cKDTree
+        self.tree     = cKDTree(_unit_vectors(self.lat, self.lon))
+        self.position = {node: i for i, node in enumerate(self.nodes)}
+        self._quadkeys = None
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def matches(self, graph: Graph) -> bool:
+        '''
+        True if <graph> has exactly the node set of this index (the index can be reused for it).
+        '''
+        return len(graph) == len(self.nodes) and all(node in self.position for node in graph)
+
+    def radius(self, lat: float, lon: float, radius_km: float) -> List[Hashable]:
+        '''
+        Nodes within <radius_km> (great-circle distance) of point (lat, lon), nearest first.
+        '''
+        point     = _unit_vectors([lat], [lon])[0]
+        positions = np.asarray(self.tree.query_ball_point(point, _chord(radius_km)), dtype=np.int64)
+        distances = np.linalg.norm(self.tree.data[positions] - point, axis=1) if len(positions) else np.zeros(0)
+        return list(self.nodes[positions[np.argsort(distances, kind='stable')]])
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> List[Tuple[Hashable, float]]:
+        '''
+        The <k> nodes nearest to point (lat, lon) as (node, distance in km), nearest first.
+        '''
+        k = min(k, len(self.nodes))
+        if(k <= 0):
+            return []
+        chords, positions = self.tree.query(_unit_vectors([lat], [lon])[0], k=k)
+        chords, positions = np.atleast_1d(chords), np.atleast_1d(positions)
+        return list(zip(self.nodes[positions], _great_circle(chords)))
+
+    def bbox(self, lat_min: float, lon_min: float, lat_max: float, lon_max: float) -> List[Hashable]:
+        '''
+        Nodes inside the bounding box (borders included), lon_min > lon_max selects a box crossing the antimeridian.
+        Candidates are taken from the sphere cap around the box center through the farthest box corner
+        (for boxes less than 180 degrees wide no point of the box is farther from the center than a corner).
+        '''
+        width   = (lon_max - lon_min) % 360 if lon_min > lon_max else lon_max - lon_min
+        center  = _unit_vectors([(lat_min + lat_max)/2], [lon_min + width/2])[0]
+        corners = _unit_vectors([lat_min, lat_min, lat_max, lat_max], [lon_min, lon_max, lon_min, lon_max])
+        reach   = np.linalg.norm(corners - center, axis=1).max() if width < 180 else 2.0
+        positions = np.asarray(self.tree.query_ball_point(center, reach + 1e-12), dtype=np.int64)
+        lat, lon  = self.lat[positions], self.lon[positions]
+        inside    = (lat >= lat_min) & (lat <= lat_max)
+        if(lon_min > lon_max):
+            inside &= (lon >= lon_min) | (lon <= lon_max)
+        else:
+            inside &= (lon >= lon_min) & (lon <= lon_max)
+        return list(self.nodes[np.sort(positions[inside])])
+
+    def within_quadkey(self, prefix: str) -> List[Hashable]:
+        '''
+        Tile level nodes (quadkeys) inside tile <prefix>, i.e. all quadkeys starting with <prefix> (binary search on sorted keys).
+        '''
+        if(self._quadkeys is None):
+            self._quadkeys = np.sort(np.array([node for node in self.nodes if isinstance(node, str)], dtype=str))
+        keys = self._quadkeys
+        return list(keys[np.searchsorted(keys, prefix, 'left'):np.searchsorted(keys, prefix + '4', 'left')])
+
+    def distances(self, lat: float, lon: float) -> np.ndarray:
+        '''
+        Great-circle distance in km of every node (index order) to point (lat, lon).
+        '''
+        return _great_circle(np.linalg.norm(self.tree.data - _unit_vectors([lat], [lon])[0], axis=1))
+
+@instrument.timed('spatial')
+def graph_index(graph: Graph) -> SpatialIndex:
+    '''
+    Builds a spatial index over the nodes of <graph>.
+    Coordinates are read from node properties lat/lon (tile level) or from (lat, lon) node keys (administrative level).
+
+    Args:
+        graph: movement or population graph
+
+    Returns:
+        index: SpatialIndex
+    '''
+    nodes = list(graph.nodes)
+    data  = graph.nodes
+    lat   = [data[node]['lat'] if 'lat' in data[node] else node[0] for node in nodes]
+    lon   = [data[node]['lon'] if 'lon' in data[node] else node[1] for node in nodes]
+    return SpatialIndex(nodes, lat, lon)
+
+@instrument.timed('spatial')
+def table_index(table: pd.DataFrame) -> SpatialIndex:
+    '''
+    Builds a spatial index over the nodes of a table (construction.population_table or movement_table).
+
+    Args:
+        table: population table (columns node, lat, lon) or movement table (columns start/end, start_lat/lon, end_lat/lon)
+
+    Returns:
+        index: SpatialIndex over all distinct nodes of all time steps
+    '''
+    if('node' in table.columns):
+        nodes = table[['node', 'lat', 'lon']]
+    else:
+        columns = ['node', 'lat', 'lon']
+        nodes   = pd.concat([table[['start', 'start_lat', 'start_lon']].set_axis(columns, axis=1),
+                             table[['end', 'end_lat', 'end_lon']].set_axis(columns, axis=1)], ignore_index=True)
+    nodes = nodes.drop_duplicates('node')
+    return SpatialIndex(nodes['node'].astype(object).tolist(), nodes['lat'].to_numpy(), nodes['lon'].to_numpy())
+
+def graph_indices(graphs: List[Graph]) -> List[SpatialIndex]:
+    '''
+    Spatial index for each graph of a time series, an index is only rebuilt when the node set changes.
+
+    Args:
+        graphs: list of graphs (e.g. one per time step)
+
+    Returns:
+        indices: one SpatialIndex per graph (shared objects for graphs with equal node sets)
+    '''
+    indices = []
+    for graph in graphs:
+        if(not indices or not indices[-1].matches(graph)):
+            indices.append(graph_index(graph))
+        else:
+            indices.append(indices[-1])
+    return indices
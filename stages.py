@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+import zipfile
+import instrument
+import partition
+import utility
+from   pathlib  import Path
+from   typing   import Any, Callable, Dict, List, Union
+
+'''
+Content-addressed stage cache of the pipeline (CSV -> graph/table -> space/time aggregation -> merge -> SIR -> plot).
+Every derived artifact is stored under a key hashing its stage, function, parameters and the keys of its inputs,
+<cache>/stages/<stage>/<key>.pkl with a manifest <key>.json recording which inputs and parameters produced it.
+Source files are keyed by a hash of their content (re-hashed only if size or modification time changed), so a
+changed 8-hour file changes the keys of exactly the artifacts depending on it: unchanged artifacts are loaded
+from the cache, only the affected ones and everything downstream of them are rebuilt on rerun.
+Artifacts are built by map_jobs workers, inputs are loaded in the worker (a stage whose outputs are cached reads nothing).
+
+Usage:
+    files  = stages.sources(cache, utility.data_files(settings.paths['movement_path']))
+    graphs = stages.stage(cache, 'movement_graph', con.movement_graph, [[file] for file in files], country='DE')
+    coarse = stages.stage(cache, 'coarse', con.space_aggregate_movement_graph, [[graph] for graph in graphs], delta=2)
+    (total,) = stages.stage(cache, 'time_aggregate', con.time_aggregate_movement_graph, [[coarse]])   # one argument: list of graphs
+    graph  = stages.load(cache, total)
+'''
+
+SOURCE = 'source'
+
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _root(cache: str) -> Path:
+    return Path(cache, 'stages')
+
+def _dump(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    temp.write_bytes(data)
+    os.replace(temp, path)
+
+def hash_file(path: str) -> str:
+    '''
+    SHA-256 of the content of a source file (plain, compressed or .zip archive member, see utility.split_archive).
+    '''
+    digest = hashlib.sha256()
+    archive, member = utility.split_archive(path)
+    with (zipfile.ZipFile(archive).open(member) if member else open(archive, 'rb')) as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def sources(cache: str, paths: List[str]) -> List[str]:
+    '''
+    Keys of source files ('source:<content hash>'). Hashes are remembered in <cache>/stages/sources.json with the
+    fingerprint of the file (see utility.fingerprint) and only recomputed for new or changed files.
+
+    Args:
+        cache: path pointing to the store directory
+        paths: source files
+
+    Returns:
+        keys: one key per file, to be used as stage inputs
+    '''
+    index = Path(_root(cache), 'sources.json')
+    known = json.loads(index.read_text(encoding='utf8')) if index.exists() else {}
+    keys  = []
+    for path in paths:
+        fingerprint = utility.fingerprint(path)
+        entry       = known.get(str(path))
+        if(entry is None or entry['fingerprint'] != fingerprint):
+            entry = known[str(path)] = {'fingerprint': fingerprint, 'key': f'{SOURCE}:{hash_file(path)}'}
+        keys.append(entry['key'])
+    _dump(index, json.dumps(known, indent=1).encode('utf8'))
+    instrument.annotate(files=len(keys))
+    return keys
+
+def _paths(cache: str) -> Dict[str, str]:
+    '''
+    Source key -> path of all known source files.
+    '''
+    index = Path(_root(cache), 'sources.json')
+    known = json.loads(index.read_text(encoding='utf8')) if index.exists() else {}
+    return {entry['key']: path for path, entry in known.items()}
+
+def artifact_path(cache: str, key: str) -> Path:
+    '''
+    Location of artifact <key> ('<stage>:<hash>') in the store at <cache>.
+    '''
+    stage, digest = key.split(':')
+    return Path(_root(cache), stage, f'{digest}.pkl')
+
+def _flatten(inputs: List) -> List[str]:
+    return [key for item in inputs for key in (item if isinstance(item, (list, tuple)) else [item])]
+
+def artifact_key(stage: str, function: Callable, inputs: List, params: Dict, version: int = 1) -> str:
+    '''
+    Key of the artifact of <function> applied to <inputs> (keys or lists of keys) with keyword arguments <params>.
+    '''
+    description = {
+        'function': f'{function.__module__}.{function.__qualname__}',
+        'version':  version,
+        'inputs':   [list(item) if isinstance(item, (list, tuple)) else item for item in inputs],
+        'params':   params,
+    }
+    return f'{stage}:{_hash(json.dumps(description, sort_keys=True, default=str).encode("utf8"))}'
+
+def load(cache: str, key: str) -> Any:
+    '''
+    Loads artifact <key> (or returns the path of source <key>).
+    '''
+    if(key.startswith(SOURCE + ':')):
+        return _paths(cache)[key]
+    with open(artifact_path(cache, key), 'rb') as file:
+        return pickle.load(file)
+
+def _build(cache: str, stage: str, function: Callable, inputs: List, params: Dict, key: str, paths: Dict[str, str]) -> str:
+    '''
+    Loads the inputs of one artifact (<paths>: source key -> path of its source inputs), calls <function> and stores the result with its manifest.
+    '''
+    resolve = lambda key: paths[key] if key.startswith(SOURCE + ':') else load(cache, key)
+    args    = [[resolve(item) for item in keys] if isinstance(keys, (list, tuple)) else resolve(keys) for keys in inputs]
+    start   = time.perf_counter()
+    result  = function(*args, **params)
+    seconds = time.perf_counter() - start
+    path    = artifact_path(cache, key)
+    _dump(path, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    manifest = {
+        'key':      key,
+        'function': f'{function.__module__}.{function.__qualname__}',
+        'inputs':   inputs,
+        'sources':  paths,
+        'params':   params,
+        'seconds':  seconds,
+        'created':  time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    _dump(path.with_suffix('.json'), json.dumps(manifest, indent=1, default=str).encode('utf8'))
+    return key
+
+@instrument.timed('stages')
+def stage(cache: str, name: str, function: Callable, inputs: List[List[Union[str, List[str]]]], jobs: int = None, version: int = 1, **params) -> List[str]:
+    '''
+    Runs a pipeline stage: one artifact per entry of <inputs>, built as function(*arguments, **params) unless an
+    artifact with the same key exists. Arguments are loaded artifacts (source files: their path), a list of keys
+    is passed as one list argument (e.g. all graphs of a time aggregation).
+
+    Args:
+        cache:    path pointing to the store directory
+        name:     stage name (sub directory of <cache>/stages)
+        function: module level function (picklable for the worker processes)
+        inputs:   one list of arguments (keys or lists of keys) per artifact
+        jobs:     number of worker processes for the missing artifacts (1: in this process, default: number of CPUs)
+        version:  increase to rebuild the stage after changes of <function>
+        params:   keyword arguments of <function>, part of the key
+
+    Returns:
+        keys: artifact key per entry of <inputs>, None if an input is missing or the build failed
+    '''
+    paths   = _paths(cache)
+    keys    = [None if None in _flatten(arguments) else artifact_key(name, function, arguments, params, version) for arguments in inputs]
+    missing = {key: arguments for key, arguments in zip(keys, inputs) if key is not None and not artifact_path(cache, key).exists()}
+    if(None in keys):
+        instrument.error(f'Stage {name}: skipped {keys.count(None)} artifacts with missing inputs.')
+    built   = partition.map_jobs(_build, [(cache, name, function, arguments, params, key, {item: paths[item] for item in _flatten(arguments) if item in paths}) for key, arguments in missing.items()], jobs)
+    failed  = {key for key, result in zip(missing, built) if result is None}
+    instrument.annotate(artifacts=len(keys), cached=len(keys) - len(missing) - keys.count(None), built=len(missing) - len(failed))
+    return [None if key in failed else key for key in keys]
+
+def manifest(cache: str, key: str) -> Dict:
+    '''
+    Manifest of artifact <key>: function, inputs, source paths, params, build time.
+    '''
+    with open(artifact_path(cache, key).with_suffix('.json'), encoding='utf8') as file:
+        return json.load(file)
+
+def lineage(cache: str, key: str) -> Dict[str, List[str]]:
+    '''
+    All upstream artifacts and sources of <key>.
+
+    Returns:
+        lineage: artifact key -> its input keys (flattened), sources map to an empty list
+    '''
+    graph, pending = {}, [key]
+    while(pending):
+        current = pending.pop()
+        if(current in graph):
+            continue
+        graph[current] = [] if current.startswith(SOURCE + ':') else _flatten(manifest(cache, current)['inputs'])
+        pending.extend(graph[current])
+    return graph
+
+def prune(cache: str, keep: List[str]) -> int:
+    '''
+    Removes all artifacts not needed for the artifacts <keep> (e.g. the final outputs of the latest run).
+
+    Returns:
+        removed: number of removed artifacts
+    '''
+    needed  = set()
+    for key in keep:
+        needed.update(lineage(cache, key))
+    removed = 0
+    for path in _root(cache).glob('*/*.pkl'):
+        if(f'{path.parent.name}:{path.stem}' not in needed):
+            path.unlink()
+            path.with_suffix('.json').unlink(missing_ok=True)
+            removed += 1
+    return removed
@@ -0,0 +1,89 @@
+import os
+import pandas  as pd
+from   pathlib import Path
+from   typing  import List
+
+'''
+Cached store: binary (pickled DataFrame) copies of tables built by the construction module,
+one file per source file at <cache>/<kind>/<name>.pkl, e.g. <cache>/movement/2020-06-01 0000.pkl.
+Writes are atomic (temporary file + rename), so an interrupted run never leaves a half written table.
+'''
+
+def table_path(cache: str, kind: str, name: str) -> Path:
+    '''
+    Returns the location of table <name> of <kind> in the store at <cache>.
+    '''
+    return Path(cache, kind, f'{name}.pkl')
+
+def write_table(table: pd.DataFrame, cache: str, kind: str, name: str) -> Path:
+    '''
+    Stores <table> as <cache>/<kind>/<name>.pkl (atomic).
+
+    Args:
+        table: DataFrame
+        cache: path pointing to the store directory
+        kind:  table kind (sub directory), e.g. 'movement'
+        name:  table name, usually the stem of the source file
+
+    Returns:
+        path: location of the stored table
+    '''
+    path = table_path(cache, kind, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(path.name + '.tmp')
+    table.to_pickle(temp)
+    os.replace(temp, path)
+    return path
+
+def read_table(cache: str, kind: str, names: List[str] = None) -> pd.DataFrame:
+    '''
+    Reads and concatenates tables of <kind> from the store at <cache>.
+
+    Args:
+        cache: path pointing to the store directory
+        kind:  table kind (sub directory), e.g. 'movement'
+        names: table names (default: all tables of <kind> in name order)
+
+    Returns:
+        table: DataFrame (None if there is no such table)
+    '''
+    names  = list_tables(cache, kind) if names is None else names
+    tables = [pd.read_pickle(table_path(cache, kind, name)) for name in names if table_path(cache, kind, name).exists()]
+    if(not tables):
+        return None
+    if(len(tables) == 1):
+        return tables[0]
+    return _concat(tables)
+
+def list_tables(cache: str, kind: str) -> List[str]:
+    '''
+    Returns the sorted names of all tables of <kind> in the store at <cache>.
+    '''
+    return sorted(path.stem for path in Path(cache, kind).glob('*.pkl'))
+
+def remove_table(cache: str, kind: str, name: str):
+    '''
+    Removes table <name> of <kind> from the store at <cache> (if present).
+    '''
+    path = table_path(cache, kind, name)
+    if(path.exists()):
+        path.unlink()
+
+def _concat(tables: List[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Concatenates tables and restores categorical columns (pandas falls back to object for differing categories).
+    '''
+    categorical = [column for column, dtype in tables[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    table = pd.concat(tables, ignore_index=True)
+    if(not categorical):
+        return table
+
+    node_columns = [column for column in ('start', 'end', 'node') if column in categorical]
+    if(node_columns):
+        nodes = pd.Index(pd.unique(pd.concat([table[column].astype(object) for column in node_columns])), dtype=object, tupleize_cols=False).sort_values()
+        for column in node_columns:
+            table[column] = pd.Categorical(table[column].astype(object), categories=nodes)
+    for column in categorical:
+        if(column not in node_columns):
+            table[column] = table[column].astype('category')
+    return table
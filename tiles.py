@@ -0,0 +1,187 @@
+import json
+import os
+import shutil
+import construction as con
+import instrument
+import partition
+import numpy    as np
+import pandas   as pd
+from   pathlib  import Path
+from   typing   import List, Tuple
+
+'''
+Precomputed multi-zoom GeoJSON tile pyramid of population and movement tables for local map viewers.
+Map tile z/x/y (web mercator, quadkey of length z) holds the data of its area aggregated to quadkey level
+z + detail (at most the tile size of the data): tile polygons with their population, or flow lines starting in the tile.
+Lower zooms reuse the quadkey aggregation of construction (one groupby per zoom for all time steps), the files of every
+time step and zoom are written in parallel to <directory>/<kind>/<YYYY-MM-DD HHMM>/<z>/<x>/<y>.geojson, an index.json
+per kind lists time steps, zooms, bounds and value ranges for the colour scale of the viewer.
+
+Usage:
+    tiles.pyramid(pop_table, 'tiles', min_zoom=4)             # tiles/population/...
+    tiles.pyramid(mov_table, 'tiles', min_zoom=4, jobs=8)     # tiles/movement/...
+'''
+
+DATE_TIME_FORMAT = '%Y-%m-%d %H%M'
+
+def _kind(table: pd.DataFrame) -> str:
+    return 'movement' if 'start' in table.columns else 'population'
+
+def tile_coordinates(quadkeys: pd.Index) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    Tile coordinates of quadkeys of the same length (vectorized analytics.quadkey_to_tile_coordinates).
+    '''
+    if(len(quadkeys) == 0):
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    digits  = np.frombuffer(''.join(quadkeys).encode('ascii'), dtype=np.uint8).reshape(len(quadkeys), -1).astype(np.int64) - ord('0')
+    weights = np.int64(1) << np.arange(digits.shape[1] - 1, -1, -1, dtype=np.int64)
+    return (digits & 1) @ weights, (digits >> 1) @ weights
+
+def tile_bounds(x: np.ndarray, y: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Bounds (west, south, east, north in degrees) of tiles <x>, <y> at <zoom>.
+    '''
+    size = 2.0**zoom
+    lat  = lambda y: np.degrees(np.arctan(np.sinh(np.pi*(1 - 2*y/size))))
+    return x/size*360 - 180, lat(y + 1), (x + 1)/size*360 - 180, lat(y)
+
+def _population_features(part: pd.DataFrame, value: str) -> List[dict]:
+    quadkeys = part['node'].astype(str).to_numpy()
+    x, y     = tile_coordinates(quadkeys)
+    west, south, east, north = (np.round(bound, 6).tolist() for bound in tile_bounds(x, y, len(quadkeys[0]) if len(quadkeys) else 0))
+    return [{
+        'type':       'Feature',
+        'geometry':   {'type': 'Polygon', 'coordinates': [[[w, s], [e, s], [e, n], [w, n], [w, s]]]},
+        'properties': {'quadkey': quadkey, value: number},
+    } for quadkey, number, w, s, e, n in zip(quadkeys, part[value].tolist(), west, south, east, north)]
+
+def _movement_features(part: pd.DataFrame, value: str) -> List[dict]:
+    coordinates = np.round(part[['start_lon', 'start_lat', 'end_lon', 'end_lat']].to_numpy(dtype=np.float64), 6).tolist()
+    lengths     = np.round(part['length_km'].to_numpy(dtype=np.float64), 3).tolist()
+    return [{
+        'type':       'Feature',
+        'geometry':   {'type': 'LineString', 'coordinates': [[x0, y0], [x1, y1]]},
+        'properties': {'start': start, 'end': end, value: number, 'length_km': length},
+    } for start, end, number, length, (x0, y0, x1, y1) in zip(part['start'].astype(str), part['end'].astype(str), part[value].tolist(), lengths, coordinates)]
+
+def _write_tiles(part: pd.DataFrame, kind: str, zoom: int, value: str, directory: str) -> int:
+    '''
+    Writes the map tiles of one time step and zoom (replacing earlier files of <directory>/<zoom>),
+    the features of tile z/x/y are the rows whose (start) quadkey starts with its quadkey.
+
+    Returns:
+        tiles: number of written files
+    '''
+    key      = part['node' if kind == 'population' else 'start'].astype(str).str[:zoom].to_numpy()
+    features = (_population_features if kind == 'population' else _movement_features)(part, value)
+    quadkeys, tile = np.unique(key, return_inverse=True)
+    order    = np.argsort(tile, kind='stable')
+    bounds   = np.searchsorted(tile[order], np.arange(len(quadkeys) + 1))
+    shutil.rmtree(Path(directory, str(zoom)), ignore_errors=True)
+    for x, y, low, high in zip(*tile_coordinates(quadkeys), bounds[:-1], bounds[1:]):
+        path = Path(directory, str(zoom), str(x), f'{y}.geojson')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp = path.with_name(path.name + '.tmp')
+        with open(temp, 'w', encoding='utf8') as file:
+            file.write(json.dumps({'type': 'FeatureCollection', 'features': [features[row] for row in order[low:high]]}, separators=(',', ':')))
+        os.replace(temp, path)
+    return len(quadkeys)
+
+def _levels(table: pd.DataFrame, kind: str, zooms: range, detail: int, level: int) -> dict:
+    '''
+    Data of every zoom: <table> aggregated to quadkey level min(zoom + detail, level), flows within a tile are left out.
+    Zooms sharing a data level share the aggregated table.
+    '''
+    aggregated = {}
+    for data_level in sorted({min(zoom + detail, level) for zoom in zooms}):
+        if(kind == 'population'):
+            part = con.space_aggregate_population_table(table, level - data_level)
+        else:
+            part = con.space_aggregate_movement_table(table, level - data_level, self_loops=False)
+            part = part[part['start'] != part['end']]
+        aggregated[data_level] = part
+    return {zoom: aggregated[min(zoom + detail, level)] for zoom in zooms}
+
+def _bounds(data: pd.DataFrame, kind: str) -> List[float]:
+    '''
+    Bounds (west, south, east, north) of all (start) tiles of <data>.
+    '''
+    quadkeys = pd.unique(data['node' if kind == 'population' else 'start'].astype(str).to_numpy())
+    if(len(quadkeys) == 0):
+        return []
+    west, south, east, north = tile_bounds(*tile_coordinates(quadkeys), len(quadkeys[0]))
+    return [round(float(bound), 6) for bound in (west.min(), south.min(), east.max(), north.max())]
+
+def _index(directory: Path, kind: str, zooms: range, detail: int, value: str, ranges: dict, bounds: List[float]):
+    '''
+    Writes <directory>/index.json for the viewer, listing every time step directory and widening the value ranges
+    of an existing index (pyramids built table by table).
+    '''
+    path = directory / 'index.json'
+    if(path.exists()):
+        with open(path, encoding='utf8') as file:
+            previous = json.load(file)
+        for zoom, (low, high) in previous.get('ranges', {}).items():
+            if(int(zoom) in ranges):
+                ranges[int(zoom)] = [min(low, ranges[int(zoom)][0]), max(high, ranges[int(zoom)][1])]
+        if(previous.get('bounds') and bounds):
+            bounds = [min(previous['bounds'][0], bounds[0]), min(previous['bounds'][1], bounds[1]), max(previous['bounds'][2], bounds[2]), max(previous['bounds'][3], bounds[3])]
+    index = {
+        'kind':       kind,
+        'format':     'geojson',
+        'tiles':      '{date_time}/{z}/{x}/{y}.geojson',
+        'date_times': sorted(path.name for path in directory.iterdir() if path.is_dir()),
+        'minzoom':    zooms.start,
+        'maxzoom':    zooms.stop - 1,
+        'detail':     detail,
+        'value':      value,
+        'bounds':     bounds,
+        'ranges':     {str(zoom): limits for zoom, limits in ranges.items()},
+    }
+    temp = directory / 'index.json.tmp'
+    with open(temp, 'w', encoding='utf8') as file:
+        json.dump(index, file, indent=1)
+    os.replace(temp, path)
+
+@instrument.timed('tiles')
+def pyramid(table: pd.DataFrame, directory: str, min_zoom: int = 2, max_zoom: int = None, detail: int = 3, value: str = None, jobs: int = None) -> int:
+    '''
+    Builds the GeoJSON tile pyramid of a population or movement table (all time steps).
+    Files of time steps already in <directory> are replaced, other time steps are kept.
+
+    Args:
+        table:     tile level population table (node, population) or movement table (start, end, n_crisis)
+        directory: root directory of the pyramid, files are written to <directory>/<kind>/...
+        min_zoom:  lowest zoom level
+        max_zoom:  highest zoom level (default: tile size of the data)
+        detail:    quadkey levels of the data below the zoom level (3: up to 64 tiles per map tile)
+        value:     value column (default: population, or n_crisis of movement tables)
+        jobs:      number of worker processes (1: in this process, default: number of CPUs)
+
+    Returns:
+        tiles: number of written files
+    '''
+    if('tile_size' not in table.columns):
+        instrument.error('Tile pyramids need tile level (quadkey) tables.')
+        return 0
+    kind  = _kind(table)
+    value = value or ('population' if kind == 'population' else 'n_crisis')
+    if(table.empty):
+        return 0
+    level = int(table['tile_size'].max())
+    zooms = range(max(min_zoom, 0), min(max_zoom or level, level) + 1)
+    root  = Path(directory, kind)
+
+    levels    = _levels(table, kind, zooms, detail, level)
+    arguments = []
+    ranges    = {}
+    for zoom, data in levels.items():
+        ranges[zoom] = [float(data[value].min()), float(data[value].max())] if len(data) else [0.0, 0.0]
+        for date_time, part in data.groupby('date_time', sort=True, observed=True):
+            arguments.append((part, kind, zoom, value, str(root / date_time.strftime(DATE_TIME_FORMAT))))
+    instrument.annotate(rows=len(table), jobs=len(arguments))
+
+    written = partition.map_jobs(_write_tiles, arguments, jobs)
+    if(root.exists()):
+        _index(root, kind, zooms, detail, value, ranges, _bounds(levels[zooms.start], kind))
+    return sum(count or 0 for count in written)
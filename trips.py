@@ -0,0 +1,185 @@
+import instrument
+import spatial
+import numpy    as np
+import pandas   as pd
+from   typing   import List, Tuple
+
+'''
+Trip-length (flow-distance) statistics of movement tables for all time steps in one pass: flow-weighted length_km
+histograms over fixed bins, quantiles and shares of short/long trips derived from them, and the radius of gyration
+of the trips of every origin. Histograms and gyration moments are plain sums, so results of different files, windows
+or worker processes are combined with merge (adding them) before quantiles, shares or radii are derived.
+
+Usage:
+    histogram = trips.histogram(mov_table)                       # one row per time step
+    trips.quantiles(histogram, [0.5, 0.9])
+    trips.shares(histogram, [5, 50])                             # < 5 km, 5 - 50 km, >= 50 km
+    histogram = trips.merge([trips.histogram(part, window='W') for part in parts])
+    gyration  = trips.gyration(mov_table)                        # one row per time step and origin
+'''
+
+# Fixed bin edges in km (lower edges, the last bin is open): 20 log-spaced bins per decade from 0.1 to 10000 km
+# plus the 1-2-5 series and 0, identical for every call so histograms can be added.
+BINS = np.unique(np.round(np.concatenate([[0.0], 10.0**np.linspace(-1, 4, 101), np.outer(10.0**np.arange(-1, 4), [1, 2, 5]).ravel()]), 6))
+
+MOMENTS = ['flow', 'flow_km', 'flow_km2', 'x', 'y', 'z']
+
+def _steps(table: pd.DataFrame, window: str = None) -> Tuple[np.ndarray, pd.DatetimeIndex]:
+    date_time = table['date_time']
+    if(window):
+        date_time = date_time.dt.to_period(window).dt.start_time
+    steps, times = pd.factorize(date_time, sort=True)
+    return steps.astype(np.int64), pd.DatetimeIndex(times, name='date_time')
+
+def _groups(steps: np.ndarray, times: pd.DatetimeIndex, table: pd.DataFrame, by: str = None) -> Tuple[np.ndarray, pd.Index]:
+    '''
+    Group of every row (time step, or time step and origin) and the index of the groups.
+    '''
+    if(by is None):
+        return steps, times
+    nodes = table['start'].cat.categories
+    keys, group = np.unique(steps*len(nodes) + table['start'].cat.codes.to_numpy(), return_inverse=True)
+    return group, pd.MultiIndex.from_arrays([times[keys // len(nodes)], nodes[keys % len(nodes)]], names=['date_time', 'node'])
+
+@instrument.timed('trips')
+def histogram(table: pd.DataFrame, window: str = None, by: str = None, bins: np.ndarray = BINS, value: str = 'n_crisis') -> pd.DataFrame:
+    '''
+    Flow-weighted trip-length histogram of every time step (or window) of a movement table.
+
+    Args:
+        table:  movement table (construction.movement_table, administrative_movement_table or coarsened/rolled up tables)
+        window: sum time steps within windows of this period, e.g. 'D' (day), 'W' (week), 'M' (month)
+        by:     None (one histogram per time step) or 'start' (one per time step and origin)
+        bins:   lower bin edges in km, ascending from 0 (keep the default to merge histograms)
+        value:  weight column
+
+    Returns:
+        histogram: indexed by date_time (and node), one column per bin (lower edge in km), summed <value> per bin
+    '''
+    steps, times = _steps(table, window)
+    group, index = _groups(steps, times, table, by)
+    length = table['length_km'].to_numpy(dtype=np.float64)
+    weight = table[value].to_numpy(dtype=np.float64)
+    kept   = np.isfinite(length) & np.isfinite(weight)
+    column = np.clip(np.searchsorted(bins, length[kept], side='right') - 1, 0, len(bins) - 1)
+    counts = np.bincount(group[kept]*len(bins) + column, weight[kept], len(index)*len(bins))
+    instrument.annotate(rows=len(table), groups=len(index))
+    return pd.DataFrame(counts.reshape(len(index), len(bins)), index=index, columns=pd.Index(bins, name='length_km'))
+
+def merge(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    '''
+    Adds histograms (or gyration moments) of different files, windows or worker processes with the same bins.
+    '''
+    frames = [frame for frame in frames if frame is not None]
+    if(any(not frame.columns.equals(frames[0].columns) for frame in frames)):
+        instrument.error('Unable to merge histograms with different bins.')
+        return None
+    merged = pd.concat(frames)
+    return merged.groupby(level=list(range(merged.index.nlevels)), sort=True).sum()
+
+def quantiles(histogram: pd.DataFrame, q: List[float] = (0.1, 0.25, 0.5, 0.75, 0.9)) -> pd.DataFrame:
+    '''
+    Trip-length quantiles of histograms, linearly interpolated within a bin (lower edge of the open last bin).
+
+    Args:
+        histogram: output of histogram / merge
+        q:         quantiles between 0 and 1
+
+    Returns:
+        quantiles: indexed like <histogram>, one column per quantile (km, NaN without flows)
+    '''
+    edges  = histogram.columns.to_numpy(dtype=np.float64)
+    upper  = np.r_[edges[1:], np.inf]
+    counts = histogram.to_numpy(dtype=np.float64)
+    total  = counts.sum(axis=1)
+    cum    = np.cumsum(counts, axis=1)
+    rows   = np.arange(len(counts))
+    result = {}
+    for quantile in q:
+        target = quantile*total
+        column = np.argmax(cum >= target[:, None] - 1e-9*total[:, None], axis=1)
+        before = np.where(column > 0, cum[rows, column - 1], 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = np.clip(np.where(counts[rows, column] > 0, (target - before)/counts[rows, column], 0), 0, 1)
+        width  = np.where(np.isfinite(upper[column]), upper[column] - edges[column], 0)
+        result[quantile] = np.where(total > 0, edges[column] + share*width, np.nan)
+    return pd.DataFrame(result, index=histogram.index).rename_axis(columns='quantile')
+
+def shares(histogram: pd.DataFrame, thresholds: List[float] = (1, 10, 100)) -> pd.DataFrame:
+    '''
+    Shares of the flow of trips shorter than, between and longer than <thresholds> (km, must be bin edges).
+
+    Returns:
+        shares: indexed like <histogram>, columns '<t1', 't1-t2', ..., '>=tn' (NaN without flows)
+    '''
+    edges   = histogram.columns.to_numpy(dtype=np.float64)
+    missing = [threshold for threshold in thresholds if threshold not in edges]
+    if(missing):
+        instrument.error(f'Thresholds {missing} are no bin edges.')
+        return None
+    counts = histogram.to_numpy(dtype=np.float64)
+    total  = counts.sum(axis=1)
+    bounds = [0] + [int(np.searchsorted(edges, threshold)) for threshold in thresholds] + [len(edges)]
+    names  = [f'<{thresholds[0]:g}'] + [f'{low:g}-{high:g}' for low, high in zip(thresholds, thresholds[1:])] + [f'>={thresholds[-1]:g}']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return pd.DataFrame({name: counts[:, low:high].sum(axis=1)/np.where(total > 0, total, np.nan) for name, low, high in zip(names, bounds, bounds[1:])}, index=histogram.index)
+
+@instrument.timed('trips')
+def moments(table: pd.DataFrame, window: str = None, value: str = 'n_crisis') -> pd.DataFrame:
+    '''
+    Flow-weighted moments of the trips of every origin and time step (or window), the mergeable basis of radius_of_gyration.
+
+    Args:
+        table:  movement table with length_km (and end_lat, end_lon for the centre of mass)
+        window: sum time steps within windows of this period, e.g. 'D' (day), 'W' (week), 'M' (month)
+        value:  weight column
+
+    Returns:
+        moments: indexed by date_time, node (origin), columns flow (sum of weights), flow_km (weighted sum of length_km),
+                 flow_km2 (weighted sum of squared length_km), x, y, z (weighted sum of destination unit vectors)
+    '''
+    steps, times = _steps(table, window)
+    group, index = _groups(steps, times, table, 'start')
+    weight = np.nan_to_num(table[value].to_numpy(dtype=np.float64))
+    length = table['length_km'].to_numpy(dtype=np.float64)
+    known  = np.isfinite(length)
+    sums   = {
+        'flow':     np.bincount(group, weight, len(index)),
+        'flow_km':  np.bincount(group[known], (weight*length)[known], len(index)),
+        'flow_km2': np.bincount(group[known], (weight*length**2)[known], len(index)),
+    }
+    if('end_lat' in table.columns):
+        points = spatial._unit_vectors(table['end_lat'].to_numpy(), table['end_lon'].to_numpy())
+        for axis, name in enumerate('xyz'):
+            sums[name] = np.bincount(group, weight*points[:, axis], len(index))
+    instrument.annotate(rows=len(table), groups=len(index))
+    return pd.DataFrame(sums, index=index)
+
+def radius_of_gyration(moments: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Trip statistics per origin from (merged) moments.
+
+    Returns:
+        gyration: indexed like <moments>, columns flow, mean_length_km (flow-weighted mean trip length),
+                  rms_length_km (root mean square trip length, radius of gyration around the origin) and
+                  radius_km (radius of gyration around the flow-weighted centre of mass of the destinations,
+                  3D approximation exact for distances much smaller than the earth radius)
+    '''
+    flow = moments['flow'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gyration = pd.DataFrame({
+            'flow':           flow,
+            'mean_length_km': np.where(flow > 0, moments['flow_km']/flow, np.nan),
+            'rms_length_km':  np.where(flow > 0, np.sqrt(moments['flow_km2']/flow), np.nan),
+        }, index=moments.index)
+        if('x' in moments.columns):
+            centre = np.column_stack([moments[axis].to_numpy() for axis in 'xyz'])/flow[:, None]
+            gyration['radius_km'] = np.where(flow > 0, spatial.EARTH_RADIUS_KM*np.sqrt(np.clip(1 - np.sum(centre**2, axis=1), 0, None)), np.nan)
+    return gyration
+
+def gyration(table: pd.DataFrame, window: str = None, value: str = 'n_crisis') -> pd.DataFrame:
+    '''
+    Radius of gyration and trip lengths of every origin and time step (or window) of a movement table,
+    see moments and radius_of_gyration.
+    '''
+    return radius_of_gyration(moments(table, window, value))
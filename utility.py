@@ -1,7 +1,20 @@
+import gzip
+import io
 import pathlib
 import os
+import queue
+import threading
+import zipfile
 import pandas as pd
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, TextIO, Iterable, Iterator, Callable
+
+COMPRESSION_SUFFIXES = ('.gz', '.zst')
+
+# Sources read ahead by read_ahead (key: str(path), value: Future of the raw bytes), served by open_text
+_prefetched = {}
+_prefetched_lock = threading.Lock()
 
 def file_list(path: str, filetype: str = 'csv', key: str = None) -> List:
     '''
@@ -44,9 +57,7 @@ def check_for_missing_file(paths: str, show: bool = False) -> List[pd.Timestamp]
     '''
     timestamps = set()
     for path in paths:
-        date = path.name[-19:-9]
-        time = path.name[-8:-6]
-        timestamps.add(pd.Timestamp(date + ' '+ time))
+        timestamps.add(timestamp_from_name(path))
     
     missing = []
     current, end = min(timestamps), max(timestamps)
@@ -58,4 +69,298 @@ def check_for_missing_file(paths: str, show: bool = False) -> List[pd.Timestamp]
         print('Missing dates:')
         for date in missing:
             print(date)
-    return missing
\ No newline at end of file
+    return missing
+
+def timestamp_from_name(path: str) -> pd.Timestamp:
+    '''
+    Returns the timestamp encoded in a Facebook file (or archive member) name ending with 'YYYY-MM-DD TTTT.csv',
+    compression suffixes (.gz, .zst) are ignored.
+
+    Args:
+        path: str or pathlib.Path object of file or archive member
+
+    Returns:
+        timestamp: pandas.Timestamp
+    '''
+    name = source_name(path)
+    return pd.Timestamp(name[-15:-5] + ' ' + name[-4:-2])
+
+def source_name(path: str) -> str:
+    '''
+    Returns the file name of <path> without .csv and compression suffixes, e.g. 'XYZ_2020-03-26 0000'.
+    '''
+    name = pathlib.Path(path).name
+    for suffix in COMPRESSION_SUFFIXES + ('.csv',):
+        if(name.lower().endswith(suffix)):
+            name = name[:-len(suffix)]
+    return name
+
+def split_archive(path: str) -> Tuple[pathlib.Path, str]:
+    '''
+    Splits a path pointing into a .zip archive, e.g. 'export.zip/folder/XYZ_2020-03-26 0000.csv', into archive and member.
+
+    Args:
+        path: str or pathlib.Path object
+
+    Returns:
+        archive: path of the .zip archive (or <path> itself if it does not point into an archive)
+        member:  name of the archive member (None if <path> does not point into an archive)
+    '''
+    path = pathlib.Path(path)
+    for parent in path.parents:
+        if(parent.suffix.lower() == '.zip' and parent.is_file()):
+            return parent, path.relative_to(parent).as_posix()
+    return path, None
+
+def data_files(path: str, key: str = None) -> List[pathlib.Path]:
+    '''
+    Lists all .csv sources in directory at <path>: plain .csv files, compressed .csv.gz/.csv.zst files
+    and .csv members of .zip archives (as paths pointing into the archive, e.g. 'export.zip/XYZ_2020-03-26 0000.csv').
+    All of them can be passed to the construction loaders without extraction.
+
+    Args:
+        path: path pointing to a file directory
+        key:  file name search key
+
+    Returns:
+        files: sorted list of pathlib.Path objects
+    '''
+    files = []
+    for file in pathlib.Path(path).iterdir():
+        name = file.name.lower()
+        if(name.endswith('.zip')):
+            with zipfile.ZipFile(file) as archive:
+                files.extend(pathlib.Path(file, member) for member in archive.namelist() if member.lower().endswith('.csv'))
+        elif(name.endswith('.csv') or any(name.endswith('.csv' + suffix) for suffix in COMPRESSION_SUFFIXES)):
+            files.append(file)
+    if(key):
+        files = [file for file in files if key in file.name]
+    return sorted(files, key=lambda file: source_name(file))
+
+def fingerprint(path: str) -> Dict:
+    '''
+    Returns size and modification time of a file, or size and CRC of an archive member (used to detect changed sources).
+    '''
+    archive, member = split_archive(path)
+    if(member is None):
+        stat = archive.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    with zipfile.ZipFile(archive) as zip_file:
+        info = zip_file.getinfo(member)
+    return {'size': info.file_size, 'crc': info.CRC}
+
+def open_text(path: str, encoding: str = 'utf8', prefetch: bool = True, chunk_size: int = 1 << 20, buffer: int = 8) -> TextIO:
+    '''
+    Opens a .csv source as text stream: plain files, .gz and .zst (requires package zstandard) compressed files
+    and members of .zip archives (see split_archive).
+    Compressed sources are decompressed on a background thread into a bounded buffer, so decompression overlaps with parsing.
+    Sources fetched by an active read_ahead are served from memory.
+
+    Args:
+        path:       str or pathlib.Path object
+        encoding:   text encoding
+        prefetch:   decompress on a background thread
+        chunk_size: size of decompressed chunks in bytes
+        buffer:     maximum number of buffered chunks
+
+    Returns:
+        stream: text stream (use as context manager)
+    '''
+    archive, member = split_archive(path)
+    suffix = archive.suffix.lower()
+
+    closers = []
+    data    = _fetched(path)
+    if(data is not None):
+        raw = io.BytesIO(data)
+        if(member is not None or suffix not in COMPRESSION_SUFFIXES):
+            return io.TextIOWrapper(raw, encoding=encoding, newline='')
+        if(suffix == '.gz'):
+            stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        else:
+            import zstandard
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    elif(member is not None):
+        zip_file = zipfile.ZipFile(archive)
+        closers.append(zip_file)
+        stream = zip_file.open(member)
+    elif(suffix == '.gz'):
+        stream = gzip.open(archive, 'rb')
+    elif(suffix == '.zst'):
+        import zstandard
+        raw = open(archive, 'rb')
+        closers.append(raw)
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    else:
+        return open(archive, encoding=encoding, newline='')
+
+    if(prefetch):
+        stream = io.BufferedReader(_PrefetchReader(stream, closers, chunk_size, buffer), buffer_size=chunk_size)
+    else:
+        stream = io.BufferedReader(_ClosingReader(stream, closers), buffer_size=chunk_size)
+    return io.TextIOWrapper(stream, encoding=encoding, newline='')
+
+class _ClosingReader(io.RawIOBase):
+    '''
+    Raw binary stream closing additional resources (e.g. the zip archive) together with the stream.
+    '''
+    def __init__(self, stream, closers: List):
+        self._stream  = stream
+        self._closers = closers
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if(not self.closed):
+            self._stream.close()
+            for closer in self._closers:
+                closer.close()
+        super().close()
+
+class _PrefetchReader(_ClosingReader):
+    '''
+    Raw binary stream reading (decompressing) <stream> on a background thread into a bounded queue of chunks.
+    '''
+    def __init__(self, stream, closers: List, chunk_size: int, buffer: int):
+        super().__init__(stream, closers)
+        self._queue      = queue.Queue(maxsize=buffer)
+        self._stop       = threading.Event()
+        self._chunk      = memoryview(b'')
+        self._eof        = False
+        self._chunk_size = chunk_size
+        self._thread     = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        while(not self._stop.is_set()):
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _fill(self):
+        try:
+            while(not self._stop.is_set()):
+                chunk = self._stream.read(self._chunk_size)
+                self._put(chunk)
+                if(not chunk):
+                    return
+        except Exception as exception:
+            self._put(exception)
+
+    def readinto(self, buffer) -> int:
+        if(not self._chunk and not self._eof):
+            item = self._queue.get()
+            if(isinstance(item, Exception)):
+                raise item
+            self._eof   = not item
+            self._chunk = memoryview(item)
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if(not self.closed):
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+def _fetch(path: str) -> bytes:
+    '''
+    Reads the raw bytes of a source (compressed files as stored, archive members decompressed).
+    '''
+    archive, member = split_archive(path)
+    if(member is not None):
+        with zipfile.ZipFile(archive) as zip_file:
+            return zip_file.read(member)
+    with open(archive, 'rb') as file:
+        return file.read()
+
+def _stored_size(path: str) -> int:
+    archive, member = split_archive(path)
+    try:
+        if(member is not None):
+            with zipfile.ZipFile(archive) as zip_file:
+                return zip_file.getinfo(member).file_size
+        return archive.stat().st_size
+    except (OSError, KeyError):
+        return 0
+
+def _fetched(path: str) -> bytes:
+    '''
+    Raw bytes of <path> if it is read ahead (waits for the read to finish), None otherwise.
+    '''
+    with _prefetched_lock:
+        future = _prefetched.get(str(path))
+    return future.result() if future is not None else None
+
+def read_ahead(items: Iterable, ahead: int = 4, max_bytes: int = 512 << 20, locate: Callable = None) -> Iterator:
+    '''
+    Yields <items> (sources, or objects holding one, see <locate>) in order while the next <ahead> sources are read into
+    memory on background threads, so disk or network latency overlaps with parsing the current source. open_text serves
+    read-ahead sources from memory, so all loaders (construction, validate, rki) profit without changes.
+    Buffered data is bounded by <max_bytes> (at least the current source is always read) and released as soon as the
+    caller moves on to the next item. Sources already read ahead by an enclosing read_ahead are not read twice.
+
+    Args:
+        items:     sources (str or pathlib.Path objects)
+        ahead:     maximum number of sources read ahead (number of background threads)
+        max_bytes: maximum size of buffered sources (sizes as stored)
+        locate:    function returning the source of an item (default: the item itself)
+
+    Returns:
+        items: generator of <items>
+
+    Usage:
+        graphs = [construction.movement_graph(path) for path in utility.read_ahead(files)]
+    '''
+    items    = list(items)
+    locate   = locate or (lambda item: item)
+    keys     = [str(locate(item)) for item in items]
+    pending  = deque()
+    buffered = 0
+    owned    = set()
+    executor = ThreadPoolExecutor(max_workers=max(1, ahead), thread_name_prefix='read_ahead')
+
+    def submit(index: int) -> bool:
+        with _prefetched_lock:
+            if(keys[index] in _prefetched):
+                return False
+            _prefetched[keys[index]] = executor.submit(_fetch, locate(items[index]))
+            owned.add(keys[index])
+        return True
+
+    try:
+        scheduled = 0
+        for index, item in enumerate(items):
+            while(scheduled < len(items) and scheduled <= index + ahead):
+                size = _stored_size(locate(items[scheduled]))
+                if(scheduled > index and buffered + size > max_bytes):
+                    break
+                size = size if submit(scheduled) else 0
+                pending.append((scheduled, size))
+                buffered  += size
+                scheduled += 1
+            yield item
+            while(pending and pending[0][0] <= index):
+                done, size = pending.popleft()
+                buffered -= size
+                with _prefetched_lock:
+                    if(keys[done] in owned):
+                        _prefetched.pop(keys[done], None)
+                        owned.discard(keys[done])
+    finally:
+        with _prefetched_lock:
+            for key in owned:
+                future = _prefetched.pop(key, None)
+                if(future is not None):
+                    future.cancel()
+        executor.shutdown(wait=True)
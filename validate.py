@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import instrument
+import settings
+import utility
+import numpy    as np
+import pandas   as pd
+from   pathlib  import Path
+from   typing   import List, Dict, Tuple
+
+'''
+Validation stage of the Facebook loaders: every column of a file is checked at once (types, lat/lon ranges, non-negative counts,
+quadkey syntax, tile size consistency) instead of parsing row by row. Invalid rows are moved to a quarantine file
+<quarantine>/<name>_<hash>.csv (all columns as in the source plus line number and reasons) with per-file counts in
+<quarantine>/<name>_<hash>.counts.json, <hash> is derived from the full source path so equally named files of different
+directories or archives are kept apart. The valid rows are processed as usual. The quarantine directory is settings.paths['quarantine'] (no files are written if it is not set).
+'''
+
+DATE_TIME_FORMAT = '%Y-%m-%d %H%M'
+
+LAT_COLUMNS      = ['lat', 'start_lat', 'end_lat']
+LON_COLUMNS      = ['lon', 'start_lon', 'end_lon']
+COUNT_COLUMNS    = ['n_crisis', 'length_km']
+INTEGER_COLUMNS  = ['tile_size', 'start_polygon_id', 'end_polygon_id']
+QUADKEY_COLUMNS  = ['quadkey', 'start_quadkey', 'end_quadkey']
+OPTIONAL_COLUMNS = ['n_baseline', 'n_difference', 'percent_change', 'z_score', 'clipped_z_score']
+
+def _numeric(column: pd.Series) -> pd.Series:
+    if(pd.api.types.is_numeric_dtype(column)):
+        return column
+    return pd.to_numeric(column.where(column != ''), errors='coerce')
+
+def checks(frame: pd.DataFrame, integers: List[str] = []) -> Dict[str, np.ndarray]:
+    '''
+    Vectorized checks of all known columns of <frame> (values as str, or already parsed numbers with NaN for empty fields).
+
+    Args:
+        frame:    DataFrame of str or parsed values
+        integers: further columns which must hold integers (e.g. n_crisis of movement files)
+
+    Returns:
+        checks: dict of check name ('<column>: <problem>') and boolean mask of failing rows
+    '''
+    failed  = {}
+    columns = set(frame.columns)
+    if('date_time' in columns):
+        failed['date_time: format'] = pd.to_datetime(frame['date_time'], format=DATE_TIME_FORMAT, errors='coerce').isna().to_numpy()
+    for column in columns.intersection(LAT_COLUMNS + LON_COLUMNS):
+        value = _numeric(frame[column])
+        limit = 90 if column in LAT_COLUMNS else 180
+        failed[f'{column}: range'] = ~value.between(-limit, limit).to_numpy()
+    for column in columns.intersection(COUNT_COLUMNS):
+        failed[f'{column}: negative or missing'] = ~(_numeric(frame[column]) >= 0).to_numpy()
+    for column in columns.intersection(INTEGER_COLUMNS + list(integers)):
+        value = _numeric(frame[column])
+        failed[f'{column}: integer'] = ~(value == value.round()).to_numpy()
+    for column in columns.intersection(OPTIONAL_COLUMNS):
+        if(not pd.api.types.is_numeric_dtype(frame[column])):
+            failed[f'{column}: number'] = ((frame[column] != '') & _numeric(frame[column]).isna()).to_numpy()
+    if('n_baseline' in columns):
+        failed['n_baseline: negative'] = (_numeric(frame['n_baseline']) < 0).to_numpy()
+
+    quadkeys = [column for column in QUADKEY_COLUMNS if column in columns]
+    for column in quadkeys:
+        failed[f'{column}: syntax'] = ~frame[column].str.fullmatch('[0-3]+').to_numpy(dtype=bool, na_value=False)
+    if(quadkeys and 'tile_size' in columns):
+        tile_size = _numeric(frame['tile_size'])
+        for column in quadkeys:
+            failed[f'{column}: tile size'] = (frame[column].str.len() != tile_size).to_numpy()
+    elif(quadkeys and len(frame)):
+        # Without tile_size column (population files) all quadkeys of a file have the most frequent length.
+        length = frame[quadkeys[0]].str.len()
+        failed[f'{quadkeys[0]}: tile size'] = (length != length.mode().iloc[0]).to_numpy()
+    return failed
+
+def split(frame: pd.DataFrame, integers: List[str] = []) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    Splits <frame> (see checks) into valid and invalid rows, see checks.
+
+    Returns:
+        valid:   rows passing all checks
+        invalid: failing rows with additional columns line (line number in the source file) and reason (failed checks)
+    '''
+    failed = checks(frame, integers)
+    bad    = np.zeros(len(frame), dtype=bool)
+    for mask in failed.values():
+        bad |= mask
+    if(not bad.any()):
+        return frame, frame.iloc[:0].assign(line=pd.Series(dtype=np.int64), reason=pd.Series(dtype=str))
+
+    reason = pd.Series('', index=frame.index[bad])
+    for name, mask in failed.items():
+        reason[mask[bad]] += name + '; '
+    invalid = frame[bad].copy()
+    invalid.insert(0, 'line', np.flatnonzero(bad) + 2)
+    invalid.insert(1, 'reason', reason.str[:-2])
+    return frame[~bad], invalid
+
+def quarantine_name(path: str) -> str:
+    '''
+    Name of the quarantine files of source <path>: its source name and a short hash of its absolute path.
+    '''
+    return f'{utility.source_name(path)}_{hashlib.sha1(str(Path(path).absolute()).encode("utf8")).hexdigest()[:8]}'
+
+def _original(invalid: pd.DataFrame, path: str) -> pd.DataFrame:
+    '''
+    Rows of <invalid> (see split) with all columns of the source <path> as written in the file.
+    '''
+    with utility.open_text(path) as csvfile:
+        frame = pd.read_csv(csvfile, dtype=str, keep_default_na=False)
+    original = frame.iloc[invalid['line'].to_numpy() - 2].reset_index(drop=True)
+    original.insert(0, 'line', invalid['line'].to_numpy())
+    original.insert(1, 'reason', invalid['reason'].to_numpy())
+    return original
+
+def quarantine(invalid: pd.DataFrame, path: str, rows: int, directory: str = None):
+    '''
+    Writes the invalid rows of source <path> (original values of all columns) to <directory>/<name>.csv and their counts
+    and source path to <directory>/<name>.counts.json, <name> see quarantine_name.
+    Existing files of the same source are replaced (or removed if the source has no invalid rows any more).
+
+    Args:
+        invalid:   output of split
+        path:      source file
+        rows:      number of rows of the source file
+        directory: quarantine directory (default: settings.paths['quarantine'], nothing is written if not set)
+    '''
+    directory = directory or settings.paths.get('quarantine')
+    if(not directory):
+        return
+    name   = quarantine_name(path)
+    target = Path(directory, f'{name}.csv')
+    counts = Path(directory, f'{name}.counts.json')
+    if(invalid.empty):
+        for file in (target, counts):
+            if(file.exists()):
+                file.unlink()
+        return
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    reasons = invalid['reason'].str.split('; ').explode().value_counts()
+    temp = target.with_name(target.name + '.tmp')
+    _original(invalid, path).to_csv(temp, index=False)
+    os.replace(temp, target)
+    temp = counts.with_name(counts.name + '.tmp')
+    with open(temp, 'w', encoding='utf8') as file:
+        json.dump({'file': str(Path(path).absolute()), 'rows': rows, 'quarantined': len(invalid), 'reasons': {reason: int(count) for reason, count in reasons.items()}}, file, indent=1)
+    os.replace(temp, counts)
+
+def _read(path: str, columns: Dict, typed: bool) -> pd.DataFrame:
+    dtype     = {column: dtype if typed else str for column, dtype in columns.items()}
+    na_values = {column: [''] for column, dtype in columns.items() if typed and dtype not in (str, 'category') and np.issubdtype(dtype, np.floating)}
+    with utility.open_text(path) as csvfile:
+        return pd.read_csv(csvfile, usecols=list(columns), dtype=dtype, keep_default_na=False, na_values=na_values)
+
+def read_valid(path: str, columns: Dict, directory: str = None) -> Tuple[pd.DataFrame, int]:
+    '''
+    Reads <columns> of a Facebook .csv source, validates them and quarantines invalid rows.
+    The file is parsed with the final dtypes first (empty float fields become NaN), only if that fails
+    (non-numeric values, empty integers) it is parsed again as str to find the offending rows.
+
+    Args:
+        path:      source file (plain, compressed or archive member, see utility.open_text)
+        columns:   dict of required column name and dtype (integer dtypes are checked for integer values)
+        directory: quarantine directory (default: settings.paths['quarantine'])
+
+    Returns:
+        valid:       valid rows (parsed, or str with empty fields as '', see convert)
+        quarantined: number of invalid rows
+    '''
+    integers = [column for column, dtype in columns.items() if dtype not in (str, 'category') and np.issubdtype(dtype, np.integer)]
+    try:
+        frame = _read(path, columns, typed=True)
+    except ValueError:
+        frame = _read(path, columns, typed=False)
+    valid, invalid = split(frame, integers)
+    quarantine(invalid, path, len(frame), directory)
+    if(len(invalid)):
+        instrument.error(f'{len(invalid)} of {len(frame)} rows of {path} failed validation and were quarantined.', file=str(path), quarantined=len(invalid))
+    return valid, len(invalid)
+
+def convert(frame: pd.DataFrame, columns: Dict) -> pd.DataFrame:
+    '''
+    Converts the validated columns of read_valid to <columns> (name: dtype, column order of <frame>), empty optional numbers become NaN.
+    '''
+    converted = {}
+    for column in frame.columns:
+        dtype = columns[column]
+        if(dtype is str or dtype == 'category'):
+            converted[column] = frame[column].astype(dtype) if dtype == 'category' else frame[column]
+        else:
+            converted[column] = _numeric(frame[column]).astype(dtype)
+    return pd.DataFrame(converted, index=frame.index).reset_index(drop=True)
+
+def quarantine_counts(directory: str = None) -> pd.DataFrame:
+    '''
+    Collects the per-file counts of the quarantine <directory> (default: settings.paths['quarantine']).
+
+    Returns:
+        counts: one row per source file with columns file, rows, quarantined and one column per failed check
+    '''
+    directory = directory or settings.paths.get('quarantine')
+    records   = []
+    for path in sorted(Path(directory).glob('*.counts.json')) if directory else []:
+        with open(path, encoding='utf8') as file:
+            entry = json.load(file)
+        records.append({'file': entry['file'], 'rows': entry['rows'], 'quarantined': entry['quarantined'], **entry['reasons']})
+    counts = pd.DataFrame(records, columns=['file', 'rows', 'quarantined'] if not records else None).fillna(0)
+    return counts.astype({column: np.int64 for column in counts.columns if column != 'file'})